@@ -0,0 +1,188 @@
+#Benchmark of the preprocessing and training scripts on synthetic data (generate_synthetic_data.py) of different sizes.
+#For each population size, the synthetic registers are generated and the following stages are run as separate processes:
+#study population, infectious disease and marriage variables (create_variables_from_inf_diseases_and_marriage.py),
+#relatives' vaccination status (the notebook section run by preprocessing_pipeline.py), merging and splitting the variable files
+#(merge_sorted_variable_files.py) and a small xgboost_training_skopt.py run. The wall time and peak memory (max RSS) of each
+#stage are written into a csv file, which can be compared to the results of an earlier run with --baseline to catch
+#performance regressions.
+import pandas as pd
+import numpy as np
+import os
+import shutil
+import subprocess
+import sys
+import hashlib
+import argparse
+
+from time import time
+
+from preprocessing_pipeline import default_stages,resolve,PathMap,DATA,PROCESSED,SCRIPT_DIR
+from study_id_index import StudyIDIndex
+
+#output files checked after each stage, files with one row per study ID are checked against the study ID index
+STAGE_OUTPUTS = {'study_ids':['vaccination_project_study_ids_082022.csv','vaccination_project_infectious_diseases_042022_COVID+_only.csv'],
+                 'infectious':['vaccination_project_infectious_diseases_082022.csv'],'marriage':['vaccination_project_marriage_082022.csv'],
+                 'relatives':['vaccination_project_relative_vaccination_status_082022.csv'],
+                 'study_variables':['synthetic_variables_wide.csv','vaccination_outcome_082022.csv'],'merge':['combined.csv']}
+NOT_PER_ID = ['vaccination_project_study_ids_082022.csv','vaccination_project_infectious_diseases_042022_COVID+_only.csv']
+
+def run_measured(command,logname):
+    #run a command, return its exit code, wall time (s) and peak memory (GB) of the process
+    start = time()
+    #scripts outside of this directory (the notebook sections) import the modules of this directory
+    env = dict(os.environ,PYTHONPATH=os.pathsep.join([SCRIPT_DIR]+([os.environ['PYTHONPATH']] if 'PYTHONPATH' in os.environ else [])))
+    with open(logname,'wt') as log:
+        process = subprocess.Popen(command,cwd=SCRIPT_DIR,env=env,stdout=log,stderr=subprocess.STDOUT)
+        _,status,usage = os.wait4(process.pid,0)
+    #ru_maxrss is in kilobytes on Linux
+    return os.waitstatus_to_exitcode(status),time()-start,usage.ru_maxrss/1e6
+
+def benchmark_commands(outdir,n_ids,args):
+    #(stage name, command) pairs of one population size, the data files are under outdir
+    data = os.path.join(outdir,'data','')
+    path_map = PathMap([(DATA,data),(PROCESSED,os.path.join(outdir,'processed_data',''))])
+    stages = {s['name']:s for s in default_stages()}
+    python = sys.executable
+    commands = [('generate',[python,'generate_synthetic_data.py','--outdir',outdir,'--n_ids',str(n_ids),'--seed',str(args.seed)])]
+    for name in ['study_ids','infectious','marriage']:
+        commands.append((name,[python if arg=='python' else arg for arg in resolve(stages[name],{},path_map)['command']]))
+    #the notebook section is written into a script file as in preprocessing_pipeline.py
+    relatives_script = os.path.join(outdir,'relatives.py')
+    with open(relatives_script,'wt') as outfile: outfile.write(resolve(stages['relatives'],{},path_map)['source'])
+    commands.append(('relatives',[python,relatives_script]))
+    commands.append(('study_variables',[python,'generate_synthetic_data.py','--outdir',outdir,'--study_variables','--n_vars',str(args.n_vars),'--seed',str(args.seed)]))
+    #all variable files are written in the order of the study ID codes, so they do not need to be sorted before merging
+    infiles = [data+fname for fname in ['vaccination_project_infectious_diseases_082022.csv','vaccination_project_marriage_082022.csv',
+                                        'vaccination_project_relative_vaccination_status_082022.csv','synthetic_variables_wide.csv','vaccination_outcome_082022.csv']]
+    train,test = data+'combined_train.'+args.outformat,data+'combined_test.'+args.outformat
+    commands.append(('merge',[python,'merge_sorted_variable_files.py','--infiles']+infiles+['--outfile',data+'combined.csv','--trainfile',train,'--testfile',test,
+                              '--outformat',args.outformat]))
+    if not args.skip_xgb:
+        commands.append(('xgboost',[python,'xgboost_training_skopt.py','--outdir',os.path.join(outdir,''),'--varname','benchmark','--allvars',data+'benchmark_allvars.txt',
+                                    '--trainfile',train,'--testfile',test,'--nproc',str(args.nproc),'--niter',str(args.niter),'--n_estimators']+args.n_estimators+
+                                    ['--max_depth']+args.max_depth+['--n_bootstraps',str(args.n_bootstraps)]))
+    return commands
+
+def write_allvars(fname,data):
+    #all variables of the merged file except the ID and the date of the first vaccination are used in the xgboost model
+    with open(data+'combined.csv','rt') as infile: header = infile.readline().strip().split(',')
+    with open(fname,'wt') as outfile: outfile.write(','.join([col for col in header if col not in ['FINREGISTRYID','first_visit']])+'\n')
+
+def check_outputs(stage,data):
+    #number of rows and checksum of each output file of the stage, and a description of the problem if a file with one row per
+    #study ID does not have exactly the study IDs in the order of the codes
+    checks = []
+    for fname in STAGE_OUTPUTS.get(stage,[]):
+        with open(data+fname,'rb') as infile: content = infile.read()
+        if fname=='vaccination_project_study_ids_082022.csv': rows = content.count(b',')+1
+        else: rows = content.count(b'\n')-1
+        problem = ''
+        if fname not in NOT_PER_ID:
+            study_ids = StudyIDIndex.load(data+'vaccination_project_study_ids_082022.csv').ids
+            ids = pd.read_csv(data+fname,usecols=[0],dtype=str).iloc[:,0].values
+            if len(ids)!=len(study_ids): problem = str(len(ids))+" rows, "+str(len(study_ids))+" study IDs"
+            elif not np.array_equal(ids,study_ids): problem = "IDs differ from the study IDs"
+        checks.append([stage,fname,rows,hashlib.sha256(content).hexdigest(),problem])
+    return checks
+
+def compare_to_reference(outputs,reference):
+    #output files whose checksum differs from an earlier run with the same population size
+    merged = outputs.merge(reference,on=['n_ids','stage','file'],suffixes=('','_reference'))
+    return merged.loc[merged['sha256']!=merged['sha256_reference']]
+
+def check_missing_values(infectious_file):
+    #the infectious disease records selected by include_in_time_window must not depend on how the missing recording weeks and
+    #sampling dates are represented: None/NaN (read_feather, astype(str) in pandas>=3) or the string 'None' (astype(str) in pandas<3)
+    from create_variables_from_inf_diseases_and_marriage import include_in_time_window
+    raw = pd.read_feather(infectious_file,columns=['recording_week','sampling_date'])
+    as_strings = raw.astype(object).where(raw.notna(),'None')
+    return all((include_in_time_window(df,first_year)==include_in_time_window(as_strings,first_year)).all()
+               for df in [raw,raw.astype(str)] for first_year in [2020,None])
+
+def compare_to_baseline(results,baseline,tolerance):
+    #stages whose wall time or peak memory is more than tolerance times the baseline
+    merged = results.merge(baseline,on=['n_ids','stage'],suffixes=('','_baseline'))
+    slower = merged['wall_time_s']>tolerance*merged['wall_time_s_baseline']
+    larger = merged['peak_rss_gb']>tolerance*merged['peak_rss_gb_baseline']
+    return merged.loc[slower | larger]
+
+def benchmark_preprocessing():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--outdir",help="Full path to the directory where the synthetic data, logs and results are written.",type=str)
+    parser.add_argument("--n_ids",help="Population sizes benchmarked (default=10000 100000).",type=int,nargs='+',default=[10000,100000])
+    parser.add_argument("--seed",help="Random seed of the synthetic data (default=42).",type=int,default=42)
+    parser.add_argument("--n_vars",help="Number of variables in the synthetic wide variable file (default=50).",type=int,default=50)
+    parser.add_argument("--outformat",help="Format of the training and test set files (default=csv).",type=str,default='csv',choices=['csv','parquet','feather'])
+    parser.add_argument("--nproc",help="Number of threads used by xgboost (default=4).",type=int,default=4)
+    parser.add_argument("--niter",help="Number of hyperparameter combinations sampled in the xgboost run (default=2).",type=int,default=2)
+    parser.add_argument("--n_estimators",help="n_estimators values of the xgboost run (default=50).",type=str,nargs='+',default=['50'])
+    parser.add_argument("--max_depth",help="max_depth values of the xgboost run (default=3).",type=str,nargs='+',default=['3'])
+    parser.add_argument("--n_bootstraps",help="Number of bootstrap samples in the evaluation of the xgboost run (default=100).",type=int,default=100)
+    parser.add_argument("--skip_xgb",help="Do not run the xgboost stage.",action='store_true')
+    parser.add_argument("--keep_data",help="Keep the synthetic data and output files of each population size (by default they are removed after the run).",action='store_true')
+    parser.add_argument("--baseline",help="Results file of an earlier run, stages that are more than --tolerance times slower or use more memory are reported (default=None).",type=str,default=None)
+    parser.add_argument("--tolerance",help="Allowed ratio of wall time and peak memory to the baseline (default=1.25).",type=float,default=1.25)
+    parser.add_argument("--reference",help="Output check file (benchmark_outputs.csv) of an earlier run with the same --seed and --n_vars, output files whose checksum differs are reported (default=None).",
+                        type=str,default=None)
+
+    args = parser.parse_args()
+
+    start = time()
+    os.makedirs(args.outdir,exist_ok=True)
+    resultfile = os.path.join(args.outdir,'benchmark_results.csv')
+    outputfile = os.path.join(args.outdir,'benchmark_outputs.csv')
+    rows,outputs = [],[]
+    output_columns = ['n_ids','stage','file','rows','sha256','problem']
+    for n_ids in args.n_ids:
+        outdir = os.path.join(args.outdir,'n'+str(n_ids))
+        logdir = os.path.join(outdir,'logs')
+        os.makedirs(logdir,exist_ok=True)
+        for stage,command in benchmark_commands(outdir,n_ids,args):
+            if stage=='xgboost': write_allvars(os.path.join(outdir,'data','benchmark_allvars.txt'),os.path.join(outdir,'data',''))
+            returncode,wall_time,peak_rss = run_measured(command,os.path.join(logdir,stage+'.log'))
+            rows.append([n_ids,stage,wall_time,peak_rss,returncode])
+            print(str(n_ids)+" IDs, "+stage+": "+str(round(wall_time,2))+" s, peak memory "+str(round(peak_rss,3))+" GB"+(", FAILED, see "+os.path.join(logdir,stage+'.log') if returncode!=0 else ""))
+            pd.DataFrame(rows,columns=['n_ids','stage','wall_time_s','peak_rss_gb','returncode']).to_csv(resultfile,index=False)
+            if returncode!=0: break
+            checks = [[n_ids]+check for check in check_outputs(stage,os.path.join(outdir,'data',''))]
+            outputs += checks
+            pd.DataFrame(outputs,columns=output_columns).to_csv(outputfile,index=False)
+            for check in checks:
+                if check[-1]!='': print(str(n_ids)+" IDs, "+stage+": "+check[2]+": "+check[-1])
+            if stage=='generate' and not check_missing_values(os.path.join(outdir,'processed_data','thl_infectious_diseases','infectious_diseases_2022-01-19.feather')):
+                print(str(n_ids)+" IDs: infectious disease records selected differently with None and 'None' as missing values")
+                rows.append([n_ids,'check_missing_values',0.0,0.0,1])
+                break
+        if not args.keep_data:
+            shutil.rmtree(os.path.join(outdir,'data'))
+            shutil.rmtree(os.path.join(outdir,'processed_data'))
+    results = pd.DataFrame(rows,columns=['n_ids','stage','wall_time_s','peak_rss_gb','returncode'])
+    outputs = pd.DataFrame(outputs,columns=output_columns).fillna('')
+    end = time()
+    print("Benchmark finished in "+str(end-start)+" s, results written to "+resultfile+" and "+outputfile)
+    failed = (results['returncode']!=0).any() or (outputs['problem']!='').any()
+    if args.reference is not None:
+        changed = compare_to_reference(outputs,pd.read_csv(args.reference,dtype={'problem':str}))
+        if len(changed)>0:
+            print("Output files that differ from the reference run:")
+            print(changed[['n_ids','stage','file','rows','rows_reference']].to_string(index=False))
+        else: print("All output files are identical to the reference run.")
+        failed = failed or len(changed)>0
+    if args.baseline is not None:
+        regressions = compare_to_baseline(results,pd.read_csv(args.baseline),args.tolerance)
+        if len(regressions)>0:
+            print("Stages more than "+str(args.tolerance)+" times slower or larger than in the baseline:")
+            print(regressions[['n_ids','stage','wall_time_s','wall_time_s_baseline','peak_rss_gb','peak_rss_gb_baseline']].to_string(index=False))
+        else: print("No regressions compared to the baseline.")
+        failed = failed or len(regressions)>0
+    if failed: sys.exit(1)
+
+if __name__=='__main__':
+    benchmark_preprocessing()
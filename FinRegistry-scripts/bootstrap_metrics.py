@@ -0,0 +1,103 @@
+#Bootstrap confidence intervals for AUC and AUPRC.
+#The scores are sorted only once, and each bootstrap resample is represented by the number of times each individual was drawn
+#(multinomial weights). The metrics of a batch of resamples are then computed together with cumulative sums over the sorted order,
+#which gives the same values as running sklearn's roc_auc_score and average_precision_score on each resample separately.
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+def sort_scores(y_true,y_score):
+    #sort the individuals by decreasing score
+    #returns the labels in sorted order, the last sorted position of each group of tied scores
+    #and the sorted position of each individual
+    y_true = np.asarray(y_true)
+    y_score = np.asarray(y_score,dtype=float).flatten()
+    order = np.argsort(-y_score,kind='mergesort')
+    y_sorted = (y_true[order]==1).astype(np.int64)
+    score_sorted = y_score[order]
+    group_end = np.r_[np.where(np.diff(score_sorted))[0],len(score_sorted)-1]
+    position = np.empty(len(order),dtype=np.int64)
+    position[order] = np.arange(len(order))
+    return y_sorted,group_end,position
+
+def resample_weights(indices,position):
+    #number of times each individual was drawn in each resample (rows of indices), in sorted order
+    nboot,n = indices.shape
+    offsets = (np.arange(nboot,dtype=np.int64)*n)[:,None]
+    return np.bincount((position[indices]+offsets).ravel(),minlength=nboot*n).reshape(nboot,n)
+
+def weighted_auc_auprc(weights,y_sorted,group_end):
+    #AUC and AUPRC for each row of weights (integer counts in sorted order)
+    #returns NaNs for resamples that contain only one class
+    #the counts of true and false positives are integers, so they are summed exactly
+    tps = np.cumsum(weights*y_sorted,axis=1)
+    fps = np.cumsum(weights,axis=1)-tps
+    if len(group_end)<weights.shape[1]: tps,fps = tps[:,group_end],fps[:,group_end]
+    zeros = np.zeros((len(weights),1),dtype=tps.dtype)
+    dtps = np.diff(tps,axis=1,prepend=zeros)
+    dfps = np.diff(fps,axis=1,prepend=zeros)
+    P,N = tps[:,-1],fps[:,-1]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        #area under the ROC curve with the trapezoidal rule, as in sklearn.metrics.auc
+        aucs = np.sum(dfps*(2*tps-dtps),axis=1)/(2.0*P*N)
+        #average precision = sum of precisions at each threshold weighted by the increase in recall,
+        #thresholds that were not drawn in the resample (tps+fps=0) do not increase recall and contribute 0
+        auprcs = np.sum(dtps*tps/np.maximum(tps+fps,1),axis=1)/P
+    valid = (P>0) & (N>0)
+    return np.where(valid,aucs,np.nan),np.where(valid,auprcs,np.nan)
+
+def draw_indices(n,nboot,seed,batch):
+    #resamples of batch number batch, drawn with a random generator of their own so that the
+    #result does not depend on how the batches are divided between the processes
+    rng = np.random.default_rng([seed,batch])
+    return rng.integers(0,n,size=(nboot,n))
+
+def legacy_indices(n,n_bootstraps,seed,batch_size):
+    #resamples drawn one at a time from np.random.RandomState(seed),
+    #this gives the same resamples as the bootstrap loop previously used in xgboost_training_skopt.py
+    rng = np.random.RandomState(seed)
+    for start in range(0,n_bootstraps,batch_size):
+        yield np.array([rng.randint(0,n,n) for i in range(min(batch_size,n_bootstraps-start))])
+
+#sorted scores shared with the worker processes
+_sorted = None
+
+def _init_worker(y_sorted,group_end,position):
+    global _sorted
+    _sorted = (y_sorted,group_end,position)
+
+def _batch_metrics(task):
+    #task is either an array of resampled indices or a tuple of (number of resamples,seed,batch number)
+    y_sorted,group_end,position = _sorted
+    indices = task if isinstance(task,np.ndarray) else draw_indices(len(y_sorted),*task)
+    return weighted_auc_auprc(resample_weights(indices,position),y_sorted,group_end)
+
+def bootstrap_auc_auprc(y_true,y_score,n_bootstraps=2000,seed=42,nproc=1,batch_size=None,legacy=False):
+    #compute AUC and AUPRC for n_bootstraps resamples of (y_true,y_score)
+    #resamples with only one class are rejected, so fewer than n_bootstraps values can be returned
+    #batches of batch_size resamples are computed at a time, by default so that a batch takes about 80MB per array,
+    #and spread over nproc processes if nproc>1
+    #legacy = draw the resamples sequentially from np.random.RandomState(seed) (as in the old bootstrap loop) instead of
+    #drawing each batch with its own generator inside the worker processes
+    #returns arrays of AUCs and AUPRCs
+    y_sorted,group_end,position = sort_scores(y_true,y_score)
+    n = len(y_sorted)
+    if batch_size is None: batch_size = max(1,min(n_bootstraps,10**7//n))
+    if legacy: tasks = legacy_indices(n,n_bootstraps,seed,batch_size)
+    else: tasks = [(min(batch_size,n_bootstraps-start),seed,i) for i,start in enumerate(range(0,n_bootstraps,batch_size))]
+    if nproc>1:
+        with ProcessPoolExecutor(max_workers=nproc,initializer=_init_worker,initargs=(y_sorted,group_end,position)) as executor:
+            results = list(executor.map(_batch_metrics,tasks))
+    else:
+        _init_worker(y_sorted,group_end,position)
+        results = [_batch_metrics(task) for task in tasks]
+    aucs = np.concatenate([r[0] for r in results])
+    auprcs = np.concatenate([r[1] for r in results])
+    keep = ~np.isnan(aucs)
+    return aucs[keep],auprcs[keep]
+
+def percentiles(values,levels=[5,95]):
+    #percentiles of the bootstrapped values at the given levels (0-100), taken as the value at index int(level/100*len(values))
+    #of the sorted values as in the original CI computation (5 and 95 = 90% confidence interval)
+    sorted_values = np.sort(values)
+    return [sorted_values[min(int(level*len(sorted_values)/100),len(sorted_values)-1)] for level in levels]
@@ -0,0 +1,143 @@
+#SHAP values of a trained XGBoost model (_best_xgb_model.pkl from xgboost_training_skopt.py) for all rows of a data file.
+#The file is read in chunks, and the SHAP values of each chunk are computed in a pool of processes either with xgboost's
+#native implementation (pred_contribs, exact TreeSHAP) or with shap.TreeExplainer. The SHAP values are written into a .npy file
+#that can be opened as a memory-mapped array (np.load(fname,mmap_mode='r')), and the mean |SHAP| of each predictor is
+#accumulated chunk by chunk, so that the full SHAP matrix is never held in memory.
+import pandas as pd
+import numpy as np
+import xgboost as xgb
+import csv
+import pickle
+import argparse
+
+from time import time
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+
+from xgboost_training_skopt import iter_chunks
+from stage_trace import peak_memory
+from merge_sorted_variable_files import count_rows
+
+def count_file_rows(fname):
+    #number of data rows in a csv, parquet or feather file
+    if fname.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(fname).metadata.num_rows
+    elif fname.endswith('.feather'):
+        import pyarrow as pa
+        reader = pa.ipc.open_file(fname)
+        return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    return count_rows(fname)
+
+#model and output file of the worker processes
+_worker = {}
+
+def _init_worker(model_file,shap_file,method,background,nthread):
+    model = pickle.load(open(model_file,'rb'))
+    if method=='native':
+        booster = model.get_booster()
+        booster.set_param({'nthread':nthread})
+        _worker['booster'] = booster
+    else:
+        import shap
+        if background is None: _worker['explainer'] = shap.TreeExplainer(model)
+        else: _worker['explainer'] = shap.TreeExplainer(model,data=background,feature_perturbation="interventional")
+    _worker['method'] = method
+    _worker['shap_file'] = shap_file
+
+def _shap_chunk(task):
+    #compute the SHAP values of one chunk, write them to rows start:start+len(X) of the output file
+    #and return the sums of |SHAP|, SHAP and SHAP^2 of each column
+    start,X = task
+    if _worker['method']=='native':
+        #the last column is the bias term (expected value of the margin)
+        values = _worker['booster'].predict(xgb.DMatrix(X),pred_contribs=True)
+    else:
+        explainer = _worker['explainer']
+        values = np.column_stack([explainer.shap_values(X),np.full(len(X),np.ravel(explainer.expected_value)[-1])])
+    out = np.load(_worker['shap_file'],mmap_mode='r+')
+    out[start:start+len(X)] = values
+    out.flush()
+    del(out)
+    values = values.astype(np.float64)
+    return len(X),np.abs(values).sum(axis=0),values.sum(axis=0),(values**2).sum(axis=0)
+
+def compute_shap_xgb():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--outdir",help="Full path to the output directory.",type=str)
+    parser.add_argument("--varname",help="Variable name, used as the prefix of the output files.",type=str,default='var')
+    parser.add_argument("--model",help="Full path to the saved model (_best_xgb_model.pkl).",type=str)
+    parser.add_argument("--allvars",help="Full path to the text file containing names of all variables used in the model.",type=str)
+    parser.add_argument("--infile",help="Full path to the file containing the samples to explain, e.g. the test set (.csv, .parquet or .feather).",type=str)
+    parser.add_argument("--nproc",help="Number of parallel processes used (default=32).",type=int,default=32)
+    parser.add_argument("--chunksize",help="Number of rows read in and explained at a time (default=20000).",type=int,default=20000)
+    parser.add_argument("--method",help="How the SHAP values are computed (default=native). native = xgboost's pred_contribs, treeexplainer = shap.TreeExplainer.",
+                        type=str,default="native",choices=['native','treeexplainer'])
+    parser.add_argument("--background",help="Number of rows from the first chunk used as the background data of an interventional TreeExplainer (default=0, path dependent TreeExplainer).",
+                        type=int,default=0)
+    parser.add_argument("--seed",help="Random seed used to draw the background rows (default=42).",type=int,default=42)
+
+    args = parser.parse_args()
+
+    start = time()
+    #read in the variables used by the model
+    with open(args.allvars,'rt') as infile:
+        r = csv.reader(infile,delimiter=',')
+        for row in r: all_vars = row
+
+    nrows = count_file_rows(args.infile)
+    chunks = iter_chunks(args.infile,all_vars,args.chunksize,['',' '])
+    first = next(chunks)
+    #the model was trained with the columns in the order they are in the data file
+    features = [col for col in first.columns if col!='COVIDVax']
+    print("Computing SHAP values for "+str(nrows)+" rows and "+str(len(features))+" predictors")
+    shap_file = args.outdir+args.varname+"_shap_values.npy"
+    out = np.lib.format.open_memmap(shap_file,mode='w+',dtype=np.float32,shape=(nrows,len(features)+1))
+    del(out)
+    with open(args.outdir+args.varname+"_shap_values_columns.txt",'wt') as outfile:
+        w = csv.writer(outfile,delimiter=',')
+        w.writerow(features+['BIAS'])
+
+    background = None
+    if args.method=='treeexplainer' and args.background>0:
+        rng = np.random.RandomState(args.seed)
+        X_first = first[features].to_numpy(dtype=float,na_value=np.nan)
+        background = X_first[rng.choice(len(X_first),min(args.background,len(X_first)),replace=False)]
+
+    #the chunks are read in by this process and explained by the workers, at most 2*nproc chunks are kept in memory at a time
+    sums = [0,0.0,0.0,0.0]
+    def add(result):
+        for i in range(len(sums)): sums[i] = sums[i]+result[i]
+    nthread = 1 if args.nproc>1 else 0
+    with ProcessPoolExecutor(max_workers=args.nproc,initializer=_init_worker,initargs=(args.model,shap_file,args.method,background,nthread)) as executor:
+        pending = []
+        row = 0
+        for df in chain([first],chunks):
+            X = df[features].to_numpy(dtype=np.float32,na_value=np.nan)
+            pending.append(executor.submit(_shap_chunk,(row,X)))
+            row += len(X)
+            if len(pending)>=2*args.nproc: add(pending.pop(0).result())
+            print(str(row)+" rows read in.")
+        for future in pending: add(future.result())
+    if row!=nrows: raise ValueError("Number of rows read in ("+str(row)+") differs from the number of rows counted ("+str(nrows)+")")
+
+    #mean SHAP values per predictor
+    n,abs_sum,value_sum,sq_sum = sums
+    df_pred_shaps = pd.DataFrame()
+    df_pred_shaps['predictor'] = features
+    df_pred_shaps['mean |SHAP|'] = abs_sum[:-1]/n
+    df_pred_shaps['std |SHAP|'] = np.sqrt(np.maximum(sq_sum[:-1]/n-(abs_sum[:-1]/n)**2,0))
+    df_pred_shaps['mean SHAP'] = value_sum[:-1]/n
+    df_pred_shaps.to_csv(args.outdir+args.varname+"_mean_SHAP_per_predictor.csv",index=False)
+    end = time()
+    print("SHAP values computed in "+str(end-start)+" s, peak memory usage "+str(peak_memory())+" GB")
+
+if __name__=='__main__':
+    compute_shap_xgb()
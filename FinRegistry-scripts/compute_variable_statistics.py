@@ -0,0 +1,154 @@
+#Prevalences and other statistics of each variable in the wide variable file, computed in one pass over the file.
+#Replaces the column group by column group reading of compute_variable_prevalences.md: the file is split into parts that are
+#scanned in parallel processes in chunks of rows, and the counts computed from each chunk are merged at the end.
+#The output file has the same columns as the prevalence file from compute_variable_prevalences.md
+#(columnID,index,isBinary,count_1,count_1_among_vaxxed,count_NA), followed by additional columns
+#count_1_among_unvaxxed,min,max,mean.
+import pandas as pd
+import numpy as np
+import csv
+import io
+import argparse
+
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+
+SKIP_VARS = ['FINREGISTRYID','COVIDVax']
+
+def chunk_statistics(df,columns):
+    #counts and other statistics of the given columns in one chunk of rows
+    #non-numeric columns (e.g. the date of the first vaccination) only get the counts of missing and non-missing values,
+    #their values are NaN in X
+    non_numeric = np.array([not pd.api.types.is_numeric_dtype(df[col]) for col in columns],dtype=bool)
+    missing = df[columns].isna().to_numpy()
+    X = np.full((len(df),len(columns)),np.nan)
+    X[:,~non_numeric] = df[[col for col,skip in zip(columns,non_numeric) if not skip]].to_numpy(dtype=float,na_value=np.nan)
+    y = df['COVIDVax'].to_numpy(dtype=float,na_value=np.nan)
+    isna = np.isnan(X)
+    positive = X>0
+    mins = np.fmin.reduce(X,axis=0)
+    maxs = np.fmax.reduce(X,axis=0)
+    return {'count':np.sum(~missing,axis=0),'count_NA':np.sum(missing,axis=0),'count_1':np.sum(positive,axis=0),'non_numeric':non_numeric,
+            'count_1_among_vaxxed':np.sum(positive[y==1],axis=0),'count_1_among_unvaxxed':np.sum(positive[y<1],axis=0),
+            'sum':np.nansum(X,axis=0),'min':mins,'max':maxs,
+            #a chunk has more than two distinct values if some values differ from both the minimum and the maximum
+            'more_than_two':np.any(~isna & (X!=mins) & (X!=maxs),axis=0),'values':[np.vstack([mins,maxs])]}
+
+def merge_statistics(a,b):
+    #combine the statistics of two sets of rows
+    if a is None: return b
+    if b is None: return a
+    merged = {key:a[key]+b[key] for key in ['count','count_NA','count_1','count_1_among_vaxxed','count_1_among_unvaxxed','sum','values']}
+    merged['min'] = np.fmin(a['min'],b['min'])
+    merged['max'] = np.fmax(a['max'],b['max'])
+    merged['more_than_two'] = a['more_than_two'] | b['more_than_two']
+    merged['non_numeric'] = a['non_numeric'] | b['non_numeric']
+    return merged
+
+def is_binary(stats):
+    #a variable is binary if it has at most two distinct values (not counting NAs)
+    #the distinct values of a variable are the union of the distinct values of each chunk
+    values = np.vstack(stats['values'])
+    binary = ~stats['more_than_two'] & ~stats['non_numeric']
+    for j in np.where(binary)[0]: binary[j] = len(np.unique(values[~np.isnan(values[:,j]),j]))<=2
+    return binary
+
+def csv_ranges(fname,nparts):
+    #split the data rows of a csv file into nparts byte ranges that start at the beginning of a line
+    with open(fname,'rb') as infile:
+        infile.readline()
+        first = infile.tell()
+        infile.seek(0,2)
+        size = infile.tell()
+        starts = [first]
+        for k in range(1,nparts):
+            infile.seek(max(first,first+k*(size-first)//nparts-1))
+            infile.readline()
+            if infile.tell()>starts[-1] and infile.tell()<size: starts.append(infile.tell())
+    return list(zip(starts,starts[1:]+[size]))
+
+def _scan_csv_range(task):
+    #statistics of the rows of a csv file between the byte offsets start and end, read chunksize rows at a time
+    fname,header,columns,start,end,chunksize = task
+    stats = None
+    with open(fname,'rb') as infile:
+        infile.seek(start)
+        while infile.tell()<end:
+            lines = []
+            while len(lines)<chunksize and infile.tell()<end: lines.append(infile.readline())
+            df = pd.read_csv(io.BytesIO(b''.join(lines)),header=None,names=header,usecols=columns+['COVIDVax'],delimiter=',')
+            stats = merge_statistics(stats,chunk_statistics(df,columns))
+    return stats
+
+def _scan_batch(task):
+    #statistics of one row group of a parquet file or one record batch of a feather file
+    fname,columns,i = task
+    if fname.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        df = pq.ParquetFile(fname).read_row_group(i,columns=columns+['COVIDVax']).to_pandas()
+    else:
+        import pyarrow as pa
+        df = pa.ipc.open_file(fname).get_batch(i).select(columns+['COVIDVax']).to_pandas()
+    return chunk_statistics(df,columns)
+
+def compute_variable_statistics():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--infile",help="Full path to the wide variable file (.csv, .parquet or .feather).",type=str)
+    parser.add_argument("--outfile",help="Full path to the output file.",type=str)
+    parser.add_argument("--nproc",help="Number of parallel processes used (default=32).",type=int,default=32)
+    parser.add_argument("--chunksize",help="Number of rows read in at a time by each process (default=20000).",type=int,default=20000)
+
+    args = parser.parse_args()
+
+    start = time()
+    if args.infile.endswith('.parquet') or args.infile.endswith('.feather'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if args.infile.endswith('.parquet'):
+            header = pq.read_schema(args.infile).names
+            nbatches = pq.ParquetFile(args.infile).num_row_groups
+        else:
+            reader = pa.ipc.open_file(args.infile)
+            header = reader.schema.names
+            nbatches = reader.num_record_batches
+        columns = [col for col in header if col not in SKIP_VARS]
+        tasks,scan = [(args.infile,columns,i) for i in range(nbatches)],_scan_batch
+    else:
+        #read in the header row
+        with open(args.infile,'rt') as infile: header = next(csv.reader(infile,delimiter=','))
+        columns = [col for col in header if col not in SKIP_VARS]
+        tasks = [(args.infile,header,columns,range_start,range_end,args.chunksize) for range_start,range_end in csv_ranges(args.infile,args.nproc)]
+        scan = _scan_csv_range
+    print(str(len(columns))+" variables, "+str(len(tasks))+" parts of the file scanned in parallel")
+
+    stats = None
+    with ProcessPoolExecutor(max_workers=args.nproc) as executor:
+        for part in executor.map(scan,tasks): stats = merge_statistics(stats,part)
+    binary = is_binary(stats)
+    with np.errstate(invalid='ignore',divide='ignore'): means = stats['sum']/stats['count']
+    #numeric statistics of non-numeric columns are written as NA
+    for key in ['min','max']: stats[key][stats['non_numeric']] = np.nan
+    means[stats['non_numeric']] = np.nan
+
+    #saving the results into a file
+    with open(args.outfile,'wt') as outfile:
+        w = csv.writer(outfile,delimiter=',')
+        w.writerow(['columnID','index','isBinary','count_1','count_1_among_vaxxed','count_NA','count_1_among_unvaxxed','min','max','mean'])
+        w.writerow(['FINREGISTRYID',0,'no','NA','NA',0,'NA','NA','NA','NA'])
+        for j,col in enumerate(columns):
+            if binary[j]: counts = [True,stats['count_1'][j],stats['count_1_among_vaxxed'][j]]
+            else: counts = [False,np.nan,np.nan]
+            extra = [stats['count_1_among_unvaxxed'][j] if binary[j] else np.nan,stats['min'][j],stats['max'][j],means[j]]
+            w.writerow([col,header.index(col)]+counts+[stats['count_NA'][j]]+extra)
+    end = time()
+    print("statistics of "+str(int(stats['count'][0]+stats['count_NA'][0]))+" rows computed in "+str(end-start)+" s")
+
+if __name__=='__main__':
+    compute_variable_statistics()
@@ -1,249 +1,291 @@
 from time import time
+import argparse
 import pandas as pd
-import csv
+import numpy as np
+from scipy.sparse import coo_matrix
+
+from study_id_index import StudyIDIndex
+from stage_trace import stage,peak_memory
+import stage_trace
+
+def parse_unique(col,pattern):
+    #parse each unique string value of col only once using the regular expression pattern
+    #with two integer groups and return the two groups as float arrays aligned with col (NaN if not parseable)
+    codes,uniques = pd.factorize(col)
+    parsed = pd.Series(uniques,dtype=object).str.extract(pattern).astype(float).values
+    #missing values of col get code -1, which points to the appended NaN row
+    parsed = np.vstack([parsed,[np.nan,np.nan]])
+    return parsed[codes,0],parsed[codes,1]
+
+def is_missing(col):
+    #missing values of a string column, either None/NaN or the string 'None'
+    #(astype(str) turns None into 'None' in pandas<3, but keeps it as NaN in pandas>=3)
+    return (col.isna() | col.str.contains('None',regex=False,na=True)).values.astype(bool)
+
+def include_in_time_window(df,first_year=None):
+    #columnar version of the rules used to select infectious disease records from the time window of interest
+    #returns a boolean mask with one value per row of df
+    #if recording_week (WW/YYYY) is available, the record is included if year is first_year...2020 or week<=43
+    #if recording_week is None, sampling_date (YYYY-MM-DD) is used and the record is included if the
+    #sampling date is between Jan/first_year and Oct/2021
+    #if also sampling_date is None, the record is included
+    #first_year=None means that there is no lower limit for the year
+    week_missing = is_missing(df['recording_week'])
+    date_missing = is_missing(df['sampling_date'])
+    week,week_year = parse_unique(df['recording_week'],r'^\s*(\d+)/(\d+)')
+    date_year,date_month = parse_unique(df['sampling_date'],r'^\s*(\d+)-(\d+)')
+    if first_year is None: first_year = -np.inf
+    
+    week_rule = ((week_year>=first_year) & (week_year<=2020)) | (week<=43)
+    date_rule = (date_year>=first_year) & ((date_year<2021) | ((date_year==2021) & (date_month<11)))
+    return np.where(week_missing,np.where(date_missing,True,date_rule),week_rule)
+
+def read_infectious_diseases(fname):
+    #read in the columns of interest
+    #ID = TNRO = column 1
+    #recording_week = column 25
+    #reporting_group = column 26
+    #sampling_date
+    with stage('read',data='infectious') as record:
+        df = pd.read_feather(fname,columns=['TNRO','recording_week','reporting_group','sampling_date'])
+        #missing values are written as 'None' with all pandas versions, as astype(str) did in pandas<3
+        for col in ['reporting_group','recording_week','sampling_date']: df[col] = df[col].where(df[col].notna(),'None').astype(str)
+        record['rows'] = len(df)
+    print(df.head())
+    return df
 
 ####################################################################
 #READ IN THE CURRENT STUDY POPULATION AND REMOVE DEATHS DURING 2020#
 ####################################################################
 
-#other exclusion criteria than deaths during 2020 and covid diagnoses have been applied to this file:
-fname = "/data/projects/vaccination_project/data/vaccination_project_minimalphenotype_082022.csv"
-study_ids = set(pd.read_csv(fname,usecols=['FINREGISTRYID'])['FINREGISTRYID'].unique())
-print("Number of initial study IDs: "+str(len(study_ids)))
-
-#remove people who died during 2020
-#read in IDs of people who have died before the end of year 2020
-death_name = "/data/processed_data/sf_death/thl2021_2196_ksyy_tutkimus.csv.finreg_IDsp"
-exclude_IDs = set()
-with open(death_name,'rt') as infile:
-    r = csv.reader(infile,delimiter=',')
-    for row in r:
-        ID = row[0]
-        if ID=='TNRO': continue
-        else: exclude_IDs.add(ID)
-
-study_ids = study_ids-exclude_IDs
-print("Number of IDs after removing deaths during 2020: "+str(len(study_ids))) #3255578 IDs
+def create_study_population(mpf_name,death_name,df,covid_positive_outname,idfile):
+    #other exclusion criteria than deaths during 2020 and covid diagnoses have been applied to the file mpf_name
+    with stage('read',data='minimal_phenotype') as record:
+        initial_index = StudyIDIndex(pd.read_csv(mpf_name,usecols=['FINREGISTRYID'],dtype=str)['FINREGISTRYID'])
+        record['rows'] = len(initial_index)
+    print("Number of initial study IDs: "+str(len(initial_index)))
+
+    #remove people who died during 2020
+    #read in IDs of people who have died before the end of year 2020
+    with stage('read',data='death') as record:
+        death_ids = pd.read_csv(death_name,usecols=[0],dtype=str).iloc[:,0]
+        record['rows'] = len(death_ids)
+
+    #study_mask = which of the initial IDs are kept in the study population
+    with stage('filter',data='death') as record:
+        study_mask = ~initial_index.mask(death_ids)
+        record['rows'] = len(death_ids)
+    print("Number of IDs after removing deaths during 2020: "+str(study_mask.sum())) #3255578 IDs
+
+    #NOTE: We define COVID positives as follows:
+    #reporting_group = "['Koronavirus', '--COVID-19-koronavirusinfektio']"
+    #reporting_week is between 1/2020 and 43/2021 (inclusive)
+    #if reporting week is NaN, then use sampling_date
+    #if also sampling date is NaN, mark as Covid positive (5 such cases)
+
+    #first define COVID positive cases according to the definition above
+    #(only records from 2020 onwards are considered)
+    with stage('filter',data='covid_positive') as record:
+        include_col = include_in_time_window(df,first_year=2020).astype(int)
+        record['rows'] = len(df)
+
+    df_COVID = df.copy()
+    df_COVID['include'] = include_col
+    print(df_COVID.head())
+
+    #subset to those cases that happened before 44/2021 and after the end of 2019
+    df_COVID = df_COVID.loc[df_COVID['include']>0]
+    print(df_COVID.head())
+
+    #get all unique values of the 'reporting_group' column
+    uniq_reporting_group = df_COVID['reporting_group'].unique()
+
+    #get the reporting group for COVID
+    for g in uniq_reporting_group:
+        if g.count('COVID')>0:
+            COVID_group = g
+            break
+
+    #select only the rows that correspond to COVID_group
+    df_COVID = df_COVID.loc[df_COVID['reporting_group']==COVID_group]
+    #This df now contains everyone with a COVID diagnosis that we want to exclude from the study
+    #saving this list to a file
+    with stage('write',data='covid_positive') as record:
+        df_COVID.to_csv(covid_positive_outname,index=False)
+        record['rows'] = len(df_COVID)
+
+    #remove from study ids those that have a reported positive covid test
+    study_mask &= ~initial_index.mask(df_COVID['TNRO'])
+    #the final study population gets the int32 codes used by all of the following stages
+    id_index = initial_index.subset(study_mask)
+    print('Number of study IDs after removing COVID positives: '+str(len(id_index))) #this is 3195308 IDs
+    #save the final list of study ids and the ID index to files
+    with stage('write',data='study_ids') as record:
+        id_index.save(idfile)
+        record['rows'] = len(id_index)
+    return id_index
 
 #########################################
 #PREPROCESS INFECTIOUS DISEASES REGISTER#
 #########################################
 
-fname = "/data/processed_data/thl_infectious_diseases/infectious_diseases_2022-01-19.feather"
-infectious_outname = "/data/projects/vaccination_project/data/vaccination_project_infectious_diseases_082022.csv"
-covid_positive_outname = "/data/projects/vaccination_project/data/vaccination_project_infectious_diseases_042022_COVID+_only.csv"
-idfile = "/data/projects/vaccination_project/data/vaccination_project_study_ids_082022.csv"
-
-#read in the columns of interest
-#ID = TNRO = column 1
-#recording_week = column 25
-#reporting_group = column 26
-#sampling_date
-#NOTE: We define COVID positives as follows:
-#reporting_group = "['Koronavirus', '--COVID-19-koronavirusinfektio']"
-#reporting_week is between 1/2020 and 43/2021 (inclusive)
-#if reporting week is NaN, then use sampling_date
-#if also sampling date is NaN, mark as Covid positive (5 such cases)
-
-df = pd.read_feather(fname,columns=['TNRO','recording_week','reporting_group','sampling_date'])
-df['reporting_group'] = df['reporting_group'].astype(str)
-df['recording_week'] = df['recording_week'].astype(str)
-df['sampling_date'] = df['sampling_date'].astype(str)
-print(df.head())
-
-#first define COVID positive cases according to the definition above
-include_col = []
-for index,row in df.iterrows():
-	
-	if row['recording_week'].count('None')>0:
-		#get the corresponding sampling date
-		date = row['sampling_date']
-		if date.count('None')>0: include_col.append(1) #if also sampling date is missing, assume this happened during time interval of interest as it is the more likely option
-		else:
-			#check if sampling date is within the time interval of Jan/2020-Oct/2021
-			year = int(date.split('-')[0])
-			month = int(date.split('-')[1])
-			if year==2020 or (year==2021 and month<11): include_col.append(1)
-			else: include_col.append(0) 
-		continue
-	year = int(row['recording_week'].split('/')[1])
-	week = int(row['recording_week'].split('/')[0])
-	if year==2020: include_col.append(1)
-	elif week<=43: include_col.append(1)
-	else: include_col.append(0)
-
-df_COVID = df.copy()
-df_COVID['include'] = include_col
-print(df_COVID.head())
-
-#subset to those cases that happened before 44/2021 and after the end of 2019
-df_COVID = df_COVID.loc[df_COVID['include']>0]
-print(df_COVID.head())
-
-#get all unique values of the 'reporting_group' column
-uniq_reporting_group = df_COVID['reporting_group'].unique()
-
-#get the reporting group for COVID
-for g in uniq_reporting_group:
-	if g.count('COVID')>0:
-		COVID_group = g
-		break
-
-#select only the rows that correspond to COVID_group
-df_COVID = df_COVID.loc[df_COVID['reporting_group']==COVID_group]
-#This df now contains everyone with a COVID diagnosis that we want to exclude from the study
-#saving this list to a file
-df_COVID.to_csv(covid_positive_outname,index=False)
-
-#remove from study ids those that have a reported positive covid test
-study_ids = list(study_ids - set(df_COVID['TNRO'].unique()))
-print('Number of study IDs after removing COVID positives: '+str(len(study_ids))) #this is 3195308 IDs
-study_ids.sort()
-#save the final list of study ids to a file
-with open(idfile,'wt') as outfile:
-    w = csv.writer(outfile,delimiter=',')
-    w.writerow(study_ids)
-
-#Then create the variables used as predictors. We select the 10 most prevalent infectious diseases
-#not counting COVID
-
-#make variables of the top 10 most frequent reporting groups
-#also map these levels to more interpretable names
-
-reporting_group_map = {"['Klamydia']":"INF_CHLAMYDIA","['Influenssa' '--Influenssa A' '----Ei H1N1 eikä H5N5']":"INF_INFLUENZA_A","['Campylobacter']":"INF_CAMPYLOBACTER",
-"['--C. difficile TOKS' 'C. difficile']":"INF_CLOSTRIDIOIDES_DIFFICILE","['Salmonella' '--Salmonella muu']":"INF_SALMONELLA",
-"['RSV']":"INF_RSV","['ESBL-kantajuus' '--ESBL-kantajuus E.coli']":"INF_ESBL_CARRIER","['Influenssa' '--Influenssa B']":"INF_INFLUENZA_B","['M. pneumoniae']":"INF_MYCOPLASMA_PNEUMONIA",
-"['Norovirus' 'Pieni pyöreä virus']":"INF_NOROVIRUS","['Hepatiitti C']":"INF_HEPATITIS_C","['Puumalavirus']":"INF_PUUMALAVIRUS",
-"['Bakteerit' '--Grampositiiviset bakteerit' '----Stafylokokit'\n '------Staphylococcus aureus'\n '--------Staphylococcus aureus muu kuin MRSA' 'S. aureus, veri/likvor'\n '--S. aureus, veri/likvor ei MRSA']":"INF_STAPHYLOCOCCUS_AUREUS_TYPICAL",
-"['MRSA-kantajuus']":"INF_MRSA_CARRIER"}
-
-#All of these are used as separate variables.
-#remove all diagnoses that happen after week 43/2021
-#remove also IDs that are not in the study population
-study_ids = set(study_ids)
-
-include_col = []
-for index,row in df.iterrows():
-        ID = row['TNRO']
-        if ID not in study_ids:
-            #remove IDs not in the study population
-            include_col.append(0)
-            continue
-        if row['recording_week'].count('None')>0:
-                #get the corresponding sampling date
-                date = row['sampling_date']
-                if date.count('None')>0: include_col.append(1) #if also sampling date is missing, assume this happened during time interval of interest as it is the more likely option
-                else:
-                        #check if sampling date is before or after Oct/2021
-                        year = int(date.split('-')[0])
-                        month = int(date.split('-')[1])
-                        if year<2021 or (year==2021 and month<11): include_col.append(1)
-                        else: include_col.append(0)
-                continue
-        year = int(row['recording_week'].split('/')[1])
-        week = int(row['recording_week'].split('/')[0])
-        if year<2021: include_col.append(1)
-        elif week<=43: include_col.append(1)
-        else: include_col.append(0)
-
-df['include'] = include_col
-
-#subset to those cases that happened before 44/2021
-df = df.loc[df['include']>0]
-print(df.head())
-
-#save the infectious diseases data
-#Create the individual variables
-inf_IDs = set(df['TNRO']) #IDs found from the infectious diseases register
-missing_ids = set(study_ids)-inf_IDs
-print('Number of study population IDs missing from infectious diseases register: '+str(len(missing_ids)))
-varnames = [reporting_group_map[key] for key in reporting_group_map]
-rowcount = 0
-data = {} #key = ID, value = {FINREGISTRYID:ID,var1:val1,var2:val2,...}
-
-#first add the ids with entries in the infectious diseases register
-for index,row in df.iterrows():
-    ID = row['TNRO']
-    rowcount += 1
-    if rowcount%100000<1: print(str(rowcount)+" rows processed")
-    #if ID not in study_ids: continue
-    if ID not in data:
-        data[ID] = {'FINREGISTRYID':ID}
-        for g in reporting_group_map: data[ID][g] = 0
-    reporting_group = row['reporting_group']
-    #only use the most frequent reporting groups defined above as variables#
-    if reporting_group not in reporting_group_map: continue
-    data[ID][reporting_group] = 1
-
-#then add the missing ids as empty rows
-for ID in missing_ids:
-    data[ID] = {'FINREGISTRYID':ID}
-    for g in reporting_group_map: data[ID][g] = 0 
-        
-#convert to dataframe
-data_df = pd.DataFrame.from_dict(data,orient='index')
-data_df = data_df.rename(columns=reporting_group_map)
-#save the resulting dataframe to a file
-data_df.to_csv(infectious_outname,index=False)    
-    
+def create_infectious_disease_variables(df,id_index,infectious_outname):
+    #Create the variables used as predictors. We select the 10 most prevalent infectious diseases
+    #not counting COVID
+
+    #make variables of the top 10 most frequent reporting groups
+    #also map these levels to more interpretable names
+
+    reporting_group_map = {"['Klamydia']":"INF_CHLAMYDIA","['Influenssa' '--Influenssa A' '----Ei H1N1 eikä H5N5']":"INF_INFLUENZA_A","['Campylobacter']":"INF_CAMPYLOBACTER",
+    "['--C. difficile TOKS' 'C. difficile']":"INF_CLOSTRIDIOIDES_DIFFICILE","['Salmonella' '--Salmonella muu']":"INF_SALMONELLA",
+    "['RSV']":"INF_RSV","['ESBL-kantajuus' '--ESBL-kantajuus E.coli']":"INF_ESBL_CARRIER","['Influenssa' '--Influenssa B']":"INF_INFLUENZA_B","['M. pneumoniae']":"INF_MYCOPLASMA_PNEUMONIA",
+    "['Norovirus' 'Pieni pyöreä virus']":"INF_NOROVIRUS","['Hepatiitti C']":"INF_HEPATITIS_C","['Puumalavirus']":"INF_PUUMALAVIRUS",
+    "['Bakteerit' '--Grampositiiviset bakteerit' '----Stafylokokit'\n '------Staphylococcus aureus'\n '--------Staphylococcus aureus muu kuin MRSA' 'S. aureus, veri/likvor'\n '--S. aureus, veri/likvor ei MRSA']":"INF_STAPHYLOCOCCUS_AUREUS_TYPICAL",
+    "['MRSA-kantajuus']":"INF_MRSA_CARRIER"}
+
+    #All of these are used as separate variables.
+    #remove all diagnoses that happen after week 43/2021
+    #remove also IDs that are not in the study population
+    with stage('filter',data='infectious') as record:
+        id_codes = id_index.codes(df['TNRO'])
+        include = (id_codes>=0) & include_in_time_window(df)
+        record['rows'] = len(df)
+
+    #subset to those cases that happened before 44/2021
+    id_codes = id_codes[include]
+    df = df.loc[include]
+    print(df.head())
+
+    #save the infectious diseases data
+    #Create the individual variables
+    start = time()
+    inf_IDs = df['TNRO'].unique() #IDs found from the infectious diseases register
+    print('Number of study population IDs missing from infectious diseases register: '+str(len(id_index)-len(inf_IDs)))
+    varnames = [reporting_group_map[key] for key in reporting_group_map]
+
+    #map each record to a row (code of the ID) and a column (index of the reporting group)
+    #records with a reporting group not among the most frequent ones get code -1 and are not used as variables
+    with stage('pivot',data='infectious') as record:
+        group_index = {g:i for i,g in enumerate(reporting_group_map)}
+        group_codes = df['reporting_group'].map(group_index).fillna(-1).astype(int).values
+        row_inds = id_codes[group_codes>=0]
+        col_inds = group_codes[group_codes>=0]
+
+        #ID x variable indicator matrix, IDs without any records are left as rows of zeros
+        indicators = coo_matrix((np.ones(len(row_inds),dtype=np.uint8),(row_inds,col_inds)),shape=(len(id_index),len(varnames))).tocsr()
+        indicators.data[:] = 1 #several records of the same reporting group are summed up when converting to csr
+        data_df = pd.DataFrame(indicators.toarray(),columns=varnames)
+        data_df.insert(0,'FINREGISTRYID',id_index.ids)
+        record['rows'] = len(df)
+    #save the resulting dataframe to a file
+    with stage('write',data='infectious') as record:
+        data_df.to_csv(infectious_outname,index=False)
+        record['rows'] = len(data_df)
+    end = time()
+    print('Infectious disease variables created in '+str(end-start)+' s, peak memory usage '+str(peak_memory())+' GB')
+
 ##############################
 #PREPROCESS MARRIAGE REGISTER#
 ##############################
 
-fname = "/data/processed_data/dvv/Tulokset_1900-2010_tutkhenk_aviohist.txt.finreg_IDsp"
-marriage_outname = "/data/projects/vaccination_project/data/vaccination_project_marriage_082022.csv"
-
-#read in the columns of interest
-#FINREGISTRYID = column 0
-#Current_marital_status = column 1
-#Starting_date = column 5
-
-#For each ID, we take the newest current_marital_status
-#Newest is the one where Starting_date is the latest
-#Map the marital status variables into more easily interpretable names:
-#Columns of the output file are:
-#FINREGISTRYID
-#SES_MARITALSTATUS_CAT = Marital status as a categorical variable, see levels from below
-#SES_MARITAL_UNKNOWN = Marital status unknown (Current_marital_status=0)
-#SES_UNMARRIED = unmarried (Current_marital_status=1)
-#SES_MARRIED = married (Current_marital_status=2)
-#SES_SEPARATED = separated (Current_marital_status=3)
-#SES_DIVORCED = divorced (Current_marital_status=4)
-#SES_WIDOW = widowed (Current_marital_status=5)
-#SES_REGPARTNERSHIP = registered partnership (Current_marital_status=6)
-#SES_DIVORCED_REGPARTNERSHIP = divorced from registered partnership (Current_marital_status=7)
-#SES_WIDOW_REGPARTHERSHIP = widowed from registered partnership (Current_marital_status=8)
-
-
-df_marriage = pd.read_csv(fname,usecols=['FINREGISTRYID','Current_marital_status','Starting_date'])
-
-from datetime import datetime
-eofu = datetime.strptime('Oct 31 2021', '%b %d %Y')
-
-#we want to keep only the latest entry that started before the end of October 2021
-df_marriage['Starting_date'] = pd.to_datetime(df_marriage['Starting_date'])
-df_marriage = df_marriage.loc[df_marriage['Starting_date']<eofu]
-df_marriage = df_marriage.sort_values('Starting_date').groupby('FINREGISTRYID').tail(1)
-
-import csv
-#save the resulting file
-marriage_ids = set(df_marriage['FINREGISTRYID'].unique())
-missing_ids = set(study_ids)-marriage_ids
-print('Number of study population IDs missing from marriage register: '+str(len(missing_ids)))
-with open(marriage_outname,'wt') as outfile:
-    w = csv.writer(outfile,delimiter=',')
-    #write header
+def create_marriage_variables(fname,id_index,marriage_outname,eofu):
+    #read in the columns of interest
+    #FINREGISTRYID = column 0
+    #Current_marital_status = column 1
+    #Starting_date = column 5
+
+    #For each ID, we take the newest current_marital_status
+    #Newest is the one where Starting_date is the latest
+    #Map the marital status variables into more easily interpretable names:
+    #Columns of the output file are:
+    #FINREGISTRYID
+    #SES_MARITALSTATUS_CAT = Marital status as a categorical variable, see levels from below
+    #SES_MARITAL_UNKNOWN = Marital status unknown (Current_marital_status=0)
+    #SES_UNMARRIED = unmarried (Current_marital_status=1)
+    #SES_MARRIED = married (Current_marital_status=2)
+    #SES_SEPARATED = separated (Current_marital_status=3)
+    #SES_DIVORCED = divorced (Current_marital_status=4)
+    #SES_WIDOW = widowed (Current_marital_status=5)
+    #SES_REGPARTNERSHIP = registered partnership (Current_marital_status=6)
+    #SES_DIVORCED_REGPARTNERSHIP = divorced from registered partnership (Current_marital_status=7)
+    #SES_WIDOW_REGPARTHERSHIP = widowed from registered partnership (Current_marital_status=8)
+
+    with stage('read',data='marriage') as record:
+        df_marriage = pd.read_csv(fname,usecols=['FINREGISTRYID','Current_marital_status','Starting_date'])
+        record['rows'] = len(df_marriage)
+
+    #we want to keep only the latest entry that started before the end of follow-up (end of October 2021)
+    with stage('filter',data='marriage') as record:
+        record['rows'] = len(df_marriage)
+        df_marriage['Starting_date'] = pd.to_datetime(df_marriage['Starting_date'])
+        df_marriage = df_marriage.loc[df_marriage['Starting_date']<eofu]
+        df_marriage = df_marriage.sort_values('Starting_date').groupby('FINREGISTRYID').tail(1)
+
+    #marital status of each study ID, IDs missing from the marriage register get status 0 (unknown)
+    with stage('pivot',data='marriage') as record:
+        marriage_codes = id_index.codes(df_marriage['FINREGISTRYID'])
+        in_study = marriage_codes>=0
+        marital_status = np.zeros(len(id_index),dtype=int)
+        marital_status[marriage_codes[in_study]] = df_marriage['Current_marital_status'].values[in_study]
+        record['rows'] = len(df_marriage)
+    print('Number of study population IDs missing from marriage register: '+str(len(id_index)-in_study.sum()))
+
+    #save the resulting file, one row per study ID in the order of the codes
     header = ['FINREGISTRYID','SES_MARITALSTATUS_CAT','SES_MARITAL_UNKNOWN','SES_UNMARRIED','SES_MARRIED','SES_SEPARATED','SES_DIVORCED','SES_WIDOW','SES_REGPARTNERSHIP',
               'SES_DIVORCED_REGPARTNERSHIP','SES_WIDOW_REGPARTNERSHIP']
-    w.writerow(header)
-    for ID in missing_ids: w.writerow([ID,0,1,0,0,0,0,0,0,0,0])
-    print('missing IDs written')
-    for index,row in df_marriage.iterrows():
-        ID = row['FINREGISTRYID']
-        if ID not in study_ids: continue
-        outrow = [0 for i in range(len(header))]
-        val = row['Current_marital_status']
-        outrow[0] = ID
-        outrow[1] = val
-        outrow[val+2] = 1
-        w.writerow(outrow)
+    with stage('write',data='marriage') as record:
+        indicators = (marital_status[:,None]==np.arange(len(header)-2)).astype(int)
+        data_df = pd.DataFrame(indicators,columns=header[2:])
+        data_df.insert(0,'SES_MARITALSTATUS_CAT',marital_status)
+        data_df.insert(0,'FINREGISTRYID',id_index.ids)
+        data_df.to_csv(marriage_outname,index=False)
+        record['rows'] = len(data_df)
+
+def create_variables_from_inf_diseases_and_marriage():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--stages",help="Which parts of the preprocessing are run (default=all three). study_ids = study population after removing deaths during 2020 and COVID positives, infectious = infectious disease variables, marriage = marital status variables. The infectious and marriage stages read the study population from --idfile.",
+                        type=str,nargs='+',default=['study_ids','infectious','marriage'],choices=['study_ids','infectious','marriage'])
+    parser.add_argument("--mpffile",help="Full path to the preprocessed minimal phenotype file (default=/data/projects/vaccination_project/data/vaccination_project_minimalphenotype_082022.csv).",
+                        type=str,default="/data/projects/vaccination_project/data/vaccination_project_minimalphenotype_082022.csv")
+    parser.add_argument("--deathfile",help="Full path to the file containing IDs of people who died before the end of 2020 (default=/data/processed_data/sf_death/thl2021_2196_ksyy_tutkimus.csv.finreg_IDsp).",
+                        type=str,default="/data/processed_data/sf_death/thl2021_2196_ksyy_tutkimus.csv.finreg_IDsp")
+    parser.add_argument("--infectiousfile",help="Full path to the infectious diseases register (default=/data/processed_data/thl_infectious_diseases/infectious_diseases_2022-01-19.feather).",
+                        type=str,default="/data/processed_data/thl_infectious_diseases/infectious_diseases_2022-01-19.feather")
+    parser.add_argument("--marriagefile",help="Full path to the marriage register (default=/data/processed_data/dvv/Tulokset_1900-2010_tutkhenk_aviohist.txt.finreg_IDsp).",
+                        type=str,default="/data/processed_data/dvv/Tulokset_1900-2010_tutkhenk_aviohist.txt.finreg_IDsp")
+    parser.add_argument("--outdir",help="Full path to the directory where the output files are written (default=/data/projects/vaccination_project/data/).",
+                        type=str,default="/data/projects/vaccination_project/data/")
+    parser.add_argument("--eofu",help="End of follow-up, marital statuses starting after this date are not used (default=2021-10-31).",type=str,default='2021-10-31')
+    parser.add_argument("--trace",help="Full path to a file where the time and memory usage of each stage (read, filter, pivot, write) are written as JSON lines (default=None, not written).",type=str,default=None)
+    parser.add_argument("--profile",help="Full path to a file where the call stacks sampled by a sampling profiler are written in the collapsed stack format (default=None, no profiling).",type=str,default=None)
+    parser.add_argument("--profile_interval",help="Sampling interval of the profiler in seconds (default=0.01).",type=float,default=0.01)
+
+    args = parser.parse_args()
+
+    infectious_outname = args.outdir+"vaccination_project_infectious_diseases_082022.csv"
+    covid_positive_outname = args.outdir+"vaccination_project_infectious_diseases_042022_COVID+_only.csv"
+    idfile = args.outdir+"vaccination_project_study_ids_082022.csv"
+    marriage_outname = args.outdir+"vaccination_project_marriage_082022.csv"
+    stage_trace.configure(args.trace,args.profile,args.profile_interval)
+
+    df = None
+    if 'study_ids' in args.stages:
+        df = read_infectious_diseases(args.infectiousfile)
+        id_index = create_study_population(args.mpffile,args.deathfile,df,covid_positive_outname,idfile)
+    else: id_index = StudyIDIndex.load(idfile)
+    if 'infectious' in args.stages:
+        if df is None: df = read_infectious_diseases(args.infectiousfile)
+        create_infectious_disease_variables(df,id_index,infectious_outname)
+        del(df)
+    if 'marriage' in args.stages: create_marriage_variables(args.marriagefile,id_index,marriage_outname,pd.Timestamp(args.eofu))
+    stage_trace.close()
+
+if __name__=='__main__':
+    create_variables_from_inf_diseases_and_marriage()
@@ -0,0 +1,217 @@
+#Evaluation of the XGBoost models on the test set.
+#evaluate_predictions computes the precision-recall and ROC curves, AUPRC and AUC over random subsamples of the test set,
+#bootstrap confidence intervals and the calibration curve for the predictions of one model. It is used at the end of
+#xgboost_training_skopt.py, and running this script evaluates many saved models (_best_xgb_model.pkl) or prediction files
+#(_test_set_xgb_pred_probas.csv.gz) at once: the test set is read in only once, all models are scored on it and the models
+#are then evaluated in parallel, and the results are written into one table.
+import pandas as pd
+import numpy as np
+import csv
+import pickle
+import random
+import argparse
+
+from time import time
+from glob import glob
+from os.path import basename
+from concurrent.futures import ProcessPoolExecutor
+
+from sklearn.metrics import average_precision_score,roc_auc_score,roc_curve,precision_recall_curve
+from sklearn.calibration import calibration_curve
+from bootstrap_metrics import bootstrap_auc_auprc,percentiles
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+
+MODEL_SUFFIX = '_best_xgb_model.pkl'
+PRED_SUFFIX = '_test_set_xgb_pred_probas.csv.gz'
+
+def evaluate_predictions(y_test,y_score,outprefix,n_subsamples=10,subsample_fraction=0.75,n_bootstraps=2000,ci_percentiles=[5,95],
+                         calibration_bins=10,nproc=1,subsample_seed=None):
+    #evaluate the predicted probabilities y_score of the test set labels y_test and write the results to files starting with outprefix
+    #(precision-recall and ROC curve figures, AUPRC and AUC of each subsample and the bootstrap confidence intervals)
+    #subsample_seed = seed for drawing the subsamples (default=None, drawn with the global random state)
+    #returns a dictionary of the results and a dataframe containing the calibration curve
+    y_test = np.asarray(y_test)
+    y_score = np.asarray(y_score).flatten()
+    #draw N random subsamples of test set and compute the metrics for each subsample
+    sampler = random if subsample_seed is None else random.Random(subsample_seed)
+    all_inds = [i for i in range(0,len(y_test))]
+    ind_samples = []
+    for i in range(0,n_subsamples): ind_samples.append(sampler.sample(all_inds,int(subsample_fraction*len(all_inds))))
+    #first plot precision-recall curve
+    auprcs = []
+    rand_AUprc = round(np.sum(y_test)/len(y_test),3)
+    plt.plot(np.linspace(0,1),rand_AUprc*np.ones(shape=(1,50)).flatten(),'--k',label="random, auPRC="+str(rand_AUprc))
+    for inds in ind_samples:
+        auprcs.append(average_precision_score(y_test[inds],y_score[inds]))
+        precision,recall,threshold = precision_recall_curve(y_test[inds],y_score[inds])
+
+    if len(auprcs)==len(ind_samples): plt.plot(recall,precision,linewidth=1,c='b',label="XGBoost, AUprc="+str(round(np.mean(auprcs),3))+" ± "+str(round(np.std(auprcs),3)))
+    else: plt.plot(recall,precision,linewidth=1,c='b')
+    plt.xlabel("recall")
+    plt.ylabel("precision")
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(outprefix+"_xgb_precision_recall_curve.png",dpi=300)
+    plt.clf()
+    #receiver operator characteristics curve and AUC
+    aucs = []
+    plt.plot(np.linspace(0,1),np.linspace(0,1),'--k',label="random, AUC=0.5")
+    for inds in ind_samples:
+        aucs.append(roc_auc_score(y_test[inds],y_score[inds]))
+        fpr,tpr,threshold = roc_curve(y_test[inds],y_score[inds])
+
+    if len(aucs)==len(ind_samples): plt.plot(fpr,tpr,linewidth=1,c='b',label="XGBoost, AUC="+str(round(np.mean(aucs),3))+" ± "+str(round(np.std(aucs),3)))
+    else: plt.plot(fpr,tpr,linewidth=1,c='b')
+
+    plt.xlabel("fpr")
+    plt.ylabel("tpr")
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(outprefix+"_xgb_roc_curve.png",dpi=300)
+    plt.clf()
+
+    #save AUPRC and AUC values to a file
+    with open(outprefix+"_xgb_AUPRC_AUC.txt",'wt') as outfile:
+        w = csv.writer(outfile,delimiter=',')
+        w.writerow(['sample','AUPRC','AUC'])
+        for i in range(1,len(aucs)+1): w.writerow([i,auprcs[i-1],aucs[i-1]])
+
+    #estimate confidence intervals for AUC and AUprc
+    #the resamples are drawn from np.random.RandomState(42) one at a time as in the original bootstrap loop
+    bootstrapped_AUCs,bootstrapped_AUprcs = bootstrap_auc_auprc(y_test,y_score,n_bootstraps=n_bootstraps,seed=42,nproc=nproc,legacy=True)
+    confidence_lower_AUC,confidence_upper_AUC = percentiles(bootstrapped_AUCs,ci_percentiles)
+    mean_AUC = np.mean(bootstrapped_AUCs)
+    confidence_lower_AUprc,confidence_upper_AUprc = percentiles(bootstrapped_AUprcs,ci_percentiles)
+    mean_AUprc = np.mean(bootstrapped_AUprcs)
+
+    #save the confidence intervals to a file
+    with open(outprefix+"_xgb_AUPRC_AUC_CIs.txt",'wt') as outfile:
+        w = csv.writer(outfile,delimiter=',')
+        w.writerow(['name','AUPRC','AUC'])
+        w.writerow(['mean',mean_AUprc,mean_AUC])
+        w.writerow(['lower_CI',confidence_lower_AUprc,confidence_lower_AUC])
+        w.writerow(['upper_CI',confidence_upper_AUprc,confidence_upper_AUC])
+
+    #calibration curve
+    prob_true,prob_pred = calibration_curve(y_test,y_score,n_bins=calibration_bins)
+    calibration = pd.DataFrame({'mean_predicted_value':prob_pred,'fraction_of_positives':prob_true})
+
+    results = {'n_test':len(y_test),'n_positive':int(np.sum(y_test==1)),
+               'AUPRC_subsample_mean':np.mean(auprcs),'AUPRC_subsample_std':np.std(auprcs),'AUC_subsample_mean':np.mean(aucs),'AUC_subsample_std':np.std(aucs),
+               'n_bootstraps':len(bootstrapped_AUCs),'AUPRC_mean':mean_AUprc,'AUPRC_lower_CI':confidence_lower_AUprc,'AUPRC_upper_CI':confidence_upper_AUprc,
+               'AUC_mean':mean_AUC,'AUC_lower_CI':confidence_lower_AUC,'AUC_upper_CI':confidence_upper_AUC}
+    return results,calibration
+
+def model_label(fname):
+    #model name = file name without the suffix added by xgboost_training_skopt.py
+    name = basename(fname)
+    for suffix in [MODEL_SUFFIX,PRED_SUFFIX]:
+        if name.endswith(suffix): return name[:-len(suffix)]
+    return name.split('.')[0]
+
+def expand_globs(patterns):
+    #files matching any of the glob patterns, in sorted order
+    fnames = []
+    for pattern in patterns:
+        matches = sorted(glob(pattern))
+        if len(matches)<1: raise ValueError("No files found matching "+pattern)
+        fnames += [fname for fname in matches if fname not in fnames]
+    return fnames
+
+def read_variable_list(fname):
+    #variables used by a model, the last row of the --allvars file as in xgboost_training_skopt.py
+    with open(fname,'rt') as infile:
+        r = csv.reader(infile,delimiter=',')
+        for row in r: all_vars = row
+    return all_vars
+
+def score_models(model_files,allvars_files,testfile,nproc):
+    #read in the test set once and compute the predicted probabilities of each model
+    #allvars_files has either one variable list file used for all models or one file per model
+    #returns the test set labels and a list of predicted probabilities
+    from xgboost_training_skopt import read_columns,to_matrix
+    if len(allvars_files)==1: allvars_files = allvars_files*len(model_files)
+    if len(allvars_files)!=len(model_files): raise ValueError("Give either one --allvars file or one for each model ("+str(len(model_files))+" models found)")
+    model_vars = [read_variable_list(fname) for fname in allvars_files]
+    all_vars = list(dict.fromkeys([var for variables in model_vars for var in variables]+['COVIDVax']))
+    load_start = time()
+    df_test = read_columns(testfile,all_vars)
+    print("Test set with "+str(df_test.shape[1])+" columns read in in "+str(time()-load_start)+" s")
+    y_test = df_test['COVIDVax'].values
+    scores = []
+    for fname,variables in zip(model_files,model_vars):
+        #the models were trained with the columns in the order they are in the training file
+        columns = [col for col in df_test.columns if col in set(variables) and col!='COVIDVax']
+        model = pickle.load(open(fname,'rb'))
+        model.set_params(n_jobs=nproc)
+        y_pred = model.predict_proba(to_matrix(df_test[columns]))
+        scores.append(y_pred[:,np.where(model.classes_==1)].flatten())
+        print(fname+" scored.")
+    return y_test,scores
+
+def read_predictions(pred_file):
+    #test set labels and predicted probabilities from a file written by xgboost_training_skopt.py
+    df_test = pd.read_csv(pred_file,usecols=['COVIDVax','xgb_pred_proba'])
+    return df_test['COVIDVax'].values,df_test['xgb_pred_proba'].values
+
+def _evaluate_task(task):
+    label,source,y_test,y_score,kwargs = task
+    if y_test is None: y_test,y_score = read_predictions(source)
+    results,calibration = evaluate_predictions(y_test,y_score,**kwargs)
+    calibration.insert(0,'model',label)
+    print(label+" evaluated.")
+    return dict({'model':label,'source':source},**results),calibration
+
+def evaluate_xgb_models():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--outdir",help="Full path to the output directory.",type=str)
+    parser.add_argument("--models",help="Glob patterns (quoted) of the saved models (*_best_xgb_model.pkl) to evaluate.",type=str,nargs='+',default=[])
+    parser.add_argument("--predfiles",help="Glob patterns (quoted) of the prediction files (*_test_set_xgb_pred_probas.csv.gz) to evaluate.",type=str,nargs='+',default=[])
+    parser.add_argument("--testfile",help="Full path to the file containing test samples (.csv, .parquet or .feather), needed with --models.",type=str,default=None)
+    parser.add_argument("--allvars",help="Full path to the text file containing names of all variables used in the models, or one file per model in the sorted order of the model files.",
+                        type=str,nargs='+',default=[])
+    parser.add_argument("--nproc",help="Number of parallel processes used (default=32).",type=int,default=32)
+    parser.add_argument("--n_bootstraps",help="Number of bootstrap samples of the test set used for the AUC and AUPRC confidence intervals (default=2000).",type=int,default=2000)
+    parser.add_argument("--ci_percentiles",help="Lower and upper percentiles of the bootstrapped AUCs and AUPRCs reported as the confidence interval (default=5 95, i.e. 90%% CI).",
+                        type=float,default=[5,95],nargs=2)
+    parser.add_argument("--calibration_bins",help="Number of bins in the calibration curves (default=10).",type=int,default=10)
+    parser.add_argument("--seed",help="Random seed used to draw the test set subsamples (default=42).",type=int,default=42)
+
+    args = parser.parse_args()
+
+    start = time()
+    model_files = expand_globs(args.models)
+    pred_files = expand_globs(args.predfiles)
+    if len(model_files)+len(pred_files)<1: parser.error("at least one of --models or --predfiles is needed")
+    if len(model_files)>0 and (args.testfile is None or len(args.allvars)<1): parser.error("--testfile and --allvars are needed with --models")
+    labels = [model_label(fname) for fname in model_files+pred_files]
+    if len(set(labels))<len(labels): raise ValueError("Model names are not unique: "+','.join(pd.Index(labels)[pd.Index(labels).duplicated()]))
+    print("Evaluating "+str(len(model_files))+" models and "+str(len(pred_files))+" prediction files")
+
+    kwargs = dict(n_bootstraps=args.n_bootstraps,ci_percentiles=args.ci_percentiles,calibration_bins=args.calibration_bins,subsample_seed=args.seed)
+    tasks = []
+    if len(model_files)>0:
+        y_test,scores = score_models(model_files,args.allvars,args.testfile,args.nproc)
+        for label,fname,y_score in zip(labels,model_files,scores): tasks.append((label,fname,y_test,y_score,dict(kwargs,outprefix=args.outdir+label)))
+    #the prediction files are read in by the worker processes
+    for label,fname in zip(labels[len(model_files):],pred_files): tasks.append((label,fname,None,None,dict(kwargs,outprefix=args.outdir+label)))
+
+    with ProcessPoolExecutor(max_workers=max(1,min(args.nproc,len(tasks)))) as executor:
+        evaluated = list(executor.map(_evaluate_task,tasks))
+
+    pd.DataFrame([r[0] for r in evaluated]).to_csv(args.outdir+"evaluation_results.csv",index=False)
+    pd.concat([r[1] for r in evaluated]).to_csv(args.outdir+"calibration_curves.csv",index=False)
+    end = time()
+    print("duration: "+str(end-start)+" s")
+
+if __name__=='__main__':
+    evaluate_xgb_models()
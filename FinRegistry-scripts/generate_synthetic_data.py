@@ -0,0 +1,154 @@
+#Synthetic versions of the register files read by the preprocessing scripts, for testing and benchmarking the scripts outside
+#the secure computing environment. The files have the same names, directory layout, column names and value formats as the
+#original files (e.g. recording_week as 'WW/YYYY' strings, reporting_group as string arrays, missing values as None), but
+#only the columns used by the scripts and random values. The files are written under <outdir>/processed_data/ and
+#<outdir>/data/, which can be used in place of /data/processed_data/ and /data/projects/vaccination_project/data/.
+#Only the inputs of the study population, infectious disease, marriage and relatives stages are written: the minimal phenotype
+#and vaccination outcome files are written directly in the preprocessed format of script_create_variables_for_vaccination_project.R,
+#whose raw inputs are not generated, and neither are the registers of the other notebook sections. With preprocessing_pipeline.py
+#(--processeddir <outdir>/processed_data --datadir <outdir>/data), first record the generated files with --adopt and then run
+#e.g. --stages study_ids infectious marriage relatives.
+#With --study_variables, a wide variable file and the filtered vaccination status file are written for the study IDs created by
+#create_variables_from_inf_diseases_and_marriage.py, so that the variable files can be merged with merge_sorted_variable_files.py.
+import pandas as pd
+import numpy as np
+import os
+import argparse
+
+from time import time
+
+#reporting groups of the infectious diseases register and their relative frequencies, the first one is COVID
+REPORTING_GROUPS = [("['Koronavirus' '--COVID-19-koronavirusinfektio']",20),("['Klamydia']",15),("['Influenssa' '--Influenssa A' '----Ei H1N1 eikä H5N5']",10),
+                    ("['Campylobacter']",6),("['--C. difficile TOKS' 'C. difficile']",4),("['Salmonella' '--Salmonella muu']",3),("['RSV']",3),
+                    ("['ESBL-kantajuus' '--ESBL-kantajuus E.coli']",3),("['Influenssa' '--Influenssa B']",3),("['M. pneumoniae']",2),
+                    ("['Norovirus' 'Pieni pyöreä virus']",2),("['Hepatiitti C']",2),("['Puumalavirus']",2),
+                    ("['Bakteerit' '--Grampositiiviset bakteerit' '----Stafylokokit'\n '------Staphylococcus aureus'\n '--------Staphylococcus aureus muu kuin MRSA' 'S. aureus, veri/likvor'\n '--S. aureus, veri/likvor ei MRSA']",2),
+                    ("['MRSA-kantajuus']",2),("['Gonorrea']",1),("['Hepatiitti B']",1),("['Borrelia']",1)]
+#relationship codes of the DVV relatives file and the number of relatives of each type per person (0...max)
+RELATIONSHIPS = [('3a',1),('3i',1),('4i',3),('4a',3),('2',3),('1',1)]
+
+def synthetic_ids(n):
+    return np.array(['FR'+str(i).zfill(8) for i in range(n)])
+
+def random_dates(rng,n,first_year,last_year):
+    #dates uniformly between the beginning of first_year and the end of last_year
+    days = rng.integers(0,(last_year-first_year+1)*365,n)
+    return pd.Timestamp(str(first_year)+'-01-01')+pd.to_timedelta(days,unit='D')
+
+def with_missing(rng,values,fraction):
+    #object array of values where a fraction of the values are replaced with None
+    values = np.asarray(values,dtype=object)
+    values[rng.random(len(values))<fraction] = None
+    return values
+
+def write_minimal_phenotype(fname,ids,rng):
+    #preprocessed minimal phenotype file (output of script_create_variables_for_vaccination_project.R)
+    n = len(ids)
+    df = pd.DataFrame({'FINREGISTRYID':ids,'date_of_birth':random_dates(rng,n,1941,1990).strftime('%Y-%m-%d'),'sex':rng.integers(0,2,n),
+                       'post_code_last':with_missing(rng,rng.integers(100,99999,n),0.01),'mother_tongue':rng.choice(['fi','sv','ru','et','en'],n,p=[0.86,0.05,0.04,0.03,0.02]),
+                       'ever_married':rng.integers(0,2,n),'ever_divorced':rng.integers(0,2,n),'emigrated':0,'in_social_hilmo':(rng.random(n)<0.05).astype(int),
+                       'in_social_assistance_registries':(rng.random(n)<0.1).astype(int),'number_of_children':rng.poisson(1.5,n),'drug_purchases':(rng.random(n)<0.8).astype(int)})
+    df.to_csv(fname,index=False,na_rep='NA')
+
+def write_death_register(fname,ids,rng,fraction=0.015):
+    #IDs of people who died before the end of 2020, TNRO is the first column
+    dead = rng.choice(ids,int(fraction*len(ids)),replace=False)
+    pd.DataFrame({'TNRO':dead,'death_date':random_dates(rng,len(dead),2020,2020).strftime('%Y-%m-%d')}).to_csv(fname,index=False)
+
+def write_infectious_diseases(fname,ids,rng,records_per_id):
+    #infectious diseases register, missing recording weeks and sampling dates are None
+    n = int(records_per_id*len(ids))
+    groups = [g for g,w in REPORTING_GROUPS]
+    weights = np.array([w for g,w in REPORTING_GROUPS],dtype=float)
+    years = rng.integers(2000,2023,n)
+    weeks = rng.integers(1,54,n)
+    recording_week = with_missing(rng,[str(w)+'/'+str(y) for w,y in zip(weeks,years)],0.1)
+    sampling_date = with_missing(rng,random_dates(rng,n,2000,2022).strftime('%Y-%m-%d'),0.5)
+    df = pd.DataFrame({'TNRO':rng.choice(ids,n),'recording_week':recording_week,'reporting_group':rng.choice(groups,n,p=weights/weights.sum()),'sampling_date':sampling_date})
+    df.to_feather(fname)
+
+def write_marriage_register(fname,ids,rng):
+    #marriage history, several entries per person
+    n = int(1.5*len(ids))
+    df = pd.DataFrame({'FINREGISTRYID':rng.choice(ids,n),'Current_marital_status':rng.choice(9,n,p=[0.02,0.3,0.4,0.03,0.15,0.08,0.01,0.005,0.005]),
+                       'Starting_date':random_dates(rng,n,1960,2022).strftime('%Y-%m-%d')})
+    df.to_csv(fname,index=False)
+
+def write_relatives(fname,ids,all_ids,rng):
+    #DVV relatives, relatives can also be outside of the population of the minimal phenotype file
+    parts = []
+    for code,max_count in RELATIONSHIPS:
+        counts = rng.integers(0,max_count+1,len(ids))
+        parts.append(pd.DataFrame({'FINREGISTRYID':np.repeat(ids,counts),'Relationship':code,'Relative_ID':rng.choice(all_ids,counts.sum())}))
+    df = pd.concat(parts)
+    df.iloc[rng.permutation(len(df))].to_csv(fname,index=False)
+
+def write_vaccination_outcome(fname,ids,rng):
+    #vaccination outcome file (output of script_create_variables_for_vaccination_project.R)
+    #the probability of being vaccinated increases with age, so that the models have something to learn
+    n = len(ids)
+    age = rng.integers(30,81,n)
+    vaccinated = (rng.random(n)<1/(1+np.exp(-(0.5+0.06*(age-45))))).astype(int)
+    first_visit = np.where(vaccinated>0,random_dates(rng,n,2021,2021).strftime('%Y-%m-%d'),None)
+    pd.DataFrame({'FINREGISTRYID':ids,'age_october_2021':age,'first_visit':first_visit,'COVIDVax':vaccinated}).to_csv(fname,index=False,na_rep='NA')
+
+def write_variable_file(fname,ids,nvars,rng,vaccinated,na_fraction=0.05,n_informative=10):
+    #wide file of binary variables (like the endpoint and drug purchase files), some of the variables have missing values
+    #the first n_informative variables are twice as common among the unvaccinated (vaccinated = COVIDVax of each ID)
+    prevalence = np.tile(rng.uniform(0.01,0.3,nvars),(len(ids),1))
+    prevalence[vaccinated<1,:n_informative] *= 2
+    X = (rng.random((len(ids),nvars))<prevalence).astype(float)
+    X[:,::5][rng.random((len(ids),X[:,::5].shape[1]))<na_fraction] = np.nan
+    df = pd.DataFrame(X,columns=['SYNTH_VAR'+str(j) for j in range(nvars)]).astype('Int8')
+    df.insert(0,'FINREGISTRYID',ids)
+    df.to_csv(fname,index=False,na_rep='NA')
+
+def generate_synthetic_data():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--outdir",help="Full path to the output directory, the files are written under <outdir>/processed_data/ and <outdir>/data/.",type=str)
+    parser.add_argument("--n_ids",help="Number of IDs in the minimal phenotype file (default=100000).",type=int,default=100000)
+    parser.add_argument("--seed",help="Random seed (default=42).",type=int,default=42)
+    parser.add_argument("--infectious_records_per_id",help="Number of infectious disease records per ID (default=1.0).",type=float,default=1.0)
+    parser.add_argument("--study_variables",help="Write the wide variable file and the filtered vaccination status file for the study IDs in <outdir>/data/vaccination_project_study_ids_082022.csv.",
+                        action='store_true')
+    parser.add_argument("--n_vars",help="Number of variables in the wide variable file written with --study_variables (default=50).",type=int,default=50)
+
+    args = parser.parse_args()
+
+    start = time()
+    processed = os.path.join(args.outdir,'processed_data','')
+    data = os.path.join(args.outdir,'data','')
+    rng = np.random.default_rng(args.seed)
+    if args.study_variables:
+        from study_id_index import StudyIDIndex
+        study_ids = StudyIDIndex.load(data+'vaccination_project_study_ids_082022.csv').ids
+        outcome = pd.read_csv(data+'vaccination_outcome_including_covid19+_052022.csv',dtype={'FINREGISTRYID':str})
+        outcome = outcome.loc[outcome['FINREGISTRYID'].isin(study_ids)].sort_values('FINREGISTRYID')
+        outcome.to_csv(data+'vaccination_outcome_082022.csv',index=False,na_rep='NA',columns=['FINREGISTRYID','age_october_2021','first_visit','COVIDVax'])
+        write_variable_file(data+'synthetic_variables_wide.csv',study_ids,args.n_vars,rng,outcome['COVIDVax'].values)
+        print("Variable files for "+str(len(study_ids))+" study IDs written in "+str(time()-start)+" s")
+        return
+
+    for dirname in ['sf_death','thl_infectious_diseases','dvv','minimal_phenotype']: os.makedirs(processed+dirname,exist_ok=True)
+    os.makedirs(data,exist_ok=True)
+    #the minimal phenotype file contains n_ids people, the other registers also contain people outside of it
+    all_ids = synthetic_ids(int(1.3*args.n_ids))
+    ids = np.sort(rng.choice(all_ids,args.n_ids,replace=False))
+    write_minimal_phenotype(data+'vaccination_project_minimalphenotype_082022.csv',ids,rng)
+    write_vaccination_outcome(data+'vaccination_outcome_including_covid19+_052022.csv',ids,rng)
+    write_death_register(processed+'sf_death/thl2021_2196_ksyy_tutkimus.csv.finreg_IDsp',all_ids,rng)
+    write_infectious_diseases(processed+'thl_infectious_diseases/infectious_diseases_2022-01-19.feather',all_ids,rng,args.infectious_records_per_id)
+    write_marriage_register(processed+'dvv/Tulokset_1900-2010_tutkhenk_aviohist.txt.finreg_IDsp',all_ids,rng)
+    write_relatives(processed+'dvv/Tulokset_1900-2010_tutkhenk_ja_sukulaiset.txt.finreg_IDsp',ids,all_ids,rng)
+    end = time()
+    print("Synthetic data for "+str(args.n_ids)+" IDs written in "+str(end-start)+" s")
+
+if __name__=='__main__':
+    generate_synthetic_data()
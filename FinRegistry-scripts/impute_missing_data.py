@@ -0,0 +1,151 @@
+#Imputation of missing values by sampling from the observed values of the same column (hot-deck imputation),
+#streaming version of impute_missing_data_082022.md.
+#The file is read twice in parts that are processed in parallel: the first pass collects the distribution of the observed
+#values (value counts) and the number of missing values of each column in each part, and the second pass fills in the
+#missing values part by part. The values drawn for a column come from a random generator of its own, seeded with
+#(seed, column index), and the k:th missing value of a column always gets the k:th draw of its generator, so the output
+#does not depend on the number of processes or the chunk size. The distributions of the training set can be saved and used
+#to impute the test set.
+import pandas as pd
+import numpy as np
+import csv
+import io
+import os
+import pickle
+import shutil
+import argparse
+
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+
+from compute_variable_statistics import csv_ranges
+
+def read_lines(fname,start,end,chunksize):
+    #read the lines of a file between the byte offsets start and end, chunksize lines at a time
+    with open(fname,'rb') as infile:
+        infile.seek(start)
+        while infile.tell()<end:
+            lines = []
+            while len(lines)<chunksize and infile.tell()<end: lines.append(infile.readline())
+            yield b''.join(lines)
+
+def read_chunk(block,header,id_column,string_columns):
+    #parse a block of csv lines, all other columns than the ID column and the string columns are read in as floats
+    return pd.read_csv(io.BytesIO(block),header=None,names=header,dtype={col:(str if col==id_column or col in string_columns else float) for col in header},delimiter=',')
+
+def _collect_distributions(task):
+    #value counts of the observed values and the number of missing values of each column in one part of the file
+    fname,header,columns,start,end,chunksize,id_column,string_columns = task
+    values = {col:[] for col in columns}
+    na_counts = np.zeros(len(columns),dtype=np.int64)
+    for block in read_lines(fname,start,end,chunksize):
+        df = read_chunk(block,header,id_column,string_columns)
+        for j,col in enumerate(columns):
+            x = df[col].to_numpy()
+            isna = df[col].isna().to_numpy()
+            na_counts[j] += isna.sum()
+            values[col].append(np.unique(x[~isna],return_counts=True))
+    distributions = {col:combine_counts(values[col]) for col in columns}
+    return distributions,na_counts
+
+def combine_counts(value_counts):
+    #combine a list of (values,counts) tuples into one tuple with unique values
+    if len(value_counts)<1: return np.array([]),np.array([],dtype=np.int64)
+    values = np.concatenate([v for v,c in value_counts])
+    counts = np.concatenate([c for v,c in value_counts])
+    unique,inverse = np.unique(values,return_inverse=True)
+    return unique,np.bincount(inverse,weights=counts,minlength=len(unique)).astype(np.int64)
+
+def draw_values(values,counts,seed,column_index,offset,n):
+    #draws number offset,...,offset+n-1 of the column's random generator, each is a value sampled with replacement
+    #from the observed values of the column
+    bit_generator = np.random.PCG64([seed,column_index])
+    bit_generator.advance(int(offset))
+    u = np.random.Generator(bit_generator).random(n)
+    cdf = np.cumsum(counts)
+    return values[np.searchsorted(cdf,u*cdf[-1],side='right')]
+
+def _impute_part(task):
+    #fill in the missing values of one part of the file and write the imputed rows into a part file
+    fname,header,columns,start,end,chunksize,id_column,string_columns,distributions,offsets,seed,integer_columns,partname = task
+    offsets = offsets.copy()
+    column_index = {col:header.index(col) for col in columns}
+    with open(partname,'wt') as outfile:
+        for block in read_lines(fname,start,end,chunksize):
+            df = read_chunk(block,header,id_column,string_columns)
+            for j,col in enumerate(columns):
+                isna = df[col].isna().values
+                n = isna.sum()
+                if n<1 or len(distributions[col][0])<1: continue
+                values = df[col].values.copy()
+                values[isna] = draw_values(distributions[col][0],distributions[col][1],seed,column_index[col],offsets[j],n)
+                df[col] = values
+                offsets[j] += n
+            for col in integer_columns:
+                if not df[col].isna().any(): df[col] = df[col].astype(np.int64)
+            df.to_csv(outfile,header=False,index=False)
+    return partname
+
+def impute_missing_data():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--infile",help="Full path to the csv file to impute.",type=str)
+    parser.add_argument("--outfile",help="Full path to the imputed output file.",type=str)
+    parser.add_argument("--seed",help="Random seed (default=123).",type=int,default=123)
+    parser.add_argument("--nproc",help="Number of parallel processes used (default=32).",type=int,default=32)
+    parser.add_argument("--chunksize",help="Number of rows read in at a time by each process (default=20000).",type=int,default=20000)
+    parser.add_argument("--save_distributions",help="Full path to a file where the distributions of the observed values of each column are saved, e.g. for imputing the test set with the training set distributions (default=None).",
+                        type=str,default=None)
+    parser.add_argument("--distributions",help="Full path to a file saved with --save_distributions whose distributions are used for imputing instead of the distributions of the input file (default=None).",
+                        type=str,default=None)
+    parser.add_argument("--id_column",help="Name of the ID column that is not imputed (default=FINREGISTRYID).",type=str,default='FINREGISTRYID')
+    parser.add_argument("--string_columns",help="Non-numeric columns, which are imputed by sampling from their observed values as strings (default=first_visit).",
+                        type=str,nargs='*',default=['first_visit'])
+
+    args = parser.parse_args()
+
+    start = time()
+    with open(args.infile,'rt') as infile: header = next(csv.reader(infile,delimiter=','))
+    columns = [col for col in header if col!=args.id_column]
+    ranges = csv_ranges(args.infile,args.nproc)
+
+    #first pass: distributions of the observed values and number of missing values in each part
+    with ProcessPoolExecutor(max_workers=args.nproc) as executor:
+        parts = list(executor.map(_collect_distributions,[(args.infile,header,columns,range_start,range_end,args.chunksize,args.id_column,args.string_columns) for range_start,range_end in ranges]))
+    distributions = {col:combine_counts([part[0][col] for part in parts]) for col in columns}
+    na_counts = np.array([part[1] for part in parts])
+    print("Distributions collected in "+str(time()-start)+" s, "+str(na_counts.sum())+" missing values in "+str(np.sum(na_counts.sum(axis=0)>0))+" columns")
+    if args.save_distributions is not None: pickle.dump(distributions,open(args.save_distributions,'wb'))
+    observed = distributions
+    if args.distributions is not None:
+        saved = pickle.load(open(args.distributions,'rb'))
+        missing = [col for col in columns if col not in saved]
+        if len(missing)>0: raise ValueError("Columns not found from "+args.distributions+": "+','.join(missing))
+        distributions = {col:saved[col] for col in columns}
+    empty = [col for col in columns if len(distributions[col][0])<1 and na_counts[:,columns.index(col)].sum()>0]
+    if len(empty)>0: print("No observed values to impute from, left missing: "+','.join(empty))
+    #columns with only integer values (both observed and imputed) are written as integers
+    integer_columns = [col for col in columns if col not in args.string_columns and len(distributions[col][0])>0 and np.all(distributions[col][0]%1==0) and np.all(observed[col][0]%1==0)]
+
+    #second pass: impute each part, the draws of each column continue from where the previous parts ended
+    offsets = np.vstack([np.zeros((1,len(columns)),dtype=np.int64),np.cumsum(na_counts,axis=0)[:-1]])
+    tasks = [(args.infile,header,columns,range_start,range_end,args.chunksize,args.id_column,args.string_columns,distributions,offsets[i],args.seed,integer_columns,args.outfile+'.part'+str(i))
+             for i,(range_start,range_end) in enumerate(ranges)]
+    with ProcessPoolExecutor(max_workers=args.nproc) as executor:
+        partnames = list(executor.map(_impute_part,tasks))
+    with open(args.outfile,'wt') as outfile:
+        csv.writer(outfile,delimiter=',').writerow(header)
+        for partname in partnames:
+            with open(partname,'rt') as part: shutil.copyfileobj(part,outfile)
+            os.remove(partname)
+    end = time()
+    print("Imputed file written in "+str(end-start)+" s")
+
+if __name__=='__main__':
+    impute_missing_data()
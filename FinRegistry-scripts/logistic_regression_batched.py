@@ -0,0 +1,206 @@
+#Age and sex adjusted logistic regression models COVIDVax ~ SEX + age_october_2021 + variable for each variable separately,
+#Python version of runLogisticRegression_chunks.R (with --isCat no).
+#Instead of fitting the models one at a time, the models of a block of variables are fitted together with Newton's method (IRLS),
+#where each model only uses the rows where its variable (and the outcome and covariates) are not missing. The blocks of variables
+#are fitted in parallel processes, and the coefficients, standard errors and p-values of all models are written into one table.
+import pandas as pd
+import numpy as np
+import argparse
+
+from time import time
+from scipy.stats import norm
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+TERMS = ['(Intercept)','SEX','age_october_2021']
+
+def read_names(fname):
+    #comma and/or newline separated variable names
+    with open(fname,'rt') as infile: return [name.strip() for name in infile.read().replace('\n',',').split(',') if len(name.strip())>0]
+
+def read_reference_levels(fname):
+    #variable name prefixes and the corresponding reference level variables, one comma-separated pair per line
+    with open(fname,'rt') as infile: return [line.strip().split(',')[:2] for line in infile if len(line.strip())>0]
+
+def reference_variable(variable,ref_levels):
+    #reference level variable of the first prefix matching the variable, None if there is no matching prefix
+    for prefix,refvar in ref_levels:
+        if variable.startswith(prefix): return refvar
+    return None
+
+def hessian(C,C_pairs,pairs,W,X,use_sex):
+    #Hessian of the negative log-likelihood of each model with weights W (shape (n,k)), shape (k,4,4)
+    k = X.shape[1]
+    H = np.zeros((k,4,4))
+    shared = C_pairs.T@W
+    for i,(a,b) in enumerate(pairs): H[:,a,b] = H[:,b,a] = shared[i]
+    WX = W*X
+    H[:,:3,3] = H[:,3,:3] = (C.T@WX).T
+    H[:,3,3] = np.sum(WX*X,axis=0)
+    #models without SEX: the coefficient of SEX is fixed to 0
+    H[~use_sex,1,:] = H[~use_sex,:,1] = 0
+    H[~use_sex,1,1] = 1
+    return H
+
+def fit_block(y,C,X,masks,use_sex,maxit=25,epsilon=1e-8):
+    #fit the logistic regression models y ~ C + X[:,j] for all columns j of X at the same time
+    #C = covariates (intercept, SEX, age) shared by all models, shape (n,3)
+    #masks = rows used by each model, shape (n,k), use_sex = whether SEX is used in each model, shape (k,)
+    #the convergence criterion is the same as in R's glm: |dev-dev_old|/(|dev|+0.1) < epsilon
+    #returns the coefficients and their covariance matrices, shapes (k,4) and (k,4,4), and a convergence indicator of each model
+    n,k = X.shape
+    W_mask = masks.astype(float)
+    X = np.where(masks,X,0.0)
+    beta = np.zeros((k,4))
+    deviance = np.full(k,np.inf)
+    converged = np.zeros(k,dtype=bool)
+    #products of the shared covariates needed for the Hessian, pairs (a,b) with a<=b
+    pairs = [(a,b) for a in range(3) for b in range(a,3)]
+    C_pairs = np.column_stack([C[:,a]*C[:,b] for a,b in pairs])
+    p = 1/(1+np.exp(-(C@beta[:,:3].T+X*beta[:,3])))
+    for it in range(maxit):
+        #Newton step, pseudoinverse is used so that singular models do not stop the fitting of the whole block
+        R = W_mask*(y[:,None]-p)
+        grad = np.column_stack([(C.T@R).T,np.sum(X*R,axis=0)])
+        grad[~use_sex,1] = 0
+        H = hessian(C,C_pairs,pairs,W_mask*p*(1-p),X,use_sex)
+        beta = beta+(np.linalg.pinv(H)@grad[:,:,None])[:,:,0]
+        #deviance at the new coefficients
+        eta = C@beta[:,:3].T+X*beta[:,3]
+        p = 1/(1+np.exp(-eta))
+        new_deviance = -2*np.sum(W_mask*np.log(np.maximum(np.where(y[:,None]>0,p,1-p),1e-300)),axis=0)
+        converged = np.abs(new_deviance-deviance)/(np.abs(new_deviance)+0.1)<epsilon
+        deviance = new_deviance
+        if np.all(converged): break
+    #covariance matrix = inverse of the Hessian at the final coefficients
+    H = hessian(C,C_pairs,pairs,W_mask*p*(1-p),X,use_sex)
+    cov = np.linalg.pinv(H)
+    cov[~use_sex,1,:] = cov[~use_sex,:,1] = np.nan
+    #models where the variable is constant (or otherwise singular) get NA coefficients
+    singular = np.linalg.matrix_rank(H)<4
+    beta[singular] = np.nan
+    return beta,cov,converged
+
+#training data of the worker processes, set by _init_worker
+_data = {}
+
+def _init_worker(shm_name,shape,dtype,index,y,C,covariate_ok):
+    #the variables are read from shared memory, the rest of the data is small and copied into each worker
+    shm = shared_memory.SharedMemory(name=shm_name)
+    #the reference to shm keeps the shared memory mapped as long as the worker is alive
+    _data['shm'] = shm
+    _data['X'] = np.ndarray(shape,dtype=dtype,buffer=shm.buf,order='F')
+    _data.update(index=index,y=y,C=C,covariate_ok=covariate_ok)
+
+def _fit_task(task):
+    #fit the models of one block of variables
+    variables,ref_columns,maxit = task
+    y,C,covariate_ok = _data['y'],_data['C'],_data['covariate_ok']
+    inds = [_data['index'][variable] for variable in variables]
+    X = _data['X'][:,inds].astype(np.float64)
+    masks = ~np.isnan(X) & covariate_ok[:,None]
+    for j,refvar in enumerate(ref_columns):
+        #if the variable category has a reference level, use only the rows where either the variable or the reference variable is >0
+        if refvar is not None:
+            ref = _data['X'][:,_data['index'][refvar]]
+            masks[:,j] &= (ref>0) | (X[:,j]>0)
+    use_sex = np.array(['BIRTH_' not in variable for variable in variables])
+    beta,cov,converged = fit_block(y,C,X,masks,use_sex,maxit=maxit)
+    se = np.sqrt(np.diagonal(cov,axis1=1,axis2=2))
+    rows = []
+    for j,variable in enumerate(variables):
+        for t,term in enumerate(TERMS+[variable]):
+            #for birth registry variables we only have women, so sex is not used for adjusting
+            if term=='SEX' and not use_sex[j]: continue
+            z = beta[j,t]/se[j,t]
+            #confidence interval and p-value as in summary(bigglm)
+            rows.append([variable,term,beta[j,t],beta[j,t]-2*se[j,t],beta[j,t]+2*se[j,t],se[j,t],2*norm.sf(np.abs(z)),int(masks[:,j].sum()),bool(converged[j])])
+    return rows
+
+def logistic_regression_batched():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--trainfile",help="Full path to the training data (.csv, .parquet or .feather).",type=str)
+    parser.add_argument("--selectfile",help="Full path to the file containing column names used as variables in the logistic regression models.",type=str)
+    parser.add_argument("--reflevelfile",help="File containing variable name prefixes and variable names used as reference for these variable categories (default=None). If no reference level variable is given, all other values are used as controls for each variable.",
+                        type=str,default=None)
+    parser.add_argument("--endpointfile",help="File containing the DISEASE endpoints to analyze, other DISEASE variables are skipped (default=None, all are analyzed).",type=str,default=None)
+    parser.add_argument("--outfile",help="Full path to the output file containing the coefficients of all models.",type=str)
+    parser.add_argument("--nproc",help="Number of parallel processes used (default=32).",type=int,default=32)
+    parser.add_argument("--blocksize",help="Number of variables fitted together in one block (default=16). Each process holds about ten float64 arrays of size rows x blocksize.",type=int,default=16)
+    parser.add_argument("--maxit",help="Maximum number of IRLS iterations (default=25, as in glm).",type=int,default=25)
+    parser.add_argument("--max_age",help="Only individuals younger than this are used (default=80).",type=float,default=80)
+
+    args = parser.parse_args()
+
+    start = time()
+    from xgboost_training_skopt import read_columns
+    ref_levels = read_reference_levels(args.reflevelfile) if args.reflevelfile is not None else []
+    used_endpoint_names = set(read_names(args.endpointfile)) if args.endpointfile is not None else None
+    select_columns = list(dict.fromkeys(read_names(args.selectfile)+[refvar for prefix,refvar in ref_levels]+['COVIDVax','SEX','age_october_2021']))
+
+    df = read_columns(args.trainfile,select_columns)
+    #subset to younger than max_age
+    df = df.loc[df['age_october_2021']<args.max_age]
+    print('Data read in in '+str(time()-start)+' s, '+str(len(df))+' rows.')
+
+    #variables used to adjust the models are skipped
+    skips = set(['SEX','age_october_2021','COVIDVax']+[refvar for prefix,refvar in ref_levels])
+    columns = [col for col in df.columns if col not in skips]
+    X = np.asfortranarray(df[columns+[refvar for prefix,refvar in ref_levels if refvar not in columns]].to_numpy(dtype=np.float32,na_value=np.nan))
+    index = {col:i for i,col in enumerate(columns+[refvar for prefix,refvar in ref_levels if refvar not in columns])}
+    y = df['COVIDVax'].to_numpy(dtype=float,na_value=np.nan)
+    sex = df['SEX'].to_numpy(dtype=float,na_value=np.nan)
+    age = df['age_october_2021'].to_numpy(dtype=float,na_value=np.nan)
+    covariate_ok = ~(np.isnan(y) | np.isnan(sex) | np.isnan(age))
+    C = np.column_stack([np.ones(len(df)),np.nan_to_num(sex),np.nan_to_num(age)])
+    y = np.nan_to_num(y)
+    del(df)
+
+    variables = []
+    for variable in columns:
+        #test if this variable corresponds to an endpoint that should be omitted
+        if variable.startswith('DISEASE') and used_endpoint_names is not None and variable not in used_endpoint_names:
+            print('skipping '+variable)
+            continue
+        #If variable only has zero values, skip it
+        if not np.nanmax(X[:,index[variable]],initial=-np.inf)>=1: continue
+        variables.append(variable)
+    print(str(len(variables))+' variables analyzed in blocks of '+str(args.blocksize))
+
+    tasks = []
+    for i in range(0,len(variables),args.blocksize):
+        block = variables[i:i+args.blocksize]
+        tasks.append((block,[reference_variable(variable,ref_levels) for variable in block],args.maxit))
+    rows = []
+    #copy the variables into shared memory, the workers only read it
+    #(the workers get the data from the initializer, so this works with the fork, forkserver and spawn start methods)
+    shm = shared_memory.SharedMemory(create=True,size=max(1,X.nbytes))
+    try:
+        X_shared = np.ndarray(X.shape,dtype=X.dtype,buffer=shm.buf,order='F')
+        X_shared[:] = X
+        del(X)
+        with ProcessPoolExecutor(max_workers=args.nproc,initializer=_init_worker,
+                                 initargs=(shm.name,X_shared.shape,X_shared.dtype,index,y,C,covariate_ok)) as executor:
+            for block_rows in executor.map(_fit_task,tasks):
+                rows += block_rows
+                print(str(len(set(row[0] for row in rows)))+' models fit.')
+        del(X_shared)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    results = pd.DataFrame(rows,columns=['variable','term','Coef','(95%','CI)','SE','p','N','converged'])
+    results.to_csv(args.outfile,index=False,na_rep='NA')
+    if not results['converged'].all(): print('Models that did not converge: '+','.join(results.loc[~results['converged'],'variable'].unique()))
+    end = time()
+    print("duration: "+str(end-start)+" s")
+
+if __name__=='__main__':
+    logistic_regression_batched()
@@ -0,0 +1,242 @@
+#Streaming merge of the intermediate variable files into the wide combined file and the training and test set files.
+#All input files must be sorted by FINREGISTRYID and contain exactly the same IDs (see create_variables_for_vaccination_project_final.md),
+#which means that the files can be combined block by block without holding all of the columns in memory at once.
+#The output files can be written either as csv or in a columnar format (parquet or feather) with compact column types,
+#which allows reading in only the columns needed by a model (see xgboost_training_skopt.py).
+import pandas as pd
+import numpy as np
+import random
+import argparse
+import re
+
+from time import time
+from os.path import getsize
+from itertools import islice
+
+#values that pd.read_csv reads as missing by default, the csv output writes them as empty fields as pandas.to_csv does
+NA_VALUES = ['#N/A','#N/A N/A','#NA','-1.#IND','-1.#QNAN','-NaN','-nan','1.#IND','1.#QNAN','<NA>','N/A','NA','NULL','NaN','None','n/a','nan','null']
+NA_FIELD = re.compile(',(?:'+'|'.join(re.escape(value) for value in NA_VALUES)+')(?=,|$)')
+
+def count_rows(fname):
+    #count the number of data rows (lines not counting the header) in a file
+    nlines = 0
+    last = b'\n'
+    with open(fname,'rb') as infile:
+        for block in iter(lambda: infile.read(1<<24),b''):
+            nlines += block.count(b'\n')
+            last = block[-1:]
+    if last!=b'\n': nlines += 1 #last line without a newline
+    return nlines-1
+
+def train_indicator(nrows,train_fraction,seed):
+    #assign train_fraction of the rows to the training set and the rest to the test set
+    #this gives the same assignment as random.sample over the row indices of the full combined dataframe
+    random.seed(seed)
+    is_train = np.zeros(nrows,dtype=bool)
+    is_train[random.sample(range(nrows),int(train_fraction*nrows))] = True
+    return is_train
+
+def read_exclude_ids(fname):
+    #read in IDs to exclude, one ID per line
+    with open(fname,'rt') as infile: return set(line.strip() for line in infile if len(line.strip())>0)
+
+def smallest_int_type(lo,hi,nullable):
+    #smallest integer type that can hold values from lo to hi, nullable types are used for columns with NAs
+    for dtype in ['uint8','int8','uint16','int16','uint32','int32']:
+        if lo>=np.iinfo(dtype).min and hi<=np.iinfo(dtype).max: break
+    else: dtype = 'int64'
+    if nullable: dtype = 'UInt'+dtype[4:] if dtype.startswith('uint') else 'Int'+dtype[3:]
+    return dtype
+
+def column_dtypes(infiles,blocksize):
+    #scan through the input files and choose a compact type for each column:
+    #uint8 for binary indicators, smallest possible integer type for other integer valued columns
+    #(nullable integer type if the column contains NAs), float64 for other numeric columns and str for everything else
+    stats = {} #key = column name, value = [isNumeric,isInteger,hasNA,min,max]
+    for fname in infiles:
+        for block in pd.read_csv(fname,delimiter=',',chunksize=blocksize):
+            numeric = block.select_dtypes(include=['number','bool']).astype(float)
+            is_integer = ((numeric%1==0) | numeric.isna()).all()
+            has_na = numeric.isna().any()
+            mins = numeric.min()
+            maxs = numeric.max()
+            for col in block.columns:
+                if col not in numeric.columns: block_stats = [False,False,True,np.nan,np.nan]
+                else: block_stats = [True,is_integer[col],has_na[col],mins[col],maxs[col]]
+                if col not in stats: stats[col] = block_stats
+                else:
+                    old = stats[col]
+                    stats[col] = [old[0] and block_stats[0],old[1] and block_stats[1],old[2] or block_stats[2],np.fmin(old[3],block_stats[3]),np.fmax(old[4],block_stats[4])]
+        print(fname+" scanned for column types.")
+
+    dtypes = {}
+    for col in stats:
+        isNumeric,isInteger,hasNA,lo,hi = stats[col]
+        if col=='FINREGISTRYID' or not isNumeric: dtypes[col] = str
+        elif isInteger and not np.isnan(lo): dtypes[col] = smallest_int_type(lo,hi,hasNA)
+        else: dtypes[col] = 'float64'
+    return dtypes
+
+def arrow_schema(columns,dtypes):
+    #arrow schema corresponding to the column types from column_dtypes
+    import pyarrow as pa
+    fields = []
+    for col in columns:
+        dtype = dtypes[col]
+        if dtype==str: fields.append(pa.field(col,pa.string()))
+        else: fields.append(pa.field(col,pa.from_numpy_dtype(np.dtype(dtype.lower()))))
+    return pa.schema(fields)
+
+def check_headers(headers,infiles):
+    #each file must have FINREGISTRYID as the first column and all other column names must be unique
+    columns = []
+    for i in range(len(headers)):
+        if headers[i][0]!='FINREGISTRYID': raise ValueError("First column of "+infiles[i]+" is not FINREGISTRYID")
+        columns += headers[i][1:]
+    duplicates = pd.Index(columns)[pd.Index(columns).duplicated()]
+    if len(duplicates)>0: raise ValueError("Column names found from more than one input file: "+','.join(duplicates))
+    return ['FINREGISTRYID']+columns
+
+def check_ids(ids,infiles,first_row):
+    #check that the IDs read from each file are the same
+    for i in range(len(ids)):
+        if len(ids[i])!=len(ids[0]): raise ValueError("Number of rows differs between "+infiles[0]+" and "+infiles[i])
+        if not np.array_equal(ids[i],ids[0]):
+            raise ValueError("IDs in "+infiles[i]+" are not in the same order as in "+infiles[0]+" (rows "+str(first_row)+"-"+str(first_row+len(ids[0])-1)+")")
+
+def merged_lines(infiles,blocksize):
+    #read the sorted files in blocks of blocksize lines and yield the blocks combined into lines of the wide file
+    #the values are copied as text, so they are written out as they are in the input files, except that missing values
+    #(e.g. NA) are written as empty fields, which is how missing values are written when the blocks are read and written with pandas
+    #yields the header line first and then tuples of (index of the first row in the block, IDs, lines)
+    handles = [open(fname,'rt') for fname in infiles]
+    headers = [handle.readline().rstrip('\r\n').split(',') for handle in handles]
+    yield ','.join(check_headers(headers,infiles))+'\n'
+    first_row = 0
+    while True:
+        blocks = [[line.rstrip('\r\n').split(',',1) for line in islice(handle,blocksize)] for handle in handles]
+        if all(len(block)<1 for block in blocks): break
+        ids = [np.array([row[0] for row in block]) for block in blocks]
+        check_ids(ids,infiles,first_row)
+        lines = [NA_FIELD.sub(',',','.join([row[0]]+[block[j][1] for block in blocks]))+'\n' for j,row in enumerate(blocks[0])]
+        yield first_row,ids[0],lines
+        first_row += len(lines)
+    for handle in handles: handle.close()
+
+def merged_blocks(infiles,blocksize,dtypes):
+    #read the sorted files in blocks of blocksize rows with the given column types and yield the blocks combined into one dataframe
+    #yields tuples of (index of the first row in the block, IDs, dataframe)
+    readers = [pd.read_csv(fname,delimiter=',',dtype=dtypes,chunksize=blocksize) for fname in infiles]
+    first_row = 0
+    while True:
+        blocks = [next(reader,None) for reader in readers]
+        if all(block is None for block in blocks): break
+        if any(block is None for block in blocks): raise ValueError("Number of rows differs between the input files")
+        if first_row<1: check_headers([list(block.columns) for block in blocks],infiles)
+        ids = [block['FINREGISTRYID'].values for block in blocks]
+        check_ids(ids,infiles,first_row)
+        combined = pd.concat([blocks[0]]+[block.drop('FINREGISTRYID',axis=1) for block in blocks[1:]],axis=1)
+        yield first_row,ids[0],combined
+        first_row += len(combined)
+
+class BlockWriter:
+    #writes blocks of rows one at a time to a csv, parquet or feather file
+    #for csv the blocks are lists of lines, for the columnar formats dataframes with column types from column_dtypes
+    def __init__(self,fname,outformat,header=None,dtypes=None):
+        self.fname = fname
+        self.outformat = outformat
+        self.header = header
+        self.dtypes = dtypes
+        self.writer = None
+
+    def write(self,block):
+        if self.outformat=='csv':
+            if self.writer is None:
+                self.writer = open(self.fname,'wt')
+                self.writer.write(self.header)
+            self.writer.writelines(block)
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self.writer is None:
+            self.schema = arrow_schema(block.columns,self.dtypes)
+            if self.outformat=='parquet': self.writer = pq.ParquetWriter(self.fname,self.schema)
+            else: self.writer = pa.ipc.new_file(self.fname,self.schema,options=pa.ipc.IpcWriteOptions(compression='lz4'))
+        self.writer.write_table(pa.Table.from_pandas(block,schema=self.schema,preserve_index=False))
+
+    def close(self):
+        if self.writer is not None: self.writer.close()
+
+def subset(block,mask):
+    #rows of a block (list of lines or dataframe) where mask is True
+    if isinstance(block,list): return [line for line,m in zip(block,mask) if m]
+    return block.loc[mask]
+
+def merge_sorted_variable_files():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--infiles",help="Full paths to the sorted input files, the columns are combined in this order.",type=str,nargs='+')
+    parser.add_argument("--outfile",help="Full path to the combined output file containing all IDs (default=None, not written).",type=str,default=None)
+    parser.add_argument("--trainfile",help="Full path to the training set output file (default=None, not written).",type=str,default=None)
+    parser.add_argument("--testfile",help="Full path to the test set output file (default=None, not written).",type=str,default=None)
+    parser.add_argument("--excludefile",help="Full path to a file containing IDs (one per line) left out from the training and test sets, e.g. people living in Askola (default=None).",type=str,default=None)
+    parser.add_argument("--train_fraction",help="Fraction of individuals assigned to the training set (default=0.8).",type=float,default=0.8)
+    parser.add_argument("--seed",help="Random seed used for the training/test split (default=42).",type=int,default=42)
+    parser.add_argument("--blocksize",help="Number of rows read from each file at a time (default=100000).",type=int,default=100000)
+    parser.add_argument("--outformat",help="Format of the output files (default=csv). Columnar formats use compact column types and allow reading in only selected columns.",
+                        type=str,default="csv",choices=['csv','parquet','feather'])
+
+    args = parser.parse_args()
+
+    start = time()
+    split = args.trainfile is not None or args.testfile is not None
+    if args.outfile is None and not split: parser.error("at least one of --outfile, --trainfile or --testfile is needed")
+
+    if split:
+        #the split is defined over all rows of the combined file, so the number of rows needs to be known beforehand
+        #all files have the same rows, so count them from the smallest one
+        nrows = count_rows(min(args.infiles,key=getsize))
+        is_train = train_indicator(nrows,args.train_fraction,args.seed)
+        print("Number of rows in the combined file: "+str(nrows))
+    exclude_ids = read_exclude_ids(args.excludefile) if args.excludefile is not None else set()
+    print("Number of IDs excluded from training and test sets: "+str(len(exclude_ids)))
+
+    if args.outformat=='csv':
+        blocks = merged_lines(args.infiles,args.blocksize)
+        header,dtypes = next(blocks),None
+    else:
+        #types of the columns need to be known before writing the first block
+        dtypes = column_dtypes(args.infiles,args.blocksize)
+        print("Column types: "+str(pd.Series([str(dtypes[col]) for col in dtypes]).value_counts().to_dict()))
+        blocks = merged_blocks(args.infiles,args.blocksize,dtypes)
+        header = None
+
+    outfiles = {}
+    for name,fname in [('all',args.outfile),('train',args.trainfile),('test',args.testfile)]:
+        if fname is not None: outfiles[name] = BlockWriter(fname,args.outformat,header,dtypes)
+
+    rowcount = 0
+    for first_row,ids,block in blocks:
+        if 'all' in outfiles: outfiles['all'].write(block)
+        if split:
+            if first_row+len(ids)>nrows: raise ValueError("The input files contain more rows than counted from the smallest file")
+            keep = np.array([ID not in exclude_ids for ID in ids],dtype=bool)
+            block_is_train = is_train[first_row:first_row+len(ids)]
+            if 'train' in outfiles: outfiles['train'].write(subset(block,keep & block_is_train))
+            if 'test' in outfiles: outfiles['test'].write(subset(block,keep & ~block_is_train))
+        rowcount += len(ids)
+        print(str(rowcount)+" rows written.")
+
+    for name in outfiles: outfiles[name].close()
+    if split and rowcount!=nrows: raise ValueError("The input files contain fewer rows than counted from the smallest file")
+    end = time()
+    print("Files merged in "+str(end-start)+" s")
+
+if __name__=='__main__':
+    merge_sorted_variable_files()
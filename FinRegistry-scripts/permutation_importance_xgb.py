@@ -0,0 +1,155 @@
+#Permutation importance of variable groups for a trained XGBoost model (_best_xgb_model.pkl from xgboost_training_skopt.py).
+#The test set is read in once and copied into shared memory, which the worker processes attach to without copying it.
+#For each variable group (a file listing the variables like the --allvars file, or the --shufflefile of runglmnet_chunks_0822.R)
+#and each repeat, a worker permutes the rows of the group's columns jointly and scores the model on the permuted test set.
+#The permuted matrix is never built: the test set is predicted in chunks of rows, and only the chunk being predicted is copied
+#and has the group's columns replaced by the permuted values. The importance of a group is the drop in AUC and AUPRC compared
+#to the unpermuted test set, and the confidence interval is given by the percentiles of the drops over the repeats.
+import pandas as pd
+import numpy as np
+import pickle
+import argparse
+
+from time import time
+from os.path import basename
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+from sklearn.metrics import average_precision_score,roc_auc_score
+from xgboost_training_skopt import read_columns,to_matrix
+from evaluate_xgb_models import read_variable_list,expand_globs
+from bootstrap_metrics import percentiles
+
+#test set, labels and model of the worker processes
+_worker = {}
+
+def _init_worker(shm_name,shape,dtype,y_test,model_file,nthread,chunksize):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    #the reference to shm keeps the shared memory mapped as long as the worker is alive
+    _worker['shm'] = shm
+    _worker['X'] = np.ndarray(shape,dtype=dtype,buffer=shm.buf)
+    _worker['y'] = y_test
+    _worker['booster'] = load_booster(model_file,nthread)
+    _worker['chunksize'] = chunksize
+
+def load_booster(model_file,nthread):
+    #booster of the saved XGBClassifier
+    booster = pickle.load(open(model_file,'rb')).get_booster()
+    booster.set_param({'nthread':nthread})
+    return booster
+
+def predict_permuted(booster,X,columns,permutation,chunksize):
+    #predicted probabilities for X where the rows of the given columns are reordered by permutation
+    #(columns=[] gives the predictions of the unpermuted data), X is copied only chunksize rows at a time
+    y_score = np.empty(X.shape[0])
+    for start in range(0,X.shape[0],chunksize):
+        end = min(start+chunksize,X.shape[0])
+        chunk = np.array(X[start:end])
+        if len(columns)>0: chunk[:,columns] = X[permutation[start:end][:,None],columns]
+        y_score[start:end] = booster.inplace_predict(chunk)
+    return y_score
+
+def _permutation_task(task):
+    #AUC and AUPRC of the test set where the columns of one group are permuted, the permutation depends only on the seed,
+    #the group and the repeat, so the results do not depend on the number of processes
+    group_index,columns,repeat,seed = task
+    X,y = _worker['X'],_worker['y']
+    permutation = np.random.default_rng([seed,group_index,repeat]).permutation(X.shape[0])
+    y_score = predict_permuted(_worker['booster'],X,columns,permutation,_worker['chunksize'])
+    return group_index,repeat,roc_auc_score(y,y_score),average_precision_score(y,y_score)
+
+def importance_table(groups,n_variables,scores,baseline,ci_percentiles):
+    #mean, standard deviation and percentile CI of the drop in AUC and AUPRC of each group
+    #scores = dataframe with columns group, repeat, AUC and AUPRC of the permuted test sets
+    rows = []
+    for group,n_vars in zip(groups,n_variables):
+        group_scores = scores.loc[scores['group']==group]
+        row = {'group':group,'n_variables':n_vars,'n_repeats':len(group_scores)}
+        for metric in ['AUC','AUPRC']:
+            drops = baseline[metric]-group_scores[metric].values
+            lower,upper = percentiles(drops,ci_percentiles)
+            row.update({metric+'_baseline':baseline[metric],metric+'_permuted_mean':group_scores[metric].mean(),metric+'_drop_mean':drops.mean(),
+                        metric+'_drop_std':drops.std(),metric+'_drop_lower_CI':lower,metric+'_drop_upper_CI':upper})
+        rows.append(row)
+    return pd.DataFrame(rows).sort_values('AUC_drop_mean',ascending=False)
+
+def permutation_importance_xgb():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--outdir",help="Full path to the output directory.",type=str)
+    parser.add_argument("--model",help="Full path to the saved model (_best_xgb_model.pkl).",type=str)
+    parser.add_argument("--varname",help="Model name used as the prefix of the output files (default=var).",type=str,default='var')
+    parser.add_argument("--testfile",help="Full path to the file containing test samples (.csv, .parquet or .feather).",type=str)
+    parser.add_argument("--allvars",help="Full path to the text file containing names of all variables used in the model.",type=str)
+    parser.add_argument("--groupfiles",help="Glob patterns (quoted) of the files listing the variables of each group in the same format as --allvars, the group name is the file name without the extension.",
+                        type=str,nargs='+')
+    parser.add_argument("--n_repeats",help="Number of permutations of each group (default=20).",type=int,default=20)
+    parser.add_argument("--ci_percentiles",help="Lower and upper percentiles of the importance drops over the repeats reported as the confidence interval (default=5 95, i.e. 90%% CI).",
+                        type=float,default=[5,95],nargs=2)
+    parser.add_argument("--nproc",help="Number of parallel processes used (default=32).",type=int,default=32)
+    parser.add_argument("--nthread",help="Number of xgboost threads in each process (default=1).",type=int,default=1)
+    parser.add_argument("--chunksize",help="Number of test set rows predicted at a time in each process (default=50000).",type=int,default=50000)
+    parser.add_argument("--seed",help="Random seed of the permutations (default=42).",type=int,default=42)
+
+    args = parser.parse_args()
+
+    start = time()
+    #read in the test set, the model was trained with the columns in the order they are in the training file
+    all_vars = read_variable_list(args.allvars)
+    df_test = read_columns(args.testfile,all_vars)
+    y_test = df_test['COVIDVax'].values
+    columns = [col for col in df_test.columns if col!='COVIDVax']
+    X_test = to_matrix(df_test[columns])
+    del(df_test)
+    print("Test set with "+str(X_test.shape[1])+" variables read in in "+str(time()-start)+" s")
+
+    #column indices of each variable group, variables not used by the model are skipped
+    column_index = {col:i for i,col in enumerate(columns)}
+    groups,group_columns = [],[]
+    for fname in expand_globs(args.groupfiles):
+        group = basename(fname).rsplit('.',1)[0]
+        variables = read_variable_list(fname)
+        missing = [var for var in variables if var not in column_index]
+        if len(missing)>0: print(group+": "+str(len(missing))+" variables not used by the model are skipped: "+','.join(missing[:10])+(',...' if len(missing)>10 else ''))
+        inds = sorted(set(column_index[var] for var in variables if var in column_index))
+        if len(inds)<1:
+            print(group+": no variables used by the model, skipping the group")
+            continue
+        groups.append(group)
+        group_columns.append(inds)
+    if len(set(groups))<len(groups): raise ValueError("Group names are not unique: "+','.join(pd.Index(groups)[pd.Index(groups).duplicated()]))
+
+    #copy the test set into shared memory, the workers only read it
+    shm = shared_memory.SharedMemory(create=True,size=X_test.nbytes)
+    try:
+        X_shared = np.ndarray(X_test.shape,dtype=X_test.dtype,buffer=shm.buf)
+        X_shared[:] = X_test
+        del(X_test)
+        baseline_score = predict_permuted(load_booster(args.model,args.nproc*args.nthread),X_shared,[],None,args.chunksize)
+        baseline = {'AUC':roc_auc_score(y_test,baseline_score),'AUPRC':average_precision_score(y_test,baseline_score)}
+        print("Test set AUC "+str(baseline['AUC'])+", AUPRC "+str(baseline['AUPRC']))
+
+        tasks = [(i,inds,repeat,args.seed) for i,inds in enumerate(group_columns) for repeat in range(args.n_repeats)]
+        with ProcessPoolExecutor(max_workers=max(1,min(args.nproc,len(tasks))),initializer=_init_worker,
+                                 initargs=(shm.name,X_shared.shape,X_shared.dtype,y_test,args.model,args.nthread,args.chunksize)) as executor:
+            results = list(executor.map(_permutation_task,tasks))
+        del(X_shared)
+    finally:
+        shm.close()
+        shm.unlink()
+    print(str(len(tasks))+" permutations of "+str(len(groups))+" groups scored in "+str(time()-start)+" s")
+
+    scores = pd.DataFrame([(groups[i],repeat,auc,auprc) for i,repeat,auc,auprc in results],columns=['group','repeat','AUC','AUPRC'])
+    scores.to_csv(args.outdir+args.varname+"_permutation_importance_repeats.csv",index=False)
+    importance_table(groups,[len(inds) for inds in group_columns],scores,baseline,args.ci_percentiles).to_csv(args.outdir+args.varname+"_permutation_importance.csv",index=False)
+    end = time()
+    print("duration: "+str(end-start)+" s")
+
+if __name__=='__main__':
+    permutation_importance_xgb()
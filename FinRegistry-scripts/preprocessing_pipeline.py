@@ -0,0 +1,403 @@
+#Runner for the preprocessing steps that create the variable files and the training and test set files.
+#Each step (stage) is declared with its input and output files: stages are either commands (e.g. the Python scripts),
+#sections of the R script or sections of create_variables_for_vaccination_project_final.md, whose Python code blocks are
+#extracted and run as one script. A stage is rerun only if its code, its parameters or the content of its input files have
+#changed since its outputs were last created (or if the outputs have been removed or modified). The content hashes of the
+#files are cached by file size and modification time, so unchanged files are not read again. Stages whose inputs are ready
+#are run in parallel processes.
+#The original absolute paths of the data files are used in the stage declarations, and they can be redirected to other
+#directories with --datadir, --processeddir and --path_map (e.g. for running the pipeline on test data).
+import json
+import hashlib
+import os
+import re
+import subprocess
+import sys
+import argparse
+
+from time import time
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
+from threading import Lock
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+NOTEBOOK = 'create_variables_for_vaccination_project_final.md'
+R_SCRIPT = 'script_create_variables_for_vaccination_project.R'
+DATA = '/data/projects/vaccination_project/data/'
+PROCESSED = '/data/processed_data/'
+#imports that are available to every notebook section, as they would be when the notebook is run from the top
+NOTEBOOK_PRELUDE = '''import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+import csv
+import numpy as np
+import pandas as pd
+from os import system
+from time import time
+'''
+
+def stage(name,inputs,outputs,command=None,section=None,code_files=[],params={}):
+    #declaration of a stage, either a command (list of arguments, '{param}' is replaced by the value of the parameter)
+    #or a section (file name, section title) of the notebook or the R script
+    return {'name':name,'inputs':inputs,'outputs':outputs,'command':command,'section':section,'code_files':code_files,'params':dict(params)}
+
+def sort_stage(fname):
+    #sort a variable file by FINREGISTRYID for merge_sorted_variable_files.py, the header row sorts first
+    name = 'sort_'+os.path.basename(fname).replace('vaccination_project_','').split('.')[0]
+    return stage(name,[fname],[fname+'.sorted'],command=['env','LC_ALL=C','sort','-t',',','-k1,1',fname,'-o',fname+'.sorted'])
+
+def default_stages():
+    #the stages of creating the training and test set files, in the order they were run manually
+    idfile = DATA+'vaccination_project_study_ids_082022.csv'
+    ids = [idfile,DATA+'vaccination_project_study_ids_082022.npy']
+    mpf = PROCESSED+'minimal_phenotype/minimal_phenotype_2022-03-28.csv'
+    inf_script = ['create_variables_from_inf_diseases_and_marriage.py','study_id_index.py']
+    inf_command = ['python','create_variables_from_inf_diseases_and_marriage.py','--outdir',DATA,
+                   '--mpffile',DATA+'vaccination_project_minimalphenotype_082022.csv',
+                   '--deathfile',PROCESSED+'sf_death/thl2021_2196_ksyy_tutkimus.csv.finreg_IDsp',
+                   '--infectiousfile',PROCESSED+'thl_infectious_diseases/infectious_diseases_2022-01-19.feather',
+                   '--marriagefile',PROCESSED+'dvv/Tulokset_1900-2010_tutkhenk_aviohist.txt.finreg_IDsp']
+    stages = [
+        stage('minimal_phenotype_r',[mpf],[DATA+'vaccination_project_minimalphenotype_082022.csv'],
+              section=(R_SCRIPT,'PROCESS THE MINIMAL PHENOTYPE FILE')),
+        stage('vaccination_outcome',[mpf,PROCESSED+'thl_vaccination/vaccination_2022-05-10.csv'],[DATA+'vaccination_outcome_including_covid19+_052022.csv'],
+              section=(R_SCRIPT,'PROCESS VACCINATION REGISTER TO CREATE OUTCOME VARIABLE')),
+        stage('study_ids',[DATA+'vaccination_project_minimalphenotype_082022.csv',PROCESSED+'sf_death/thl2021_2196_ksyy_tutkimus.csv.finreg_IDsp',
+                           PROCESSED+'thl_infectious_diseases/infectious_diseases_2022-01-19.feather'],
+              ids+[DATA+'vaccination_project_infectious_diseases_042022_COVID+_only.csv'],command=inf_command+['--stages','study_ids'],code_files=inf_script),
+        stage('infectious',ids+[PROCESSED+'thl_infectious_diseases/infectious_diseases_2022-01-19.feather'],[DATA+'vaccination_project_infectious_diseases_082022.csv'],
+              command=inf_command+['--stages','infectious'],code_files=inf_script),
+        stage('marriage',ids+[PROCESSED+'dvv/Tulokset_1900-2010_tutkhenk_aviohist.txt.finreg_IDsp'],[DATA+'vaccination_project_marriage_082022.csv'],
+              command=inf_command+['--stages','marriage','--eofu','{eofu}'],code_files=inf_script,params={'eofu':'2021-10-31'}),
+        stage('minimal_phenotype',[idfile,DATA+'ISO639-language-codes-semicolon.csv',PROCESSED+'dvv/Tulokset_1900-2010_tutkhenk_ja_sukulaiset.txt.finreg_IDsp',
+                                   DATA+'vaccination_project_minimalphenotype_042022.csv','/data/projects/project_akarvane/geo/living_municipalities.csv'],
+              [DATA+'vaccination_project_minimalphenotype_DVV_mt_082022.csv'],section=(NOTEBOOK,'Additional minimal phenotype file preprocessing')),
+        stage('earnings',ids+[PROCESSED+'etk_pension/vuansiot_2022-05-12.feather'],[DATA+'vaccination_project_yearly_earnings_082022.csv'],
+              section=(NOTEBOOK,'Pension registry preprocessing'),code_files=['study_id_index.py']),
+        stage('social_hilmo',[idfile,PROCESSED+'thl_soshilmo/thl2019_1776_soshilmo.csv.finreg_IDsp'],[DATA+'vaccination_project_soshilmo_wide_082022.csv'],
+              section=(NOTEBOOK,'Process social HILMO')),
+        stage('social_assistance',[idfile,PROCESSED+'thl_social_assistance/3214_FinRegistry_toitu_MattssonHannele07122020.csv.finreg_IDsp'],
+              [DATA+'vaccination_project_socialassistanceregister_wide_082022.csv'],section=(NOTEBOOK,'Process social assistance register')),
+        stage('birth',[idfile,PROCESSED+'thl_birth/THL2019_1776_synre.csv.finreg_IDsp'],[DATA+'vaccination_project_birthregistry_wide_082022_0fixed.csv'],
+              section=(NOTEBOOK,'Process birth register')),
+        stage('occupation',[idfile,mpf,PROCESSED+'sf_socioeconomic/ammatti_u1442_a.csv.finreg_IDsp'],[DATA+'vaccination_project_occupation_wide_082022.csv'],
+              section=(NOTEBOOK,'Process occupation register')),
+        stage('education',[idfile,mpf,PROCESSED+'sf_socioeconomic/tutkinto_u1442_a.csv.finreg_IDsp'],[DATA+'vaccination_project_education_wide_082022.csv'],
+              section=(NOTEBOOK,'Process registry of education')),
+        stage('drug_names',[idfile,DATA+'drug_purchases_binary_wide_ALL.csv',DATA+'atc_codes_wikipedia.csv'],[DATA+'drug_purchases_binary_wide_ALL_newnames_082022.csv'],
+              section=(NOTEBOOK,'Update the drug purchase file variable names to more interpretable names and truncate ATC-codes to first 5 digits')),
+        stage('endpoint_names',[idfile,DATA+'wide_first_events_endpoints_dicot.csv',DATA+'keep_endpoints_from_Andrius_new.csv',DATA+'FINNGEN_ENDPOINTS_DF8_Final_2021-09-02.csv'],
+              [DATA+'wide_first_events_endpoints_dicot_newnames_08S2022.csv'],section=(NOTEBOOK,'Update endpoint variable names to more interpretable names')),
+        stage('relatives',ids+[PROCESSED+'dvv/Tulokset_1900-2010_tutkhenk_ja_sukulaiset.txt.finreg_IDsp',DATA+'vaccination_outcome_including_covid19+_052022.csv'],
+              [DATA+'vaccination_project_relative_vaccination_status_082022.csv'],section=(NOTEBOOK,'Create variables describing vaccination status of relatives'),
+              code_files=['study_id_index.py','relatives_index.py']),
+        stage('vaccination_status',[idfile,DATA+'vaccination_outcome_including_covid19+_052022.csv'],[DATA+'vaccination_outcome_082022.csv'],
+              section=(NOTEBOOK,'Filter the vaccination status file')),
+    ]
+    #the variable files are combined in this order (see the last section of the notebook)
+    variable_files = [DATA+fname for fname in ['wide_first_events_endpoints_dicot_newnames_08S2022.csv','drug_purchases_binary_wide_ALL_newnames_082022.csv',
+                      'vaccination_project_marriage_082022.csv','vaccination_project_socialassistanceregister_wide_082022.csv',
+                      'vaccination_project_birthregistry_wide_082022_0fixed.csv','vaccination_project_minimalphenotype_DVV_mt_082022.csv',
+                      'vaccination_project_soshilmo_wide_082022.csv','vaccination_project_education_wide_082022.csv',
+                      'vaccination_project_occupation_wide_082022.csv','vaccination_project_yearly_earnings_082022.csv',
+                      'vaccination_project_infectious_diseases_082022.csv','vaccination_project_relative_vaccination_status_082022.csv',
+                      'vaccination_outcome_082022.csv']]
+    sorted_files = []
+    for fname in variable_files:
+        #the birth registry file is already sorted
+        if fname.endswith('_0fixed.csv'): sorted_files.append(fname)
+        else:
+            stages.append(sort_stage(fname))
+            sorted_files.append(fname+'.sorted')
+    combined = DATA+'vaccination_project_combined_variables_wide_30082022.csv'
+    stages.append(stage('merge',sorted_files,[combined],command=['python','merge_sorted_variable_files.py','--infiles']+sorted_files+['--outfile',combined],
+                        code_files=['merge_sorted_variable_files.py']))
+    #NOTE: the Askola IDs file is created by vacc_stats.md
+    train,test = DATA+'vaccination_project_combined_variables_wide_30082022_train',DATA+'vaccination_project_combined_variables_wide_30082022_test'
+    stages.append(stage('split',[combined,DATA+'vaccination_project_study_ids_living_in_Askola_082022.csv'],[train+'.{outformat}',test+'.{outformat}'],
+                        command=['python','merge_sorted_variable_files.py','--infiles',combined,'--excludefile',DATA+'vaccination_project_study_ids_living_in_Askola_082022.csv',
+                                 '--trainfile',train+'.{outformat}','--testfile',test+'.{outformat}','--train_fraction','{train_fraction}','--seed','{seed}','--outformat','{outformat}'],
+                        code_files=['merge_sorted_variable_files.py'],params={'train_fraction':'0.8','seed':'42','outformat':'csv'}))
+    return stages
+
+def notebook_section(fname,title):
+    #Python code blocks of the notebook section with the given title (from the heading to the next heading of the same level)
+    #IPython magics (lines starting with %) are left out
+    code = []
+    in_section = in_block = False
+    with open(fname,'rt') as infile:
+        for line in infile:
+            if line.startswith('## '):
+                if in_section: break
+                in_section = line[3:].strip()==title
+            elif in_section and line.startswith('```'):
+                in_block = line.strip()=='```python'
+            elif in_section and in_block and not line.startswith('%'): code.append(line)
+    if len(code)<1: raise ValueError("No Python code found from section '"+title+"' of "+fname)
+    return NOTEBOOK_PRELUDE+''.join(code)
+
+def r_section(fname,title):
+    #the library calls of the R script followed by the part of the script under the banner '## title ##'
+    with open(fname,'rt') as infile: lines = infile.readlines()
+    banners = [i for i,line in enumerate(lines) if re.match(r'^## .* ##\s*$',line)]
+    starts = [i for i in banners if lines[i].strip()=='## '+title+' ##']
+    if len(starts)<1: raise ValueError("Section '"+title+"' not found from "+fname)
+    #the banner is preceded and followed by a line of #s
+    end = min([i-1 for i in banners if i>starts[0]]+[len(lines)])
+    libraries = [line for line in lines[:banners[0]] if line.startswith('library(')]
+    return ''.join(libraries+lines[starts[0]-1:end])
+
+def override_assignments(code,params):
+    #replace the top-level assignments 'name = ...' of the parameters with 'name = value', value is Python source code
+    for name,value in params.items():
+        pattern = re.compile(r'^'+re.escape(name)+r'\s*=.*$',re.MULTILINE)
+        if pattern.search(code) is None: raise ValueError("No assignment to "+name+" found in the stage code")
+        code = pattern.sub(lambda m: name+' = '+value,code)
+    return code
+
+class PathMap:
+    #redirects the original absolute paths to other directories by replacing their prefixes
+    def __init__(self,prefixes):
+        self.prefixes = dict(prefixes)
+        #longest prefixes are matched first, so that more specific mappings take precedence
+        self.pattern = re.compile('|'.join(re.escape(old) for old in sorted(self.prefixes,key=len,reverse=True))) if len(self.prefixes)>0 else None
+
+    def __call__(self,text):
+        #replace the mapped prefixes in a path or in a piece of code
+        if self.pattern is None: return text
+        return self.pattern.sub(lambda m: self.prefixes[m.group(0)],text)
+
+class FileHashes:
+    #content hashes (sha256) of files, reused as long as the size and modification time of the file are unchanged
+    def __init__(self,fname):
+        self.fname = fname
+        self.lock = Lock()
+        self.hashes = json.load(open(fname,'rt')) if os.path.exists(fname) else {}
+
+    def __call__(self,path):
+        #None if the file does not exist
+        if not os.path.exists(path): return None
+        st = os.stat(path)
+        with self.lock: cached = self.hashes.get(path)
+        if cached is not None and cached[0]==st.st_size and cached[1]==st.st_mtime_ns: return cached[2]
+        h = hashlib.sha256()
+        with open(path,'rb') as infile:
+            for block in iter(lambda: infile.read(1<<24),b''): h.update(block)
+        with self.lock: self.hashes[path] = [st.st_size,st.st_mtime_ns,h.hexdigest()]
+        return h.hexdigest()
+
+    def save(self):
+        with self.lock:
+            with open(self.fname+'.tmp','wt') as outfile: json.dump(self.hashes,outfile)
+            os.replace(self.fname+'.tmp',self.fname)
+
+def resolve(stage,params,path_map):
+    #stage with its parameters applied and paths mapped, and the code that is run (command or script source)
+    stage = dict(stage)
+    params = dict(stage['params'],**params)
+    fill = lambda s: path_map(s.format(**params))
+    stage['inputs'] = [fill(f) for f in stage['inputs']]
+    stage['outputs'] = [fill(f) for f in stage['outputs']]
+    stage['params'] = params
+    if stage['command'] is not None:
+        stage['command'] = [fill(arg) for arg in stage['command']]
+        stage['source'] = None
+    else:
+        fname,title = stage['section']
+        if fname.endswith('.md'): source = override_assignments(notebook_section(os.path.join(SCRIPT_DIR,fname),title),params)
+        else: source = r_section(os.path.join(SCRIPT_DIR,fname),title)
+        stage['source'] = path_map(source)
+    return stage
+
+def stage_key(stage,hashes,produced=set()):
+    #hash of everything that determines the outputs of a stage: code, parameters and the content of the input files
+    #None if an input file produced by another stage (in produced) does not exist yet, missing raw input files are part of
+    #the key as missing, so that stages adopted without their raw inputs stay up to date until the raw inputs appear
+    inputs = {f:hashes(f) for f in stage['inputs']}
+    if any(h is None and f in produced for f,h in inputs.items()): return None
+    key = {'command':stage['command'],'source':stage['source'],'params':stage['params'],'inputs':inputs,
+           'code_files':{f:hashes(os.path.join(SCRIPT_DIR,f)) for f in stage['code_files']}}
+    return hashlib.sha256(json.dumps(key,sort_keys=True).encode()).hexdigest()
+
+def record_file(cachedir,name):
+    return os.path.join(cachedir,name+'.json')
+
+def is_up_to_date(stage,key,hashes,cachedir):
+    #True if the outputs were created from the same key and have not been modified or removed since
+    if key is None or not os.path.exists(record_file(cachedir,stage['name'])): return False
+    record = json.load(open(record_file(cachedir,stage['name']),'rt'))
+    return record['key']==key and all(hashes(f)==record['outputs'].get(f) for f in stage['outputs'])
+
+def save_record(stage,key,hashes,cachedir,duration):
+    record = {'key':key,'outputs':{f:hashes(f) for f in stage['outputs']},'duration':duration,'finished':time()}
+    with open(record_file(cachedir,stage['name']),'wt') as outfile: json.dump(record,outfile,indent=1)
+
+def run_stage(stage,key,hashes,cachedir):
+    #run one stage in its own process, stdout and stderr are written into <cachedir>/<stage>.log
+    start = time()
+    if stage['source'] is not None:
+        #sections are written into a script file and run with Python or R
+        ext = '.R' if stage['section'][0].endswith('.R') else '.py'
+        script = os.path.join(cachedir,stage['name']+ext)
+        with open(script,'wt') as outfile: outfile.write(stage['source'])
+        command = ['Rscript',script] if ext=='.R' else [sys.executable,script]
+    else: command = [sys.executable if arg=='python' else arg for arg in stage['command']]
+    for f in stage['outputs']:
+        if os.path.dirname(f)!='': os.makedirs(os.path.dirname(f),exist_ok=True)
+    with open(os.path.join(cachedir,stage['name']+'.log'),'wt') as log:
+        #the extracted scripts are run from the cache directory, so the modules of this directory are added to the path
+        env = dict(os.environ,PYTHONPATH=os.pathsep.join([SCRIPT_DIR]+([os.environ['PYTHONPATH']] if 'PYTHONPATH' in os.environ else [])))
+        returncode = subprocess.run(command,cwd=SCRIPT_DIR,env=env,stdout=log,stderr=subprocess.STDOUT).returncode
+    if returncode!=0: return False,'exit code '+str(returncode)
+    missing = [f for f in stage['outputs'] if not os.path.exists(f)]
+    if len(missing)>0: return False,'output files not written: '+','.join(missing)
+    save_record(stage,key,hashes,cachedir,time()-start)
+    return True,str(time()-start)+' s'
+
+def dependencies(stages):
+    #names of the stages producing the inputs of each stage
+    producers = {}
+    for s in stages:
+        for f in s['outputs']:
+            if f in producers: raise ValueError(f+" is an output of both "+producers[f]+" and "+s['name'])
+            producers[f] = s['name']
+    return {s['name']:sorted(set(producers[f] for f in s['inputs'] if f in producers)) for s in stages}
+
+def topological_order(names,deps):
+    #stages ordered so that each stage comes after the stages it depends on
+    order,visiting,done = [],set(),set()
+    def visit(name):
+        if name in done: return
+        if name in visiting: raise ValueError("Stages depend on each other in a cycle: "+name)
+        visiting.add(name)
+        for d in deps[name]: visit(d)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+    for name in names: visit(name)
+    return order
+
+def run_pipeline(stages,targets,force,nproc,cachedir,dry_run=False,adopt=False):
+    #run the target stages and the stages they depend on, returns the status of each stage
+    by_name = {s['name']:s for s in stages}
+    deps = dependencies(stages)
+    order = topological_order(targets,deps)
+    produced = set(f for s in stages for f in s['outputs'])
+    #raw input files (not produced by any stage) are only needed by the stages that are run
+    missing_inputs = lambda s: [f for f in s['inputs'] if f not in produced and not os.path.exists(f)]
+    hashes = FileHashes(os.path.join(cachedir,'file_hashes.json'))
+
+    status = {}
+    if dry_run or adopt:
+        for name in order:
+            s = by_name[name]
+            upstream_runs = any(status[d] in ['run','may run'] for d in deps[name])
+            key = stage_key(s,hashes,produced)
+            if adopt:
+                #record the existing outputs as created from the current inputs without running the stage
+                if key is None or any(not os.path.exists(f) for f in s['outputs']): status[name] = 'run'
+                else:
+                    save_record(s,key,hashes,cachedir,None)
+                    status[name] = 'adopted'
+            elif name in force or not is_up_to_date(s,key,hashes,cachedir): status[name] = 'run'
+            #if an upstream stage is rerun, the stage is rerun only if the upstream outputs change
+            elif upstream_runs: status[name] = 'may run'
+            else: status[name] = 'up to date'
+            print(name+': '+status[name]+(', input files missing: '+' '.join(missing_inputs(s)) if status[name]=='run' and len(missing_inputs(s))>0 else ''))
+        hashes.save()
+        return status
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=nproc) as executor:
+        while len(status)<len(order):
+            for name in order:
+                if name in status or name in running.values(): continue
+                if any(status.get(d) in ['failed','skipped'] for d in deps[name]):
+                    status[name] = 'skipped'
+                    print(name+': skipped, an upstream stage failed')
+                    continue
+                if not all(status.get(d) in ['done','up to date'] for d in deps[name]): continue
+                s = by_name[name]
+                key = stage_key(s,hashes,produced)
+                if name not in force and is_up_to_date(s,key,hashes,cachedir):
+                    status[name] = 'up to date'
+                    print(name+': up to date')
+                    continue
+                if len(missing_inputs(s))>0:
+                    status[name] = 'failed'
+                    print(name+': failed, input files missing: '+' '.join(missing_inputs(s)))
+                    continue
+                if len(running)>=nproc: continue
+                print(name+': running')
+                running[executor.submit(run_stage,s,key,hashes,cachedir)] = name
+            if len(running)<1: continue
+            finished,_ = wait(list(running),return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                ok,message = future.result()
+                status[name] = 'done' if ok else 'failed'
+                print(name+': '+status[name]+', '+message+('' if ok else ', see '+os.path.join(cachedir,name+'.log')))
+            hashes.save()
+    hashes.save()
+    return status
+
+def parse_params(values,stages):
+    #--set stage.param=value arguments into {stage:{param:value}}
+    names = set(s['name'] for s in stages)
+    params = {}
+    for value in values:
+        m = re.match(r'^([^.=]+)\.([^=]+)=(.*)$',value)
+        if m is None or m.group(1) not in names: raise ValueError("Invalid parameter (should be stage.param=value with an existing stage): "+value)
+        params.setdefault(m.group(1),{})[m.group(2)] = m.group(3)
+    return params
+
+def preprocessing_pipeline():
+
+    ########################
+    #command line arguments#
+    ########################
+
+    parser = argparse.ArgumentParser()
+
+    #PARAMETERS
+    parser.add_argument("--cachedir",help="Full path to the directory where the stage records, file hashes, logs and extracted stage scripts are saved.",type=str)
+    parser.add_argument("--stages",help="Stages to run, together with the stages they depend on (default=all stages).",type=str,nargs='+',default=None)
+    parser.add_argument("--force",help="Stages that are rerun even if they are up to date (default=none).",type=str,nargs='+',default=[])
+    parser.add_argument("--set",help="Parameters of the stages, given as stage.param=value. For command stages the value replaces {param} in the command, e.g. marriage.eofu=2021-10-31, split.outformat=parquet. For notebook sections the value is Python code that replaces the assignment 'param = ...' in the section.",
+                        type=str,nargs='+',default=[])
+    parser.add_argument("--datadir",help="Directory used instead of "+DATA+" (default=None, not changed).",type=str,default=None)
+    parser.add_argument("--processeddir",help="Directory used instead of "+PROCESSED+" (default=None, not changed).",type=str,default=None)
+    parser.add_argument("--path_map",help="Other path prefixes to replace, given as old=new (default=none).",type=str,nargs='+',default=[])
+    parser.add_argument("--nproc",help="Maximum number of stages run at the same time (default=4).",type=int,default=4)
+    parser.add_argument("--dry_run",help="Only print which stages would be run.",action='store_true')
+    parser.add_argument("--adopt",help="Record the existing output files of the stages as up to date without running them, e.g. when starting to use the pipeline with files created manually.",action='store_true')
+    parser.add_argument("--list",help="Print the stages with their inputs and outputs and exit.",action='store_true')
+
+    args = parser.parse_args()
+
+    start = time()
+    prefixes = [tuple(p.split('=',1)) for p in args.path_map]
+    if args.datadir is not None: prefixes.append((DATA,os.path.join(args.datadir,'')))
+    if args.processeddir is not None: prefixes.append((PROCESSED,os.path.join(args.processeddir,'')))
+    path_map = PathMap(prefixes)
+    stages = default_stages()
+    params = parse_params(args.set,stages)
+    stages = [resolve(s,params.get(s['name'],{}),path_map) for s in stages]
+    if args.list:
+        deps = dependencies(stages)
+        for s in stages: print(s['name']+' (after '+(','.join(deps[s['name']]) if len(deps[s['name']])>0 else '-')+')\n  inputs: '+' '.join(s['inputs'])+'\n  outputs: '+' '.join(s['outputs']))
+        return
+    names = [s['name'] for s in stages]
+    targets = args.stages if args.stages is not None else names
+    unknown = [name for name in targets+args.force if name not in names]
+    if len(unknown)>0: parser.error("unknown stages: "+','.join(unknown)+" (see --list)")
+    os.makedirs(args.cachedir,exist_ok=True)
+
+    status = run_pipeline(stages,targets,set(args.force),args.nproc,args.cachedir,dry_run=args.dry_run,adopt=args.adopt)
+    end = time()
+    counts = {}
+    for name in status: counts[status[name]] = counts.get(status[name],0)+1
+    print("Pipeline finished in "+str(end-start)+" s: "+', '.join(str(counts[c])+' '+c for c in counts))
+    if any(status[name] in ['failed','skipped'] for name in status): sys.exit(1)
+
+if __name__=='__main__':
+    preprocessing_pipeline()
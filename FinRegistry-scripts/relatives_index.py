@@ -0,0 +1,84 @@
+#Index of the relatives of the study population from the DVV relatives register, used to create variables from the
+#vaccination status (or any other per-person value) of relatives.
+#For each relationship group (e.g. mother = '3a', father = '3i', siblings = '4i' or '4a') the relatives of each person are
+#stored as a CSR-style adjacency: the relatives of the person with code i (see study_id_index.py) are
+#indices[indptr[i]:indptr[i+1]], in the order they are listed in the relatives file. Relatives outside the study population
+#have code -1. Variables of relatives are computed by gathering a per-person value array with the relative codes and reducing
+#over each person's segment, so a new family variable (e.g. vaccination status or number of children or spouses) only needs
+#the relationship codes of the new group and a reduction, not another pass over the relatives file.
+import pandas as pd
+import numpy as np
+
+#relationship codes of the DVV relatives file
+RELATIONSHIPS = {'mother':['3a'],'father':['3i'],'sibling':['4i','4a']}
+
+class RelativesIndex:
+
+    def __init__(self,df_rel,id_index,groups=RELATIONSHIPS):
+        #df_rel = dataframe with columns FINREGISTRYID, Relationship and Relative_ID, id_index = StudyIDIndex
+        #groups = name of the relationship group -> list of relationship codes
+        self.n = len(id_index)
+        relationship = df_rel['Relationship'].astype(str).values
+        person_codes = id_index.codes(df_rel['FINREGISTRYID'])
+        relative_codes = id_index.codes(df_rel['Relative_ID'])
+        self.groups = {}
+        for name,codes in groups.items():
+            rows = np.isin(relationship,codes) & (person_codes>=0)
+            persons = person_codes[rows]
+            #stable sort keeps the relatives of each person in the order of the relatives file
+            order = np.argsort(persons,kind='stable')
+            indptr = np.zeros(self.n+1,dtype=np.int64)
+            np.cumsum(np.bincount(persons,minlength=self.n),out=indptr[1:])
+            self.groups[name] = (indptr,relative_codes[rows][order])
+
+    def counts(self,group,in_study=True):
+        #number of relatives of each person in the group (only relatives in the study population if in_study=True)
+        indptr,indices = self.groups[group]
+        if not in_study: return np.diff(indptr)
+        return segment_reduce(indptr,(indices>=0).astype(np.int64),np.add,0)
+
+    def gather(self,group,values):
+        #values of the relatives in the group, aligned with the adjacency (NaN for relatives outside the study population)
+        indptr,indices = self.groups[group]
+        gathered = np.full(len(indices),np.nan)
+        gathered[indices>=0] = values[indices[indices>=0]]
+        return gathered
+
+    def first(self,group,values):
+        #value of the first relative of each person listed in the relatives file, NaN if there are no relatives
+        #or if the first relative is not in the study population
+        indptr,indices = self.groups[group]
+        gathered = self.gather(group,values)
+        result = np.full(self.n,np.nan)
+        nonempty = np.diff(indptr)>0
+        result[nonempty] = gathered[indptr[:-1][nonempty]]
+        return result
+
+    def reduce(self,group,values,ufunc=np.fmin):
+        #reduce the values of the relatives of each person with a NaN-ignoring ufunc (np.fmin, np.fmax, ...),
+        #NaN if no relative has a value
+        indptr,indices = self.groups[group]
+        return segment_reduce(indptr,self.gather(group,values),ufunc,np.nan)
+
+def segment_reduce(indptr,values,ufunc,empty):
+    #ufunc.reduceat over the segments values[indptr[i]:indptr[i+1]], empty segments get the value empty
+    result = np.full(len(indptr)-1,empty,dtype=np.result_type(values,type(empty)))
+    nonempty = np.diff(indptr)>0
+    if len(values)>0 and nonempty.any(): result[nonempty] = ufunc.reduceat(values,indptr[:-1][nonempty])
+    return result
+
+def relative_vaccination_variables(relatives,id_index,vacc_status):
+    #REL_ variables of create_variables_for_vaccination_project_final.md for each study ID, in the order of the codes
+    #vacc_status = COVIDVax of each study ID (NaN if not in the vaccination status file)
+    #people without vaccination status get NA for all variables, like IDs missing from the vaccination status file did before
+    known = ~np.isnan(vacc_status)
+    mother = np.where(known,relatives.first('mother',vacc_status),np.nan)
+    father = np.where(known,relatives.first('father',vacc_status),np.nan)
+    #REL_ISSIBLINGVACC = 0 if any sibling in the study population has COVIDVax=0, otherwise COVIDVax of the siblings
+    sibling = np.where(known,relatives.reduce('sibling',vacc_status,np.fmin),np.nan)
+    df = pd.DataFrame({'FINREGISTRYID':id_index.ids})
+    for name,values in [('REL_ISMOTHERVACC',mother),('REL_ISFATHERVACC',father),('REL_ISSIBLINGVACC',sibling)]:
+        df[name] = pd.array(np.where(np.isnan(values),0,values).astype(np.int64),dtype='Int64')
+        df.loc[np.isnan(values),name] = pd.NA
+    for name,values in [('REL_ISMOTHERNA',mother),('REL_ISFATHER_NA',father),('REL_ISSIBLINGNA',sibling)]: df[name] = np.isnan(values).astype(int)
+    return df
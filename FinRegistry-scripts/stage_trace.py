@@ -0,0 +1,108 @@
+#Stage-level instrumentation of the preprocessing and training scripts.
+#The code of a script is wrapped into named stages (read, filter, pivot, write, cv_fit, predict, bootstrap, ...) with
+#    with stage('read') as record:
+#        df = pd.read_csv(...)
+#        record['rows'] = len(df)
+#and each finished stage is written as one JSON line into the trace file set with configure(): wall and CPU time, peak memory
+#(max RSS of the process at the end of the stage) and the resident memory at the start and end of the stage, rows/s if the
+#stage sets record['rows'], and any other fields given to stage() or set in the record. CPU time is that of the whole process,
+#so it includes the threads of xgboost and of concurrently running stages. Records that are not stages (e.g. the time of each
+#boosting iteration, see IterationTimer in xgboost_training_skopt.py) are written with log_record().
+#configure(profilefile=...) also starts a sampling profiler, which records the Python call stacks of all threads at fixed
+#intervals and writes the number of samples of each stack into profilefile in the collapsed stack format
+#(one "frame;frame;...;frame count" line per stack), which can be read by flamegraph.pl and speedscope.
+#If configure() is not called, the stages are timed but not written anywhere.
+import numpy as np
+import json
+import os
+import sys
+import threading
+
+from time import time,process_time,sleep
+from contextlib import contextmanager
+from resource import getrusage,RUSAGE_SELF
+
+_trace = {'outfile':None,'profiler':None,'lock':threading.Lock()}
+
+def peak_memory():
+    #peak resident set size of this process in GB
+    return getrusage(RUSAGE_SELF).ru_maxrss/1e6
+
+def current_memory():
+    #current resident set size of this process in GB, None if not available (/proc is Linux only)
+    try:
+        with open('/proc/self/statm','rt') as infile: return int(infile.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1e9
+    except (OSError,ValueError): return None
+
+def to_json(value):
+    #numpy values in the records are written as the corresponding Python values
+    if isinstance(value,(np.generic,np.ndarray)): return value.tolist()
+    return str(value)
+
+def configure(tracefile=None,profilefile=None,profile_interval=0.01):
+    #start writing the stages into tracefile (JSON lines, overwritten) and, if profilefile is given, start the sampling profiler
+    close()
+    if tracefile is not None: _trace['outfile'] = open(tracefile,'wt')
+    if profilefile is not None:
+        _trace['profiler'] = SamplingProfiler(profilefile,profile_interval)
+        _trace['profiler'].start()
+
+def close():
+    #stop the profiler and close the trace file
+    if _trace['profiler'] is not None:
+        _trace['profiler'].stop()
+        _trace['profiler'] = None
+    if _trace['outfile'] is not None:
+        _trace['outfile'].close()
+        _trace['outfile'] = None
+
+def log_record(record):
+    #write one record into the trace file, records can be written from several threads
+    with _trace['lock']:
+        if _trace['outfile'] is None: return
+        _trace['outfile'].write(json.dumps(record,default=to_json)+'\n')
+        _trace['outfile'].flush()
+
+@contextmanager
+def stage(name,**fields):
+    #time the code in the with block and write it into the trace as stage name, the fields are added to the record
+    #the with block gets the record, so that it can add e.g. the number of rows processed (record['rows'])
+    record = dict(stage=name,**fields)
+    rss_start = current_memory()
+    start,cpu_start = time(),process_time()
+    try:
+        yield record
+    finally:
+        wall_time = time()-start
+        record.update(start=start,wall_time_s=wall_time,cpu_time_s=process_time()-cpu_start,peak_rss_gb=peak_memory(),
+                      rss_start_gb=rss_start,rss_end_gb=current_memory())
+        if 'rows' in record and wall_time>0: record['rows_per_s'] = record['rows']/wall_time
+        if sys.exc_info()[0] is not None: record['error'] = repr(sys.exc_info()[1])
+        log_record(record)
+
+class SamplingProfiler(threading.Thread):
+    #samples the call stacks of all other threads every interval seconds and counts the samples of each stack
+    def __init__(self,fname,interval):
+        super().__init__(daemon=True)
+        self.fname = fname
+        self.interval = interval
+        self.counts = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            for thread_id,frame in sys._current_frames().items():
+                if thread_id==self.ident: continue
+                stack = []
+                while frame is not None:
+                    stack.append(os.path.basename(frame.f_code.co_filename)+':'+frame.f_code.co_name+':'+str(frame.f_lineno))
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key,0)+1
+            sleep(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        with open(self.fname,'wt') as outfile:
+            for key,count in sorted(self.counts.items(),key=lambda item: -item[1]): outfile.write(key+' '+str(count)+'\n')
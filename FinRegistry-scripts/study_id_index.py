@@ -0,0 +1,102 @@
+#Integer codes of the study population IDs shared by the register preprocessing stages.
+#The final study population (after removing the deaths during 2020 and the COVID positives) is sorted once and the
+#int32 code of an ID is its position in the sorted order. The sorted IDs are saved next to the study ID file
+#(vaccination_project_study_ids_082022.csv -> vaccination_project_study_ids_082022.npy), so that each stage can translate the
+#ID column of a register into codes with one vectorized lookup (or read only the study population rows of a register file
+#with StudyIDIndex.rows) and select the study population with array masks instead of building its own set of ID strings.
+import pandas as pd
+import numpy as np
+import csv
+import os
+
+def index_file(idfile):
+    #name of the file containing the sorted IDs, saved next to the study ID file
+    return os.path.splitext(idfile)[0]+'.npy'
+
+class StudyIDIndex:
+    #sorted study population IDs stored as a fixed-width byte string array, code of an ID = position in the array
+
+    def __init__(self,ids):
+        ids = np.unique(np.asarray(ids,dtype=bytes))
+        if len(ids)>np.iinfo(np.int32).max: raise ValueError("Too many IDs for int32 codes: "+str(len(ids)))
+        self.sorted_ids = ids
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+    @property
+    def ids(self):
+        #IDs as strings in the order of the codes
+        return self.sorted_ids.astype(str)
+
+    def codes(self,ids):
+        #int32 codes of the given IDs, -1 for IDs not in the study population
+        #each distinct ID is looked up only once
+        inverse,uniques = pd.factorize(np.asarray(ids,dtype=object))
+        #string IDs are encoded all at once, which is much faster than converting each of them to a numpy byte string
+        if pd.api.types.infer_dtype(uniques,skipna=False)=='string': uniques = np.array('\n'.join(uniques).encode().split(b'\n'))
+        else: uniques = np.asarray(uniques,dtype=bytes)
+        pos = np.searchsorted(self.sorted_ids,uniques)
+        found = pos<len(self.sorted_ids)
+        found[found] = self.sorted_ids[pos[found]]==uniques[found]
+        unique_codes = np.append(np.where(found,pos,-1),-1).astype(np.int32)
+        #missing IDs get inverse code -1, which points to the appended -1
+        return unique_codes[inverse]
+
+    def mask(self,ids):
+        #boolean array with one value per study ID, True if the ID is among the given IDs
+        codes = self.codes(ids)
+        mask = np.zeros(len(self),dtype=bool)
+        mask[codes[codes>=0]] = True
+        return mask
+
+    def code_dict(self):
+        #dictionary from ID string to code, built on first use and kept with the index
+        if getattr(self,'_code_dict',None) is None: self._code_dict = dict(zip(self.ids.tolist(),range(len(self))))
+        return self._code_dict
+
+    def rows(self,fname,id_column=0,delimiter=',',encoding=None,quoting=False):
+        #rows of a delimited register file with a header line whose ID (in column id_column) is in the study population,
+        #as (code,row) pairs in the order of the file, where row is the line split on the delimiter, or the list of values
+        #given by csv.reader if quoting=True (files with quoted fields that may contain the delimiter)
+        #the IDs are looked up one row at a time in code_dict with the surrounding quotes removed, as a vectorized lookup per
+        #block of rows costs more than the lookup itself when every row is handled in python anyway
+        get_code = self.code_dict().get
+        with open(fname,'rt',encoding=encoding,newline='' if quoting else None) as infile:
+            next(infile,None)
+            if quoting:
+                for row in csv.reader(infile,delimiter=delimiter):
+                    if len(row)<=id_column: continue
+                    code = get_code(row[id_column].strip('"'))
+                    if code is not None: yield code,row
+            else:
+                for line in infile:
+                    row = line.rstrip('\r\n').split(delimiter)
+                    if len(row)<=id_column: continue
+                    code = get_code(row[id_column].strip('"'))
+                    if code is not None: yield code,row
+
+    def subset(self,mask):
+        #index of the IDs selected by a boolean mask over the codes
+        index = StudyIDIndex.__new__(StudyIDIndex)
+        index.sorted_ids = self.sorted_ids[mask]
+        return index
+
+    def save(self,idfile):
+        #write the sorted IDs as one comma-separated row (the format of the study ID file) and as the index file
+        with open(idfile,'wt') as outfile:
+            w = csv.writer(outfile,delimiter=',')
+            w.writerow(self.ids)
+        np.save(index_file(idfile),self.sorted_ids)
+
+    @classmethod
+    def load(cls,idfile):
+        #read the index saved next to the study ID file, or build it from the study ID file if there is no index file
+        if os.path.exists(index_file(idfile)):
+            index = cls.__new__(cls)
+            index.sorted_ids = np.load(index_file(idfile))
+            return index
+        with open(idfile,'rt') as infile:
+            r = csv.reader(infile,delimiter=',')
+            for row in r: ids = row
+        return cls(ids)
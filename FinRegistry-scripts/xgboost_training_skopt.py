@@ -11,6 +11,15 @@ import sklearn
 import argparse
 import skopt
 from skopt.callbacks import DeltaXStopper
+from skopt import Optimizer
+from skopt.utils import dimensions_aslist
+from sklearn.utils import check_random_state
+from sklearn.model_selection import StratifiedKFold
+from scipy.stats import rankdata
+from evaluate_xgb_models import evaluate_predictions
+from stage_trace import stage,log_record,peak_memory
+import stage_trace
+from concurrent.futures import ThreadPoolExecutor
 
 from time import time
 from glob import glob
@@ -18,15 +27,336 @@ from glob import glob
 #from scipy.sparse import csr_matrix
 
 from sklearn.utils import class_weight
-from sklearn.metrics import average_precision_score,roc_auc_score,roc_curve,precision_recall_curve,ConfusionMatrixDisplay
-import matplotlib
-matplotlib.use('Agg')
-from matplotlib import pyplot as plt
+from sklearn.metrics import average_precision_score
 
-print(sklearn.__version__)
-print(xgb.__version__)
 logging.shutdown()
 
+def read_columns(fname,columns,na_values=None):
+    #read in the given columns from a csv file or from a columnar (parquet/feather) file written by merge_sorted_variable_files.py
+    #columns are returned in the order they appear in the file, same as with pd.read_csv(usecols=...)
+    if fname.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        names = pq.read_schema(fname).names
+        return pd.read_parquet(fname,columns=[name for name in names if name in set(columns)])
+    elif fname.endswith('.feather'):
+        import pyarrow as pa
+        names = pa.ipc.open_file(fname).schema.names
+        return pd.read_feather(fname,columns=[name for name in names if name in set(columns)])
+    return pd.read_csv(fname,usecols=columns,na_values=na_values)
+
+def to_matrix(df):
+    #convert a dataframe with possibly mixed (nullable) column types into a float matrix with NaNs for missing values
+    return df.to_numpy(dtype=float,na_value=np.nan)
+
+def iter_chunks(fname,columns,chunksize,na_values=None):
+    #read in the given columns from a csv, parquet or feather file as dataframes of at most chunksize rows
+    #columns are returned in the order they appear in the file
+    if fname.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(fname)
+        names = [name for name in pf.schema_arrow.names if name in set(columns)]
+        for batch in pf.iter_batches(batch_size=chunksize,columns=names): yield batch.to_pandas()
+    elif fname.endswith('.feather'):
+        import pyarrow as pa
+        reader = pa.ipc.open_file(fname)
+        names = [name for name in reader.schema.names if name in set(columns)]
+        for i in range(reader.num_record_batches): yield reader.get_batch(i).select(names).to_pandas()
+    else:
+        for df in pd.read_csv(fname,usecols=columns,na_values=na_values,chunksize=chunksize): yield df
+
+class FileChunkIter(xgb.DataIter):
+    #reads the given columns of the training data file in chunks, converts each chunk into a float32 matrix and feeds these
+    #to xgb.QuantileDMatrix one at a time, so that the full unquantized training data is never held in memory
+    def __init__(self,fname,columns,chunksize,na_values=None):
+        self.fname = fname
+        self.columns = columns
+        self.chunksize = chunksize
+        self.na_values = na_values
+        self.nan_counts = [] #number of NAs in each chunk, xgboost may read the data several times
+        self.reset()
+        super().__init__()
+
+    def next(self,input_data):
+        df = next(self.chunks,None)
+        if df is None: return False
+        X = df.drop('COVIDVax',axis=1).to_numpy(dtype=np.float32,na_value=np.nan)
+        if self.it==len(self.nan_counts): self.nan_counts.append(np.isnan(X).sum())
+        self.it += 1
+        input_data(data=X,label=df['COVIDVax'].to_numpy())
+        return True
+
+    def reset(self):
+        self.chunks = iter_chunks(self.fname,self.columns,self.chunksize,self.na_values)
+        self.it = 0
+
+def quantize_training_data(fname,columns,chunksize,na_values,nproc):
+    #stream the training data into a QuantileDMatrix, which stores the histogram bin of each value instead of the value itself
+    it = FileChunkIter(fname,columns,chunksize,na_values)
+    dtrain = xgb.QuantileDMatrix(it,nthread=nproc)
+    print("Total number of NAs: "+str(sum(it.nan_counts)))
+    return dtrain
+
+def cv_folds(y,nfolds):
+    #boolean masks of the validation rows of each CV fold, these are the same folds that BayesSearchCV(cv=nfolds)
+    #uses for a classifier (StratifiedKFold without shuffling)
+    folds = []
+    for train_inds,valid_inds in StratifiedKFold(n_splits=nfolds).split(np.zeros(len(y)),y):
+        is_valid = np.zeros(len(y),dtype=bool)
+        is_valid[valid_inds] = True
+        folds.append(is_valid)
+    return folds
+
+class IterationTimer(xgb.callback.TrainingCallback):
+    #xgboost callback writing the wall time of each boosting iteration of one training run into the trace
+    #as an 'xgb_iterations' record with the given fields
+    def __init__(self,**fields):
+        self.fields = fields
+        super().__init__()
+
+    def before_training(self,model):
+        self.times = []
+        self.last = time()
+        return model
+
+    def after_iteration(self,model,epoch,evals_log):
+        now = time()
+        self.times.append(now-self.last)
+        self.last = now
+        return False
+
+    def after_training(self,model):
+        times = np.array(self.times)
+        log_record(dict(stage='xgb_iterations',**self.fields,n_iterations=len(times),total_time_s=times.sum(),
+                        mean_time_s=times.mean() if len(times)>0 else None,max_time_s=times.max() if len(times)>0 else None,
+                        iteration_times_s=np.round(times,5)))
+        return model
+
+class DMatrixSearchCV:
+    #Bayesian hyperparameter search (skopt.Optimizer with the same defaults as skopt.BayesSearchCV) where the models are
+    #trained with xgb.train on one QuantileDMatrix containing the full quantized training data
+    #a CV fold is trained by giving the validation rows of the fold zero weight, so the data is quantized and the folds are
+    #defined once and reused for all candidates. The fold model matches a model trained on the training rows of the fold only,
+    #except that the quantile cuts of the histograms come from all training rows (including the validation rows of the fold),
+    #so the CV scores can differ slightly from those of BayesSearchCV
+    #the n_points candidates proposed at each step are trained concurrently, each using n_jobs/n_points threads
+    #the candidates are scored with accuracy, which is what BayesSearchCV uses for XGBClassifier by default
+    #after fit, the attributes cv_results_, best_index_, best_params_, best_score_ and best_estimator_ are the same as in BayesSearchCV,
+    #and cv_results_['scoring'] gives the metric of the test scores
+    scoring = 'accuracy'
+
+    def __init__(self,search_spaces,base_params,cv=5,n_iter=50,n_points=1,random_state=None):
+        self.search_spaces = search_spaces
+        self.base_params = base_params #XGBClassifier parameters that are not optimized, n_jobs is the total number of threads used
+        self.cv = cv
+        self.n_iter = n_iter
+        self.n_points = n_points
+        self.random_state = random_state
+
+    def train_params(self,params,nthread):
+        #parameters for xgb.train corresponding to the XGBClassifier parameters
+        xgb_params = {'objective':self.base_params['objective'],'eval_metric':self.base_params['eval_metric'],'tree_method':self.base_params['tree_method'],
+                      'scale_pos_weight':self.base_params['scale_pos_weight'],'nthread':nthread,'seed':self.base_params['random_state'],
+                      'max_depth':params['max_depth'],'eta':params['learning_rate'],'gamma':params['gamma'],'alpha':params['reg_alpha'],'lambda':params['reg_lambda']}
+        return xgb_params,params['n_estimators']
+
+    def fit_and_score(self,params,dtrain,y,is_valid,nthread,fold=None):
+        #train the model with the given hyperparameters on the current fold and compute its accuracy on the validation rows
+        xgb_params,num_boost_round = self.train_params(params,nthread)
+        fit_start = time()
+        with stage('cv_fit',params=params,fold=fold) as record:
+            booster = xgb.train(xgb_params,dtrain,num_boost_round=num_boost_round,callbacks=[IterationTimer(training='cv_fit',params=params,fold=fold)])
+            record['rows'] = int(len(y)-is_valid.sum())
+        fit_time = time()-fit_start
+        score_start = time()
+        with stage('cv_predict',params=params,fold=fold) as record:
+            score = np.mean((booster.predict(dtrain)[is_valid]>0.5)==y[is_valid])
+            record['rows'] = len(y)
+        return score,fit_time,time()-score_start
+
+    def evaluate_candidates(self,candidates,dtrain,folds):
+        #train and score each of the candidate hyperparameter combinations on each CV fold
+        #the candidates are trained concurrently on the same fold, xgboost releases the GIL during training
+        #returns a list of (scores,fit_times,score_times) for each candidate
+        y = dtrain.get_label()
+        nthread = max(1,self.base_params['n_jobs']//len(candidates))
+        results = [([],[],[]) for params in candidates]
+        with ThreadPoolExecutor(max_workers=min(len(candidates),max(1,self.base_params['n_jobs']))) as executor:
+            for k,is_valid in enumerate(folds):
+                dtrain.set_weight((~is_valid).astype(np.float32))
+                fold_results = list(executor.map(lambda params: self.fit_and_score(params,dtrain,y,is_valid,nthread,k),candidates))
+                for i in range(len(candidates)):
+                    for j in range(3): results[i][j].append(fold_results[i][j])
+        dtrain.set_weight(np.ones(len(y),dtype=np.float32))
+        return results
+
+    def fit(self,dtrain,callback=None):
+        names = sorted(self.search_spaces.keys())
+        folds = cv_folds(dtrain.get_label(),self.cv)
+        optimizer = Optimizer(dimensions_aslist(self.search_spaces),random_state=check_random_state(self.random_state))
+        results = [] #list of (params,scores,fit_times,score_times)
+        n_iter = self.n_iter
+        while n_iter>0:
+            n_points = min(n_iter,self.n_points)
+            points = [[np.array(v).item() for v in point] for point in optimizer.ask(n_points=n_points)]
+            candidates = [dict(zip(names,point)) for point in points]
+            scores = []
+            for params,result in zip(candidates,self.evaluate_candidates(candidates,dtrain,folds)):
+                results.append((params,)+result)
+                scores.append(np.mean(result[0]))
+                logging.info("CV score "+str(scores[-1])+" for "+str(params))
+            optim_result = optimizer.tell(points,[-score for score in scores])
+            n_iter -= n_points
+            if callback is not None and callback(optim_result): break
+
+        self.set_cv_results(results,names,len(folds))
+        self.refit(dtrain)
+        return self
+
+    def set_cv_results(self,results,names,nfolds,rank_order=None):
+        #store the search results in the same format as BayesSearchCV.cv_results_
+        #results is a list of (params,scores,fit_times,score_times), rank_order can be used to give the order of the
+        #candidates from best to worst, by default they are ranked by the mean CV score
+        self.cv_results_ = {'mean_fit_time':[np.mean(r[2]) for r in results],'std_fit_time':[np.std(r[2]) for r in results],
+                            'mean_score_time':[np.mean(r[3]) for r in results],'std_score_time':[np.std(r[3]) for r in results]}
+        for name in names: self.cv_results_['param_'+name] = [r[0][name] for r in results]
+        self.cv_results_['params'] = [r[0] for r in results]
+        for k in range(nfolds): self.cv_results_['split'+str(k)+'_test_score'] = [r[1][k] for r in results]
+        self.cv_results_['mean_test_score'] = [np.mean(r[1]) for r in results]
+        self.cv_results_['std_test_score'] = [np.std(r[1]) for r in results]
+        self.cv_results_['scoring'] = [self.scoring]*len(results)
+        if rank_order is None: self.cv_results_['rank_test_score'] = rankdata(-np.array(self.cv_results_['mean_test_score']),method='min').astype(int)
+        else:
+            self.cv_results_['rank_test_score'] = np.zeros(len(results),dtype=int)
+            self.cv_results_['rank_test_score'][rank_order] = np.arange(1,len(results)+1)
+        self.best_index_ = int(np.argmin(self.cv_results_['rank_test_score']))
+        self.best_params_ = self.cv_results_['params'][self.best_index_]
+        self.best_score_ = self.cv_results_['mean_test_score'][self.best_index_]
+
+    def refit(self,dtrain):
+        #refit the best model on the full training data and store it as an XGBClassifier
+        xgb_params,num_boost_round = self.train_params(self.best_params_,self.base_params['n_jobs'])
+        with stage('refit',params=self.best_params_) as record:
+            booster = xgb.train(xgb_params,dtrain,num_boost_round=num_boost_round,callbacks=[IterationTimer(training='refit',params=self.best_params_)])
+            record['rows'] = dtrain.num_row()
+        self.best_estimator_ = xgb.XGBClassifier(**self.base_params,**self.best_params_)
+        self.best_estimator_.load_model(bytearray(booster.save_raw('json')))
+
+class HalvingDMatrixSearchCV(DMatrixSearchCV):
+    #successive halving version of DMatrixSearchCV, where the number of boosting rounds is the budget given to the candidates
+    #the candidates are proposed by the optimizer in brackets of factor^(number of rungs-1) candidates, which are first trained
+    #for min_rounds rounds, after which the best 1/factor of them continue training for factor times more rounds and so on
+    #until the largest value of n_estimators in the search space is reached
+    #on each fold, training is stopped early if the validation score has not improved in early_stopping_rounds rounds
+    #the validation score is either negative logloss (positives weighted by scale_pos_weight as in training) or AUPRC,
+    #the time spent computing it after each round is recorded as the score time of the fold
+    #the candidates are ranked by the last rung they reached and then by their best mean validation score, and n_estimators
+    #of each candidate is set to the mean of the best iterations over the folds
+    def __init__(self,search_spaces,base_params,cv=5,n_iter=50,n_points=1,random_state=None,min_rounds=50,factor=3,early_stopping_rounds=20,metric='logloss'):
+        super().__init__(search_spaces,base_params,cv=cv,n_iter=n_iter,n_points=n_points,random_state=random_state)
+        self.min_rounds = min_rounds
+        self.factor = factor
+        self.early_stopping_rounds = early_stopping_rounds
+        self.metric = metric
+
+    @property
+    def scoring(self):
+        #name of the validation score in cv_results_
+        return 'aucpr' if self.metric=='aucpr' else 'neg_logloss'
+
+    def budgets(self):
+        #number of boosting rounds at each rung
+        max_rounds = max(self.search_spaces['n_estimators'])
+        budgets = [min(self.min_rounds,max_rounds)]
+        while budgets[-1]<max_rounds: budgets.append(min(budgets[-1]*self.factor,max_rounds))
+        return budgets
+
+    def validation_score(self,y_valid,p_valid):
+        #score of the predictions on the validation rows, higher is better
+        if self.metric=='aucpr': return average_precision_score(y_valid,p_valid)
+        p_valid = np.clip(p_valid,1e-15,1-1e-15)
+        weights = np.where(y_valid==1,self.base_params['scale_pos_weight'],1.0)
+        return np.average(y_valid*np.log(p_valid)+(1-y_valid)*np.log(1-p_valid),weights=weights)
+
+    def train_fold(self,state,k,dtrain,y,is_valid,budget,nthread):
+        #continue training the candidate on fold k up to budget rounds or until the validation score stops improving
+        rounds = budget-state['rounds'][k]
+        if state['stopped'][k] or rounds<1: return
+        xgb_params,num_boost_round = self.train_params(dict(state['params'],n_estimators=budget),nthread)
+        xgb_params['disable_default_eval_metric'] = 1
+        score_time = [0.0]
+        def metric(predt,dmatrix):
+            score_start = time()
+            score = self.validation_score(y[is_valid],predt[is_valid])
+            score_time[0] += time()-score_start
+            return 'score',score
+        history = {}
+        fit_start = time()
+        with stage('cv_fit',params=state['params'],fold=k,budget=budget) as record:
+            state['boosters'][k] = xgb.train(xgb_params,dtrain,num_boost_round=rounds,evals=[(dtrain,'valid')],custom_metric=metric,evals_result=history,
+                                             callbacks=[xgb.callback.EarlyStopping(rounds=self.early_stopping_rounds,metric_name='score',data_name='valid',maximize=True),
+                                                        IterationTimer(training='cv_fit',params=state['params'],fold=k,budget=budget)],
+                                             xgb_model=state['boosters'][k],verbose_eval=False)
+            record['rows'] = int(len(y)-is_valid.sum())
+        state['fit_times'][k] += time()-fit_start-score_time[0]
+        state['score_times'][k] += score_time[0]
+        scores = history['valid']['score']
+        best = int(np.argmax(scores))
+        if scores[best]>state['scores'][k]:
+            state['scores'][k] = scores[best]
+            state['best_iterations'][k] = state['rounds'][k]+best+1
+        state['rounds'][k] += len(scores)
+        state['stopped'][k] = len(scores)<rounds
+
+    def train_rung(self,states,dtrain,folds,budget):
+        #train all candidates of the rung on each fold, the candidates are trained concurrently as in DMatrixSearchCV
+        y = dtrain.get_label()
+        nthread = max(1,self.base_params['n_jobs']//min(len(states),self.n_points))
+        with ThreadPoolExecutor(max_workers=min(len(states),self.n_points,max(1,self.base_params['n_jobs']))) as executor:
+            for k,is_valid in enumerate(folds):
+                dtrain.set_weight((~is_valid).astype(np.float32))
+                list(executor.map(lambda state: self.train_fold(state,k,dtrain,y,is_valid,budget,nthread),states))
+        dtrain.set_weight(np.ones(len(y),dtype=np.float32))
+
+    def fit(self,dtrain,callback=None):
+        names = sorted(self.search_spaces.keys())
+        space = {name:self.search_spaces[name] for name in names if name!='n_estimators'}
+        folds = cv_folds(dtrain.get_label(),self.cv)
+        budgets = self.budgets()
+        optimizer = Optimizer(dimensions_aslist(space),random_state=check_random_state(self.random_state))
+        results = [] #list of (params,scores,fit_times,score_times)
+        rungs = [] #last rung reached by each candidate
+        n_iter = self.n_iter
+        while n_iter>0:
+            #propose a new bracket of candidates
+            n_candidates = min(n_iter,self.factor**(len(budgets)-1))
+            points = [[np.array(v).item() for v in point] for point in optimizer.ask(n_points=n_candidates)]
+            states = [{'params':dict(zip(sorted(space.keys()),point)),'boosters':[None]*len(folds),'rounds':[0]*len(folds),'stopped':[False]*len(folds),
+                       'scores':[-np.inf]*len(folds),'best_iterations':[0]*len(folds),'fit_times':[0.0]*len(folds),'score_times':[0.0]*len(folds),'rung':0}
+                      for point in points]
+            active = states
+            for rung,budget in enumerate(budgets):
+                self.train_rung(active,dtrain,folds,budget)
+                for state in active: state['rung'] = rung
+                logging.info("rung "+str(rung)+" ("+str(budget)+" rounds) trained for "+str(len(active))+" candidates")
+                if rung==len(budgets)-1: break
+                #keep the best 1/factor of the candidates
+                order = np.argsort([-np.mean(state['scores']) for state in active],kind='stable')
+                active = [active[i] for i in order[:int(np.ceil(len(active)/self.factor))]]
+            for state in states:
+                params = dict(state['params'],n_estimators=max(1,int(round(np.mean(state['best_iterations'])))))
+                results.append((params,state['scores'],state['fit_times'],state['score_times']))
+                rungs.append(state['rung'])
+                logging.info("CV score "+str(np.mean(state['scores']))+" at rung "+str(state['rung'])+" for "+str(params))
+            optim_result = optimizer.tell(points,[-np.mean(state['scores']) for state in states])
+            n_iter -= n_candidates
+            if callback is not None and callback(optim_result): break
+
+        rank_order = np.lexsort((-np.array([np.mean(r[1]) for r in results]),-np.array(rungs)))
+        self.set_cv_results(results,names,len(folds),rank_order)
+        self.cv_results_['rung'] = rungs
+        self.refit(dtrain)
+        return self
+
 def xgboost_training_skopt():
 
     ########################
@@ -40,17 +370,38 @@ def xgboost_training_skopt():
     parser.add_argument("--allvars",help="Full path to the text file containing names of all variables used in the model.",type=str)
     parser.add_argument("--nproc",help="Number of parallel processes used default=32).",type=int,default=32)
     parser.add_argument("--varname",help="Variable name.",type=str,default='var')
-    parser.add_argument("--trainfile",help="Full path to the file containing training samples.",type=str)
-    parser.add_argument("--testfile",help="Full path to the file containing test samples.",type=str)
+    parser.add_argument("--trainfile",help="Full path to the file containing training samples (.csv, .parquet or .feather).",type=str)
+    parser.add_argument("--testfile",help="Full path to the file containing test samples (.csv, .parquet or .feather).",type=str)
     parser.add_argument("--niter",help="Number of hyperparameter combinatons sampled for each CV run (default=75).",type=int,default=75)
     parser.add_argument("--tree_method",help="Default = hist.",type=str,default="hist",choices=['hist','gpu_hist'])
-    parser.add_argument("--n_estimators",help="Comma-separated list for input for n_estimators xgboost paramemter.",
+    parser.add_argument("--n_estimators",help="Values of the n_estimators xgboost parameter in the hyperparameter grid (default=100 300 800).",
                         type=int,default=[100,300,800],nargs='+')
-    parser.add_argument("--max_depth",help="Comma-separated list for input for max_depth xgboost parameter.",
-                        type=int,default=[3, 5, 6, 10],nargs='+')
+    parser.add_argument("--max_depth",help="Values of the max_depth xgboost parameter in the hyperparameter grid (default=3 5 6 7).",
+                        type=int,default=[3, 5, 6, 7],nargs='+')
+    parser.add_argument("--input_mode",help="How the training data is handled (default=pandas). pandas = read the full training data into memory and search with BayesSearchCV, quantile = stream the training data in float32 chunks into an xgboost QuantileDMatrix that is quantized once and reused for all CV folds and candidates.",
+                        type=str,default="pandas",choices=['pandas','quantile'])
+    parser.add_argument("--cv_driver",help="How the hyperparameter search is run with --input_mode pandas (default=bayessearchcv). bayessearchcv = skopt.BayesSearchCV, cached = quantize the training data and define the CV folds once and evaluate the candidates concurrently (always used with --input_mode quantile).",
+                        type=str,default="bayessearchcv",choices=['bayessearchcv','cached'])
+    parser.add_argument("--n_points",help="Number of hyperparameter combinations proposed and evaluated at a time (default=2). With the cached CV driver these are trained concurrently, sharing the --nproc threads.",type=int,default=2)
+    parser.add_argument("--n_bootstraps",help="Number of bootstrap samples of the test set used for the AUC and AUPRC confidence intervals (default=2000).",type=int,default=2000)
+    parser.add_argument("--ci_percentiles",help="Lower and upper percentiles of the bootstrapped AUCs and AUPRCs reported as the confidence interval (default=5 95, i.e. 90%% CI).",
+                        type=float,default=[5,95],nargs=2)
+    parser.add_argument("--search_mode",help="Hyperparameter search mode (default=exhaustive). exhaustive = every candidate is trained with its full n_estimators on all folds, halving = successive halving over the number of boosting rounds with per-fold early stopping (uses the cached CV driver).",
+                        type=str,default="exhaustive",choices=['exhaustive','halving'])
+    parser.add_argument("--es_metric",help="Validation metric used for early stopping and ranking the candidates with --search_mode halving (default=logloss).",type=str,default="logloss",choices=['logloss','aucpr'])
+    parser.add_argument("--early_stopping_rounds",help="Number of rounds without improvement in the validation metric before training is stopped with --search_mode halving (default=20).",type=int,default=20)
+    parser.add_argument("--min_rounds",help="Number of boosting rounds in the first rung of successive halving (default=50).",type=int,default=50)
+    parser.add_argument("--halving_factor",help="Only the best 1/halving_factor of the candidates continue to the next rung, which has halving_factor times more rounds (default=3).",type=int,default=3)
+    parser.add_argument("--chunksize",help="Number of rows read at a time with --input_mode quantile (default=20000).",type=int,default=20000)
+    parser.add_argument("--profile",help="Run a sampling profiler and write the sampled call stacks to <outdir><varname>-xgbrun.profile.txt (collapsed stack format).",action='store_true')
+    parser.add_argument("--profile_interval",help="Sampling interval of the profiler in seconds (default=0.01).",type=float,default=0.01)
    
     args = parser.parse_args()
-    
+
+    #versions of the libraries used in this run
+    print(sklearn.__version__)
+    print(xgb.__version__)
+
     #set parameters for the run
     seed = 123
 
@@ -63,14 +414,16 @@ def xgboost_training_skopt():
     logging.info("output directory: "+args.outdir)
     logging.info("file containing the variable groups used by the model: "+args.allvars)
     logging.info("model name: "+args.varname)
+    #time and memory usage of each stage of the run are written next to the log file
+    stage_trace.configure(args.outdir+args.varname+'-xgbrun.trace.jsonl',args.outdir+args.varname+'-xgbrun.profile.txt' if args.profile else None,args.profile_interval)
 
     #Hyperparameter grid for XGboost
-    params = { 'max_depth': [3, 5, 6, 7],
+    params = { 'max_depth': args.max_depth,
            'learning_rate': [0.0001, 0.001, 0.01, 0.1, 0.2, 0.3],
            #'subsample': np.arange(0.5, 1.0, 0.1),
            #'colsample_bytree': np.arange(0.4, 1.0, 0.1),
            #'colsample_bylevel': np.arange(0.4, 1.0, 0.1),
-           'n_estimators': [100,300,800],
+           'n_estimators': args.n_estimators,
           'gamma': np.linspace(0,15,20),#[i for i in range(0,16)],
             'reg_alpha': [0],#[0,0.001,0.01,0.1,1,10,100],
             'reg_lambda': np.linspace(1,20,10)}#[1,10,100]}
@@ -86,144 +439,120 @@ def xgboost_training_skopt():
         r = csv.reader(infile,delimiter=',')
         for row in r: all_vars = row
         
-    #read in the training data for the current model
-    df_train = pd.read_csv(args.trainfile,usecols=all_vars,na_values=['',' '])
-    print("Dataframe read in...")
-    print("Total number of NAs: "+str(df_train.isna().sum().sum()))
-    
-    #transform training set to xgboost compatible format
-    class1_count = len(df_train.loc[df_train['COVIDVax']==1])
-    class0_count = len(df_train.loc[df_train['COVIDVax']==0])
-    X_train, y_train =  df_train.drop('COVIDVax',axis=1).values, df_train.loc[:,'COVIDVax'].values
-    del(df_train)
-    
+    if args.input_mode=='quantile':
+        #stream the training data in chunks as float32 arrays into a QuantileDMatrix
+        load_start = time()
+        with stage('read',data='train',input_mode=args.input_mode) as record:
+            dtrain = quantize_training_data(args.trainfile,all_vars,args.chunksize,['',' '],args.nproc)
+            record['rows'] = dtrain.num_row()
+        class1_count = np.sum(dtrain.get_label()==1)
+        class0_count = np.sum(dtrain.get_label()==0)
+        logging.info(args.varname+" training set loaded in "+str(time()-load_start)+" s")
+        logging.info(args.varname+" training set quantized, peak memory usage "+str(peak_memory())+" GB")
+    else:
+        #read in the training data for the current model
+        load_start = time()
+        with stage('read',data='train',input_mode=args.input_mode) as record:
+            df_train = read_columns(args.trainfile,all_vars,na_values=['',' '])
+            record['rows'] = len(df_train)
+        print("Dataframe read in...")
+        logging.info(args.varname+" training set loaded in "+str(time()-load_start)+" s")
+        print("Total number of NAs: "+str(df_train.isna().sum().sum()))
+
+        #transform training set to xgboost compatible format
+        class1_count = len(df_train.loc[df_train['COVIDVax']==1])
+        class0_count = len(df_train.loc[df_train['COVIDVax']==0])
+        with stage('convert',data='train') as record:
+            X_train, y_train =  to_matrix(df_train.drop('COVIDVax',axis=1)), df_train.loc[:,'COVIDVax'].values
+            del(df_train)
+            record['rows'] = len(y_train)
+            if args.cv_driver=='cached' or args.search_mode=='halving':
+                dtrain = xgb.QuantileDMatrix(X_train,y_train,nthread=args.nproc)
+                del(X_train)
+                del(y_train)
+
     #compute class weights
     ratio = float(class0_count)/class1_count
     logging.info(args.varname+" training set read in.")
     #initialize model and hyperparameter grid
-    xgb_model = xgb.XGBClassifier(objective="binary:logistic", random_state=42,use_label_encoder=False,eval_metric='logloss',
-                                     **{"tree_method": args.tree_method}, scale_pos_weight=ratio,n_jobs=args.nproc)
-    clf = skopt.BayesSearchCV(estimator=xgb_model, search_spaces=params, cv=5, n_iter=args.niter, random_state=seed, verbose=2, n_jobs=1,n_points=2)
-    logging.info(args.varname+" XGB model initialized.")
-    #fit the model
-    clf.fit(X_train,y_train,callback=DeltaXStopper(1e-8))
-    del(X_train)
-    del(y_train)
-    logging.info(args.varname+" XGB model trained.")
-    pickle.dump(clf,open(args.outdir+args.varname+'BayesSearchCV.pkl','wb'))
-    #save the hyperparameter optimization paths to file
-    cv_res_df = pd.DataFrame.from_dict(clf.cv_results_)
-    cv_res_df.to_csv(args.outdir+args.varname+'optimization_path.csv',index=False)
+    base_params = dict(objective="binary:logistic", random_state=42,use_label_encoder=False,eval_metric='logloss',
+                       tree_method=args.tree_method, scale_pos_weight=ratio,n_jobs=args.nproc)
+    if args.search_mode=='halving':
+        clf = HalvingDMatrixSearchCV(search_spaces=params,base_params=base_params,cv=5,n_iter=args.niter,n_points=args.n_points,random_state=seed,
+                                     min_rounds=args.min_rounds,factor=args.halving_factor,early_stopping_rounds=args.early_stopping_rounds,metric=args.es_metric)
+        logging.info(args.varname+" XGB model initialized, successive halving over "+str(clf.budgets())+" boosting rounds.")
+        #fit the model
+        with stage('cv_search',search_mode=args.search_mode,n_iter=args.niter) as record:
+            clf.fit(dtrain,callback=DeltaXStopper(1e-8))
+            record['rows'] = dtrain.num_row()
+        del(dtrain)
+    elif args.input_mode=='quantile' or args.cv_driver=='cached':
+        clf = DMatrixSearchCV(search_spaces=params,base_params=base_params,cv=5,n_iter=args.niter,n_points=args.n_points,random_state=seed)
+        logging.info(args.varname+" XGB model initialized.")
+        #fit the model
+        with stage('cv_search',search_mode=args.search_mode,n_iter=args.niter) as record:
+            clf.fit(dtrain,callback=DeltaXStopper(1e-8))
+            record['rows'] = dtrain.num_row()
+        del(dtrain)
+    else:
+        xgb_model = xgb.XGBClassifier(**base_params)
+        clf = skopt.BayesSearchCV(estimator=xgb_model, search_spaces=params, cv=5, n_iter=args.niter, random_state=seed, verbose=2, n_jobs=1,n_points=args.n_points)
+        logging.info(args.varname+" XGB model initialized.")
+        #fit the model
+        with stage('cv_search',search_mode=args.search_mode,n_iter=args.niter) as record:
+            clf.fit(X_train,y_train,callback=DeltaXStopper(1e-8))
+            record['rows'] = len(y_train)
+        #BayesSearchCV trains the candidates internally, so only the fit times of each candidate and fold are known
+        for i,candidate in enumerate(clf.cv_results_['params']):
+            log_record(dict(stage='cv_fit',params=candidate,mean_fit_time_s=clf.cv_results_['mean_fit_time'][i],std_fit_time_s=clf.cv_results_['std_fit_time'][i],
+                            mean_score_time_s=clf.cv_results_['mean_score_time'][i]))
+        del(X_train)
+        del(y_train)
+    logging.info(args.varname+" XGB model trained, peak memory usage "+str(peak_memory())+" GB")
+    with stage('write',data='search'):
+        pickle.dump(clf,open(args.outdir+args.varname+'BayesSearchCV.pkl','wb'))
+        #save the hyperparameter optimization paths to file
+        cv_res_df = pd.DataFrame.from_dict(clf.cv_results_)
+        #BayesSearchCV uses the default score of XGBClassifier
+        if 'scoring' not in cv_res_df.columns: cv_res_df['scoring'] = 'accuracy'
+        cv_res_df.to_csv(args.outdir+args.varname+'optimization_path.csv',index=False)
     #read in test data and make predictions
-    df_test = pd.read_csv(args.testfile,usecols=all_vars)
+    load_start = time()
+    with stage('read',data='test') as record:
+        df_test = read_columns(args.testfile,all_vars)
+        record['rows'] = len(df_test)
     #transform test set to xgboost compatible format
-    X_test, y_test =  df_test.drop('COVIDVax',axis=1).values, df_test.loc[:,'COVIDVax'].values
+    with stage('convert',data='test') as record:
+        X_test, y_test =  to_matrix(df_test.drop('COVIDVax',axis=1)), df_test.loc[:,'COVIDVax'].values
+        record['rows'] = len(y_test)
 
-    logging.info(args.varname+" test set read in.")
+    logging.info(args.varname+" test set read in in "+str(time()-load_start)+" s.")
     model = clf.best_estimator_
     #save best model to file
     pickle.dump(model,open(args.outdir+args.varname+"_best_xgb_model.pkl",'wb'))
     #make predictions
-    y_pred = model.predict_proba(X_test)
+    with stage('predict',data='test') as record:
+        y_pred = model.predict_proba(X_test)
+        record['rows'] = len(y_pred)
     del(X_test)
     #add predictions to df_test and save to file
-    df_test['xgb_pred_proba'] = y_pred[:,np.where(model.classes_==1)].flatten()
-    df_test.to_csv(args.outdir+args.varname+"_test_set_xgb_pred_probas.csv.gz",compression="gzip")
+    with stage('write',data='predictions') as record:
+        df_test['xgb_pred_proba'] = y_pred[:,np.where(model.classes_==1)].flatten()
+        df_test.to_csv(args.outdir+args.varname+"_test_set_xgb_pred_probas.csv.gz",compression="gzip")
+        record['rows'] = len(df_test)
     del(df_test)
     logging.info(args.varname+" predictions saved to a file.")
-    #draw N random subsamples of test set and compute the metrics for each subsample
-    N = 10
-    f = 0.75
-    all_inds = [i for i in range(0,len(y_test))]
-    ind_samples = []
-    for i in range(0,N): ind_samples.append(random.sample(all_inds,int(f*len(all_inds))))
-    #first plot precision-recall curve
-    auprcs = []
-    rand_AUprc = round(np.sum(y_test)/len(y_test),3)
-    plt.plot(np.linspace(0,1),rand_AUprc*np.ones(shape=(1,50)).flatten(),'--k',label="random, auPRC="+str(rand_AUprc))
-    for inds in ind_samples:
-        auprcs.append(average_precision_score(y_test[inds],y_pred[inds,np.where(model.classes_==1)].flatten()))
-        precision,recall,threshold = precision_recall_curve(y_test[inds],y_pred[inds,np.where(model.classes_==1)].flatten())
-        
-    if len(auprcs)==len(ind_samples): plt.plot(recall,precision,linewidth=1,c='b',label="XGBoost, AUprc="+str(round(np.mean(auprcs),3))+" ± "+str(round(np.std(auprcs),3)))
-    else: plt.plot(recall,precision,linewidth=1,c='b')
-    plt.xlabel("recall")
-    plt.ylabel("precision")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(args.outdir+args.varname+"_xgb_precision_recall_curve.png",dpi=300)
-    plt.clf()
-    logging.info(args.varname+" pr-curves computed.")
-    #receiver operator characteristics curve and AUC
-    aucs = []
-    plt.plot(np.linspace(0,1),np.linspace(0,1),'--k',label="random, AUC=0.5")
-    for inds in ind_samples:
-        aucs.append(roc_auc_score(y_test[inds],y_pred[inds,np.where(model.classes_==1)].flatten()))
-        fpr,tpr,threshold = roc_curve(y_test[inds],y_pred[inds,np.where(model.classes_==1)].flatten())
-    
-    if len(aucs)==len(ind_samples): plt.plot(fpr,tpr,linewidth=1,c='b',label="XGBoost, AUC="+str(round(np.mean(aucs),3))+" ± "+str(round(np.std(aucs),3)))
-    else: plt.plot(fpr,tpr,linewidth=1,c='b')
-
-    plt.xlabel("fpr")
-    plt.ylabel("tpr")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(args.outdir+args.varname+"_xgb_roc_curve.png",dpi=300)
-    plt.clf()
-    logging.info(args.varname+" roc-curves computed.")
-        
-    #save AUPRC and AUC values to a file
-    with open(args.outdir+args.varname+"_xgb_AUPRC_AUC.txt",'wt') as outfile:
-        w = csv.writer(outfile,delimiter=',')
-        w.writerow(['sample','AUPRC','AUC'])
-        for i in range(1,len(aucs)+1): w.writerow([i,auprcs[i-1],aucs[i-1]])
-                
-    #estimate confidence intervals for AUC and AUprc
-    n_bootstraps = 2000
-    rng_seed = 42  # control reproducibility
-    bootstrapped_AUCs = []
-    bootstrapped_AUprcs = []
-
-    rng = np.random.RandomState(rng_seed)
-    for i in range(n_bootstraps):
-        # bootstrap by sampling with replacement on the prediction indices
-        indices = rng.randint(0, len(y_pred[:,np.where(model.classes_==1)].flatten()), len(y_pred[:,np.where(model.classes_==1)].flatten()))
-        if len(np.unique(y_test[indices])) < 2:
-            # We need at least one positive and one negative sample for ROC AUC
-            # to be defined: reject the sample
-            continue
-
-        score = roc_auc_score(y_test[indices],y_pred[indices,np.where(model.classes_==1)].flatten())
-        bootstrapped_AUCs.append(score)
-        score = average_precision_score(y_test[indices],y_pred[indices,np.where(model.classes_==1)].flatten())
-        bootstrapped_AUprcs.append(score)
-    
-    sorted_AUCs = np.array(bootstrapped_AUCs)
-    sorted_AUCs.sort()
-
-    sorted_AUprcs = np.array(bootstrapped_AUprcs)
-    sorted_AUprcs.sort()
-
-    # Computing the lower and upper bound of the 90% confidence interval
-    # You can change the bounds percentiles to 0.025 and 0.975 to get
-    # a 95% confidence interval instead.
-    confidence_lower_AUC = sorted_AUCs[int(0.05 * len(sorted_AUCs))]
-    confidence_upper_AUC = sorted_AUCs[int(0.95 * len(sorted_AUCs))]
-    mean_AUC = np.mean(sorted_AUCs)
-    confidence_lower_AUprc = sorted_AUprcs[int(0.05 * len(sorted_AUprcs))]
-    confidence_upper_AUprc = sorted_AUprcs[int(0.95 * len(sorted_AUprcs))]
-    mean_AUprc = np.mean(sorted_AUprcs)
-
-    #save the confidence intervals to a file
-    with open(args.outdir+args.varname+"_xgb_AUPRC_AUC_CIs.txt",'wt') as outfile:
-        w = csv.writer(outfile,delimiter=',')
-        w.writerow(['name','AUPRC','AUC'])
-        w.writerow(['mean',mean_AUprc,mean_AUC])
-        w.writerow(['lower_CI',confidence_lower_AUprc,confidence_lower_AUC])
-        w.writerow(['upper_CI',confidence_upper_AUprc,confidence_upper_AUC])
-            
+    #precision-recall and ROC curves, AUPRC and AUC over random subsamples of the test set and bootstrap confidence intervals
+    with stage('bootstrap',n_bootstraps=args.n_bootstraps) as record:
+        results,calibration = evaluate_predictions(y_test,y_pred[:,np.where(model.classes_==1)].flatten(),args.outdir+args.varname,
+                                                   n_bootstraps=args.n_bootstraps,ci_percentiles=args.ci_percentiles,nproc=args.nproc)
+        record['rows'] = len(y_test)
+    logging.info(args.varname+" pr- and roc-curves and "+str(results['n_bootstraps'])+" bootstrap samples computed.")
+
     logging.info(args.varname+" analysis completed.")    
+    stage_trace.close()
     end = time()
     print("duration: "+str(end-start)+" s")
     
-xgboost_training_skopt()
+if __name__=='__main__':
+    xgboost_training_skopt()